@@ -0,0 +1,144 @@
+# benchmarks/coldstart.py
+"""
+Cold-start measurement: what a fresh Lambda execution environment pays
+before the first response.
+
+Each run starts a new interpreter and times, inside it:
+
+- import_ms:        importing the handler module (Lambda's INIT phase)
+- clients_ms:       creating the S3 and DynamoDB clients on first use
+- first_presign_ms: the first presigned URL (credential resolution, signer)
+
+plus process_ms, the whole process as seen from outside (interpreter
+startup included). A separate -X importtime run lists the slowest imports.
+
+    python -m benchmarks.coldstart --runs 10 --output coldstart.json
+
+No network is needed: clients are created and URLs signed locally with fake
+credentials. benchmarks/compare.py compares the phase medians of two reports.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+from .harness import percentile  # also pins fake credentials for the children
+from .run import _git_commit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_CHILD = """
+import importlib, json, sys, time
+t0 = time.perf_counter()
+importlib.import_module(sys.argv[1])
+t1 = time.perf_counter()
+from src import clients, storage
+clients.get_client("s3")
+clients.get_client("dynamodb")
+t2 = time.perf_counter()
+storage.generate_presigned_put("coldstart", "image/png")
+t3 = time.perf_counter()
+ms = lambda a, b: (b - a) * 1000
+print(json.dumps({
+    "import_ms": ms(t0, t1),
+    "clients_ms": ms(t1, t2),
+    "first_presign_ms": ms(t2, t3),
+    "modules": len(sys.modules),
+}))
+"""
+
+
+def _env() -> Dict[str, str]:
+    env = dict(os.environ, STORAGE_BACKEND="aws", PYTHONPATH=ROOT)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    return env
+
+
+def measure_once(module: str) -> Dict[str, float]:
+    start = time.perf_counter()
+    out = subprocess.run(
+        [sys.executable, "-c", _CHILD, module], cwd=ROOT, env=_env(), capture_output=True, text=True, check=True
+    )
+    row = json.loads(out.stdout.strip().splitlines()[-1])
+    row["process_ms"] = (time.perf_counter() - start) * 1000
+    return row
+
+
+def parse_importtime(stderr: str, top: int) -> List[Dict[str, Any]]:
+    """Slowest modules (by self time) from `python -X importtime` output."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append({
+            "module": name.strip(),
+            "self_ms": round(int(self_us) / 1000, 3),
+            "cumulative_ms": round(int(cumulative_us) / 1000, 3),
+        })
+    rows.sort(key=lambda r: r["self_ms"], reverse=True)
+    return rows[:top]
+
+
+def top_imports(module: str, top: int) -> List[Dict[str, Any]]:
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, env=_env(), capture_output=True, text=True, check=True,
+    )
+    return parse_importtime(out.stderr, top)
+
+
+def summarize_runs(runs: List[Dict[str, float]]) -> Dict[str, Dict[str, float]]:
+    phases: Dict[str, Dict[str, float]] = {}
+    for phase in ("import_ms", "clients_ms", "first_presign_ms", "process_ms"):
+        values = sorted(r[phase] for r in runs)
+        phases[phase] = {
+            "median_ms": round(percentile(values, 50), 3),
+            "p90_ms": round(percentile(values, 90), 3),
+            "min_ms": round(values[0], 3),
+            "max_ms": round(values[-1], 3),
+        }
+    return phases
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="src.handler", help="module Lambda imports for the handler")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--top", type=int, default=15, help="slowest imports to list")
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    measure_once(args.module)  # warm-up: writes bytecode, as the Lambda image ships it precompiled
+    runs = [measure_once(args.module) for _ in range(max(1, args.runs))]
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": {k: v for k, v in vars(args).items() if k != "output"},
+        },
+        "coldstart": {
+            "module": args.module,
+            "modules_loaded": runs[-1]["modules"],
+            "phases": summarize_runs(runs),
+            "top_imports": top_imports(args.module, args.top),
+        },
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+# benchmarks/compare.py
+"""
+Compare two benchmark reports from benchmarks.run.
+
+    python -m benchmarks.compare baseline.json candidate.json [--threshold 10]
+
+HTTP rows are matched on (scenario, table_size, concurrency) and compared on
+p99 latency and throughput; micro rows on us_per_op; cold-start phases
+(benchmarks.coldstart) on their median. Exits 1 if anything got
+worse by more than --threshold percent, so it can gate a deploy.
+"""
+import argparse
+import json
+import sys
+from typing import Any, Dict, List, Tuple
+
+
+def _load(path: str) -> Dict[str, Any]:
+    with open(path) as f:
+        return json.load(f)
+
+
+def _change(old: float, new: float) -> float:
+    return (new - old) / old * 100 if old else 0.0
+
+
+def compare(baseline: Dict[str, Any], candidate: Dict[str, Any], threshold: float) -> Tuple[List[str], bool]:
+    """
+    Returns (report lines, regressed). Positive percentages are always "worse".
+    """
+    lines: List[str] = []
+    regressed = False
+
+    def row(label: str, metric: str, old: float, new: float, worse: float) -> None:
+        nonlocal regressed
+        flag = ""
+        if worse > threshold:
+            flag = "  REGRESSION"
+            regressed = True
+        lines.append(f"{label:<48} {metric:<14} {old:>12.3f} {new:>12.3f} {worse:>+8.1f}%{flag}")
+
+    old_http = {(r["scenario"], r["table_size"], r["concurrency"]): r for r in baseline.get("http", [])}
+    for r in candidate.get("http", []):
+        key = (r["scenario"], r["table_size"], r["concurrency"])
+        if key not in old_http:
+            continue
+        o = old_http[key]
+        label = f"{key[0]} n={key[1]} c={key[2]}"
+        p99_old, p99_new = o["latency_ms"]["p99"], r["latency_ms"]["p99"]
+        row(label, "p99_ms", p99_old, p99_new, _change(p99_old, p99_new))
+        rps_old, rps_new = o["throughput_rps"], r["throughput_rps"]
+        row(label, "rps", rps_old, rps_new, -_change(rps_old, rps_new))
+
+    old_micro = {r["name"]: r for r in baseline.get("micro", [])}
+    for r in candidate.get("micro", []):
+        o = old_micro.get(r["name"])
+        if o:
+            row(r["name"], "us_per_op", o["us_per_op"], r["us_per_op"], _change(o["us_per_op"], r["us_per_op"]))
+
+    old_cold = baseline.get("coldstart", {}).get("phases", {})
+    for phase, r in candidate.get("coldstart", {}).get("phases", {}).items():
+        o = old_cold.get(phase)
+        if o:
+            row(f"coldstart {phase}", "median_ms", o["median_ms"], r["median_ms"], _change(o["median_ms"], r["median_ms"]))
+    return lines, regressed
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10.0, help="allowed slowdown in percent")
+    args = parser.parse_args(argv)
+
+    lines, regressed = compare(_load(args.baseline), _load(args.candidate), args.threshold)
+    print(f"{'case':<48} {'metric':<14} {'baseline':>12} {'candidate':>12} {'worse':>9}")
+    print("\n".join(lines))
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,242 @@
+# benchmarks/harness.py
+"""
+Shared pieces of the benchmark suite: in-process AWS stand-ins (moto, or
+the memory storage backend), a minimal ASGI client for driving server.app without a network hop, and
+latency statistics.
+
+Import this module before anything from src: it pins the environment
+(fake credentials, no AWS_ENDPOINT_URL) that src.config and the boto3
+clients read at import time.
+"""
+import asyncio
+import json
+import math
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+os.environ.pop("AWS_ENDPOINT_URL", None)
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+os.environ.setdefault("AWS_REGION", "us-east-1")
+os.environ.setdefault("AWS_DEFAULT_REGION", os.environ["AWS_REGION"])
+# the local derivative worker would compete with the measured requests
+os.environ.setdefault("DERIVATIVES_LOCAL_QUEUE", "false")
+# load tests deliberately exceed any per-user budget
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+
+from moto import mock_aws  # noqa: E402  must patch botocore before src builds clients
+
+
+def start_aws():
+    """
+    Start moto and create the bucket and tables the service expects,
+    mirroring create_resources.sh. Returns the active mock (call .stop()).
+    """
+    mock = mock_aws()
+    mock.start()
+
+    import boto3
+    from src import config
+
+    boto3.client("s3", region_name=config.AWS_REGION).create_bucket(Bucket=config.S3_BUCKET)
+    ddb = boto3.client("dynamodb", region_name=config.AWS_REGION)
+
+    def gsi(name: str, hash_key: str) -> Dict[str, Any]:
+        return {
+            "IndexName": name,
+            "KeySchema": [
+                {"AttributeName": hash_key, "KeyType": "HASH"},
+                {"AttributeName": "created_at", "KeyType": "RANGE"},
+            ],
+            "Projection": {"ProjectionType": "ALL"},
+        }
+
+    ddb.create_table(
+        TableName=config.DDB_TABLE,
+        BillingMode="PAY_PER_REQUEST",
+        KeySchema=[{"AttributeName": "image_id", "KeyType": "HASH"}],
+        AttributeDefinitions=[
+            {"AttributeName": name, "AttributeType": "S"}
+            for name in ("image_id", "user_id", "content_type", "status", "created_at")
+        ],
+        GlobalSecondaryIndexes=[
+            gsi(config.DDB_USER_INDEX, "user_id"),
+            gsi(config.DDB_CONTENT_TYPE_INDEX, "content_type"),
+            gsi(config.DDB_STATUS_INDEX, "status"),
+        ],
+    )
+    ddb.create_table(
+        TableName=config.DDB_TAG_TABLE,
+        BillingMode="PAY_PER_REQUEST",
+        KeySchema=[
+            {"AttributeName": "tag", "KeyType": "HASH"},
+            {"AttributeName": "sort_key", "KeyType": "RANGE"},
+        ],
+        AttributeDefinitions=[
+            {"AttributeName": "tag", "AttributeType": "S"},
+            {"AttributeName": "sort_key", "AttributeType": "S"},
+        ],
+    )
+    ddb.create_table(
+        TableName=config.DDB_CONTENT_TABLE,
+        BillingMode="PAY_PER_REQUEST",
+        KeySchema=[{"AttributeName": "sha256", "KeyType": "HASH"}],
+        AttributeDefinitions=[{"AttributeName": "sha256", "AttributeType": "S"}],
+    )
+    ddb.create_table(
+        TableName=config.DDB_USAGE_TABLE,
+        BillingMode="PAY_PER_REQUEST",
+        KeySchema=[{"AttributeName": "user_id", "KeyType": "HASH"}],
+        AttributeDefinitions=[{"AttributeName": "user_id", "AttributeType": "S"}],
+    )
+    return mock
+
+
+class _MemoryRun:
+    """Swaps storage onto a fresh MemoryBackend until stop()."""
+
+    def __init__(self):
+        from src import storage
+        from src.memory_backend import MemoryBackend
+
+        self._storage = storage
+        self._previous = storage.backend
+        storage.use_backend(MemoryBackend())
+
+    def stop(self) -> None:
+        self._storage.use_backend(self._previous)
+
+
+def start_backend(name: str):
+    """
+    "moto": botocore against moto (exercises serialisation and signing);
+    "memory": src.memory_backend (handler code only). Returns an object with .stop().
+    """
+    if name == "moto":
+        return start_aws()
+    if name == "memory":
+        return _MemoryRun()
+    raise ValueError(f"unknown benchmark backend {name!r}")
+
+
+async def asgi_request(
+    app,
+    method: str,
+    path: str,
+    query: Optional[Dict[str, Any]] = None,
+    body: Any = None,
+) -> Tuple[int, bytes]:
+    """
+    Send one HTTP request straight into an ASGI app. Returns (status, body).
+    """
+    raw = json.dumps(body).encode() if body is not None else b""
+    headers = [(b"content-type", b"application/json")] if body is not None else []
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": urlencode(query or {}).encode(),
+        "root_path": "",
+        "headers": headers + [(b"content-length", str(len(raw)).encode())],
+        "client": ("bench", 0),
+        "server": ("bench", 80),
+    }
+    sent = False
+    status = 0
+    chunks: List[bytes] = []
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": raw, "more_body": False}
+        await asyncio.Event().wait()  # never disconnects
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return status, b"".join(chunks)
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies: List[float], elapsed: float, errors: int) -> Dict[str, Any]:
+    ordered = sorted(latencies)
+    ms = lambda v: round(v * 1000, 3)  # noqa: E731
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 4),
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            "mean": ms(sum(ordered) / len(ordered)) if ordered else 0.0,
+            "p50": ms(percentile(ordered, 50)),
+            "p90": ms(percentile(ordered, 90)),
+            "p99": ms(percentile(ordered, 99)),
+            "max": ms(ordered[-1]) if ordered else 0.0,
+        },
+    }
+
+
+async def run_load(
+    call: Callable[[int], Awaitable[int]],
+    requests: int,
+    concurrency: int,
+    ok: Tuple[int, ...] = (200, 201),
+) -> Dict[str, Any]:
+    """
+    Issue `requests` calls (call(i) returns an HTTP status) with at most
+    `concurrency` in flight, and summarize their latencies.
+    """
+    latencies: List[float] = []
+    errors = 0
+    next_index = 0
+
+    async def worker():
+        nonlocal errors, next_index
+        while next_index < requests:
+            i = next_index
+            next_index += 1
+            start = time.perf_counter()
+            status = await call(i)
+            latencies.append(time.perf_counter() - start)
+            if status not in ok:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - start, errors)
+
+
+def micro(fn: Callable[[], Any], iterations: int) -> Dict[str, Any]:
+    """
+    Time `iterations` back-to-back calls of fn (after a short warm-up).
+    """
+    for _ in range(min(100, iterations)):
+        fn()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    elapsed = time.perf_counter() - start
+    return {
+        "iterations": iterations,
+        "us_per_op": round(elapsed / iterations * 1e6, 3),
+        "ops_per_s": round(iterations / elapsed, 1),
+    }
@@ -0,0 +1,224 @@
+# benchmarks/run.py
+"""
+Load-test and micro-benchmark suite.
+
+Drives server.app in-process (ASGI, no sockets) against moto or the memory
+storage backend, for each table size and concurrency level, and times the
+hot helpers in isolation.
+Everything is written as one JSON document so runs can be diffed with
+benchmarks/compare.py.
+
+    python -m benchmarks.run --table-sizes 100,1000 --concurrency 1,8 \
+        --requests 200 --output bench.json
+
+Numbers are only comparable between runs on the same machine and backend:
+moto stands in for AWS, so absolute latencies measure our code plus moto
+(botocore included), not the network; --backend memory leaves out botocore
+too, which isolates the handler code for profiling.
+"""
+import argparse
+import asyncio
+import json
+import platform
+import subprocess
+import sys
+import uuid
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Any, Dict, List
+
+from . import harness  # pins the AWS environment before src is imported
+
+USERS = [f"user-{n}" for n in range(10)]
+CONTENT_TYPES = ["image/png", "image/jpeg", "image/webp"]
+TAGS = ["red", "green", "blue", "grey"]
+
+
+def _item(n: int) -> Dict[str, Any]:
+    return {
+        "image_id": str(uuid.uuid4()),
+        "user_id": USERS[n % len(USERS)],
+        "filename": f"img-{n}.png",
+        "content_type": CONTENT_TYPES[n % len(CONTENT_TYPES)],
+        "size": 1000 + n,
+        "tags": [TAGS[n % len(TAGS)]],
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def seed(count: int) -> List[str]:
+    """Write `count` metadata items (plus tag entries). Returns their ids."""
+    from src import storage
+
+    items = [_item(n) for n in range(count)]
+    for chunk in storage._chunks(items, 500):
+        unwritten = storage.batch_create_metadata(chunk)
+        unindexed = storage.index_tags(chunk)
+        if unwritten or unindexed:
+            raise RuntimeError("seeding left unprocessed items")
+    return [i["image_id"] for i in items]
+
+
+def http_scenarios(app, ids: List[str]) -> Dict[str, Any]:
+    """name -> (call(i) -> status coroutine, accepted statuses)"""
+    req = harness.asgi_request
+
+    async def upload(i):
+        body = {"user_id": USERS[i % len(USERS)], "filename": f"n{i}.png", "content_type": "image/png", "size": 1234}
+        return (await req(app, "POST", "/v1/images", body=body))[0]
+
+    async def get(i):
+        return (await req(app, "GET", f"/v1/images/{ids[i % len(ids)]}"))[0]
+
+    async def download(i):
+        return (await req(app, "GET", f"/v1/images/{ids[i % len(ids)]}", {"download": "true"}))[0]
+
+    def lister(key, values):
+        async def call(i):
+            return (await req(app, "GET", "/v1/images", {key: values[i % len(values)], "limit": 20}))[0]
+        return call
+
+    async def list_all(i):
+        return (await req(app, "GET", "/v1/images", {"limit": 20}))[0]
+
+    return {
+        "request_upload": (upload, (201,)),
+        "get_image": (get, (200,)),
+        "get_image_download": (download, (200,)),
+        "list_by_user": (lister("user_id", USERS), (200,)),
+        "list_by_content_type": (lister("content_type", CONTENT_TYPES), (200,)),
+        "list_by_tag": (lister("tag", TAGS), (200,)),
+        "list_unfiltered": (list_all, (200,)),
+    }
+
+
+async def _delete_run(app, requests: int, concurrency: int) -> Dict[str, Any]:
+    # fresh victims so the table size stays constant across levels
+    victims = seed(requests)
+
+    async def delete(i):
+        return (await harness.asgi_request(app, "DELETE", f"/v1/images/{victims[i]}"))[0]
+
+    return await harness.run_load(delete, requests, concurrency, ok=(200,))
+
+
+def run_http(
+    table_sizes: List[int], levels: List[int], requests: int, only: List[str], backend: str = "moto"
+) -> List[Dict[str, Any]]:
+    results = []
+    for size in table_sizes:
+        mock = harness.start_backend(backend)
+        try:
+            from src import storage
+            import server
+
+            storage.metadata_cache.clear()
+            storage.presign_cache.clear()
+            ids = seed(size)
+            scenarios = http_scenarios(server.app, ids)
+            for concurrency in levels:
+                for name, (call, ok) in scenarios.items():
+                    if only and name not in only:
+                        continue
+                    summary = asyncio.run(harness.run_load(call, requests, concurrency, ok=ok))
+                    results.append({"scenario": name, "table_size": size, "concurrency": concurrency, **summary})
+                    _progress(results[-1])
+                if not only or "delete_image" in only:
+                    summary = asyncio.run(_delete_run(server.app, requests, concurrency))
+                    results.append({"scenario": "delete_image", "table_size": size, "concurrency": concurrency, **summary})
+                    _progress(results[-1])
+        finally:
+            mock.stop()
+    return results
+
+
+def run_micro(iterations: int, backend: str = "moto") -> List[Dict[str, Any]]:
+    mock = harness.start_backend(backend)
+    try:
+        from src import handler, serialization, storage
+
+        item = {**_item(1), "size": Decimal(1234), "ratio": Decimal("1.5")}
+        page = {"items": [{**_item(n), "size": Decimal(n)} for n in range(100)], "next_cursor": "x" * 40}
+        stdlib = lambda obj: json.dumps(obj, default=serialization._default)  # noqa: E731
+
+        def presign_get_uncached():
+            storage.presign_cache.invalidate("images/bench")
+            storage.generate_presigned_get("bench")
+
+        cases = {
+            "response_item": lambda: handler._response(200, item),
+            "response_list_page_100": lambda: handler._response(200, page),
+            "stdlib_json_list_page_100": lambda: stdlib(page),
+            "presign_put": lambda: storage.generate_presigned_put("bench", "image/png"),
+            "presign_get_uncached": presign_get_uncached,
+            "presign_get_cached": lambda: storage.generate_presigned_get("bench"),
+            "cursor_roundtrip": lambda: storage.decode_cursor(storage.encode_cursor({"image_id": "bench"})),
+        }
+        results = []
+        for name, fn in cases.items():
+            n = iterations if not name.startswith("presign") else max(1, iterations // 10)
+            results.append({"name": name, **harness.micro(fn, n)})
+            _progress(results[-1])
+        return results
+    finally:
+        mock.stop()
+
+
+def _progress(row: Dict[str, Any]) -> None:
+    print(json.dumps(row), file=sys.stderr)
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def _ints(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--table-sizes", type=_ints, default=[100, 1000])
+    parser.add_argument("--concurrency", type=_ints, default=[1, 8])
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario and level")
+    parser.add_argument("--micro-iterations", type=int, default=20000)
+    parser.add_argument("--backend", choices=("moto", "memory"), default="moto")
+    parser.add_argument("--scenarios", default="", help="comma-separated subset of HTTP scenarios")
+    parser.add_argument("--skip-http", action="store_true")
+    parser.add_argument("--skip-micro", action="store_true")
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": {k: v for k, v in vars(args).items() if k != "output"},
+        },
+        "http": [] if args.skip_http else run_http(
+            args.table_sizes,
+            args.concurrency,
+            args.requests,
+            [s for s in args.scenarios.split(",") if s],
+            args.backend,
+        ),
+        "micro": [] if args.skip_micro else run_micro(args.micro_iterations, args.backend),
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,6 +4,9 @@ ENDPOINT="http://localhost:4566"
 REGION="us-east-1"
 BUCKET_NAME="montycloud-images"
 TABLE_NAME="Images"
+TAG_TABLE_NAME="ImageTags"
+CONTENT_TABLE_NAME="ImageContent"
+USAGE_TABLE_NAME="ImageUsage"
 
 echo "Creating S3 bucket: $BUCKET_NAME"
 aws --endpoint-url=$ENDPOINT s3 mb s3://$BUCKET_NAME --region $REGION || true
@@ -11,11 +14,37 @@ aws --endpoint-url=$ENDPOINT s3 mb s3://$BUCKET_NAME --region $REGION || true
 echo "Creating DynamoDB table: $TABLE_NAME"
 aws --endpoint-url=$ENDPOINT dynamodb create-table \
   --table-name $TABLE_NAME \
-  --attribute-definitions AttributeName=image_id,AttributeType=S AttributeName=user_id,AttributeType=S AttributeName=created_at,AttributeType=S \
+  --attribute-definitions AttributeName=image_id,AttributeType=S AttributeName=user_id,AttributeType=S AttributeName=created_at,AttributeType=S AttributeName=content_type,AttributeType=S AttributeName=status,AttributeType=S \
   --key-schema AttributeName=image_id,KeyType=HASH \
   --provisioned-throughput ReadCapacityUnits=5,WriteCapacityUnits=5 \
   --global-secondary-indexes '[
-    {"IndexName":"gsi_user_created","KeySchema":[{"AttributeName":"user_id","KeyType":"HASH"},{"AttributeName":"created_at","KeyType":"RANGE"}],"Projection":{"ProjectionType":"ALL"},"ProvisionedThroughput":{"ReadCapacityUnits":5,"WriteCapacityUnits":5}}
+    {"IndexName":"gsi_user_created","KeySchema":[{"AttributeName":"user_id","KeyType":"HASH"},{"AttributeName":"created_at","KeyType":"RANGE"}],"Projection":{"ProjectionType":"ALL"},"ProvisionedThroughput":{"ReadCapacityUnits":5,"WriteCapacityUnits":5}},
+    {"IndexName":"gsi_content_type_created","KeySchema":[{"AttributeName":"content_type","KeyType":"HASH"},{"AttributeName":"created_at","KeyType":"RANGE"}],"Projection":{"ProjectionType":"ALL"},"ProvisionedThroughput":{"ReadCapacityUnits":5,"WriteCapacityUnits":5}},
+    {"IndexName":"gsi_status_created","KeySchema":[{"AttributeName":"status","KeyType":"HASH"},{"AttributeName":"created_at","KeyType":"RANGE"}],"Projection":{"ProjectionType":"ALL"},"ProvisionedThroughput":{"ReadCapacityUnits":5,"WriteCapacityUnits":5}}
   ]' --region $REGION || true
 
+echo "Creating DynamoDB table: $TAG_TABLE_NAME"
+aws --endpoint-url=$ENDPOINT dynamodb create-table \
+  --table-name $TAG_TABLE_NAME \
+  --attribute-definitions AttributeName=tag,AttributeType=S AttributeName=sort_key,AttributeType=S \
+  --key-schema AttributeName=tag,KeyType=HASH AttributeName=sort_key,KeyType=RANGE \
+  --provisioned-throughput ReadCapacityUnits=5,WriteCapacityUnits=5 \
+  --region $REGION || true
+
+echo "Creating DynamoDB table: $CONTENT_TABLE_NAME"
+aws --endpoint-url=$ENDPOINT dynamodb create-table \
+  --table-name $CONTENT_TABLE_NAME \
+  --attribute-definitions AttributeName=sha256,AttributeType=S \
+  --key-schema AttributeName=sha256,KeyType=HASH \
+  --provisioned-throughput ReadCapacityUnits=5,WriteCapacityUnits=5 \
+  --region $REGION || true
+
+echo "Creating DynamoDB table: $USAGE_TABLE_NAME"
+aws --endpoint-url=$ENDPOINT dynamodb create-table \
+  --table-name $USAGE_TABLE_NAME \
+  --attribute-definitions AttributeName=user_id,AttributeType=S \
+  --key-schema AttributeName=user_id,KeyType=HASH \
+  --provisioned-throughput ReadCapacityUnits=5,WriteCapacityUnits=5 \
+  --region $REGION || true
+
 echo "Resources created (or already existed)."
@@ -26,6 +26,14 @@ resource "aws_s3_bucket" "images" {
   versioning {
     enabled = true
   }
+
+  # safety net behind the abort_stale_uploads job
+  lifecycle_rule {
+    id                                     = "abort-incomplete-multipart"
+    enabled                                = true
+    prefix                                 = "images/"
+    abort_incomplete_multipart_upload_days = 2
+  }
 }
 
 resource "aws_dynamodb_table" "images" {
@@ -47,10 +55,74 @@ resource "aws_dynamodb_table" "images" {
     type = "S"
   }
 
+  attribute {
+    name = "content_type"
+    type = "S"
+  }
+
+  attribute {
+    name = "status"
+    type = "S"
+  }
+
   global_secondary_index {
     name               = "gsi_user_created"
     hash_key           = "user_id"
     range_key          = "created_at"
     projection_type    = "ALL"
   }
+
+  global_secondary_index {
+    name               = "gsi_content_type_created"
+    hash_key           = "content_type"
+    range_key          = "created_at"
+    projection_type    = "ALL"
+  }
+
+  # pending/complete uploads by age, walked by src/reaper.py
+  global_secondary_index {
+    name               = "gsi_status_created"
+    hash_key           = "status"
+    range_key          = "created_at"
+    projection_type    = "ALL"
+  }
+}
+
+# Tag fan-out index: one item per (tag, image) pair, sort_key = "<created_at>#<image_id>"
+resource "aws_dynamodb_table" "image_tags" {
+  name           = var.ddb_tag_table
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "tag"
+  range_key      = "sort_key"
+  attribute {
+    name = "tag"
+    type = "S"
+  }
+
+  attribute {
+    name = "sort_key"
+    type = "S"
+  }
+}
+
+# Content-hash index for deduplication: sha256 -> shared object key + refcount
+resource "aws_dynamodb_table" "image_content" {
+  name           = var.ddb_content_table
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "sha256"
+  attribute {
+    name = "sha256"
+    type = "S"
+  }
+}
+
+# Per-user usage counters: image count, bytes and per-content-type counts
+resource "aws_dynamodb_table" "image_usage" {
+  name           = var.ddb_usage_table
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "user_id"
+  attribute {
+    name = "user_id"
+    type = "S"
+  }
 }
@@ -10,3 +10,15 @@ variable "ddb_table" {
   type    = string
   default = "Images"
 }
+variable "ddb_tag_table" {
+  type    = string
+  default = "ImageTags"
+}
+variable "ddb_content_table" {
+  type    = string
+  default = "ImageContent"
+}
+variable "ddb_usage_table" {
+  type    = string
+  default = "ImageUsage"
+}
@@ -1,75 +1,222 @@
 # server.py
-import json
+import time
+from collections.abc import Iterator
+from botocore.exceptions import ClientError
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 import uvicorn
 
-from src.handler import (
+from src.async_handler import (
     request_upload,
+    batch_request_upload,
+    request_multipart_upload,
     complete_upload,
     get_image,
     delete_image_handler,
     list_images_handler,
+    stream_images_handler,
+    batch_get_images,
+    batch_delete_images,
+    get_usage_handler,
 )
+from src.config import DERIVATIVES_LOCAL_QUEUE, RATE_LIMIT_ENABLED
+from src.derivatives import LocalDerivativeQueue
+from src.handler import RESERVED_PATH_SEGMENTS
+from src.ratelimit import AdmissionControl
+from src import metrics, storage
+
+derivative_queue = LocalDerivativeQueue()
 
 app = FastAPI(title="MontyCloud Image Service - Local HTTP Adapter")
 
 
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+    # whole request as seen by the adapter: handler + body encoding + hops
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        metrics.http_seconds.observe(
+            time.perf_counter() - start,
+            method=request.method,
+            route=getattr(route, "path", "unmatched"),
+            status=status,
+        )
+
+
+if RATE_LIMIT_ENABLED:
+    # added last, so it runs first: rejected requests never reach the
+    # latency middleware or the router
+    app.add_middleware(AdmissionControl)
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 def _unwrap_handler_response(res: dict):
     """
     Convert handler-style response {"statusCode": int, "body": "<json>"} into
-    a FastAPI JSONResponse (with parsed JSON body and proper status code).
+    a FastAPI response with the proper status code. The handler body is
+    already JSON text, so it is passed through as-is rather than parsed and
+    re-encoded.
     """
     status = int(res.get("statusCode", 500))
     body = res.get("body")
-    # body may already be dict (if someone changed handler). ensure it's a dict/object.
-    if isinstance(body, str):
-        try:
-            body_obj = json.loads(body)
-        except Exception:
-            # if it's plain string, return as {"message": body}
-            body_obj = {"message": body}
-    else:
-        body_obj = body
-    return JSONResponse(content=body_obj, status_code=status)
+    headers = res.get("headers") or {}
+    if isinstance(body, Iterator):
+        # streaming handler: pass chunks straight through without buffering
+        media_type = headers.get("Content-Type", "application/octet-stream")
+        return StreamingResponse(body, status_code=status, media_type=media_type)
+    if status == 304:
+        # If-None-Match hit: only the validators go back, no body
+        return Response(status_code=304, headers=headers)
+    if isinstance(body, (str, bytes)):
+        return Response(content=body, status_code=status, media_type="application/json", headers=headers)
+    # body may already be dict (if someone changed handler).
+    return JSONResponse(content=body, status_code=status)
+
+
+def _reserved_segment(image_id: str):
+    # /v1/images/batch etc. only take POST; without this a GET or DELETE
+    # would fall through to the {image_id} routes below
+    if image_id in RESERVED_PATH_SEGMENTS:
+        return JSONResponse(content={"error": "method not allowed"}, status_code=405, headers={"Allow": "POST"})
+    return None
 
 
 @app.post("/v1/images")
 async def upload(req: dict):
-    event = {"body": json.dumps(req)}
-    res = request_upload(event)
+    event = {"body": req}
+    res = await request_upload(event)
+    return _unwrap_handler_response(res)
+
+
+@app.post("/v1/images/batch")
+async def batch_upload(req: dict):
+    event = {"body": req}
+    res = await batch_request_upload(event)
+    return _unwrap_handler_response(res)
+
+
+@app.post("/v1/images/batch-get")
+async def batch_get(req: dict):
+    event = {"body": req}
+    res = await batch_get_images(event)
+    return _unwrap_handler_response(res)
+
+
+@app.post("/v1/images/batch-delete")
+async def batch_delete(req: dict):
+    event = {"body": req}
+    res = await batch_delete_images(event)
+    return _unwrap_handler_response(res)
+
+
+@app.post("/v1/images/multipart")
+async def multipart_upload(req: dict):
+    event = {"body": req}
+    res = await request_multipart_upload(event)
     return _unwrap_handler_response(res)
 
 
 @app.post("/v1/images/{image_id}/complete")
-async def complete(image_id: str):
-    event = {"pathParameters": {"image_id": image_id}}
-    res = complete_upload(event)
+async def complete(image_id: str, request: Request):
+    # optional body: {"parts": [{"part_number", "etag"}]} for multipart uploads
+    raw = await request.body()
+    event = {"pathParameters": {"image_id": image_id}, "body": raw.decode("utf-8") if raw else None}
+    res = await complete_upload(event)
+    if DERIVATIVES_LOCAL_QUEUE and res.get("statusCode") in (200, 202):
+        # no S3 event notifications locally: hand off to the in-process worker
+        # (which also verifies uploads too large for the request, the 202s)
+        derivative_queue.submit(image_id)
     return _unwrap_handler_response(res)
 
 
 @app.get("/v1/images/{image_id}")
 async def view(image_id: str, request: Request):
+    reserved = _reserved_segment(image_id)
+    if reserved is not None:
+        return reserved
     qs = dict(request.query_params)
-    event = {"pathParameters": {"image_id": image_id}, "queryStringParameters": qs}
-    res = get_image(event)
+    event = {"pathParameters": {"image_id": image_id}, "queryStringParameters": qs, "headers": dict(request.headers)}
+    res = await get_image(event)
     return _unwrap_handler_response(res)
 
 
 @app.get("/v1/images")
 async def list_images(request: Request):
     qs = dict(request.query_params)
-    event = {"queryStringParameters": qs}
-    res = list_images_handler(event)
+    event = {"queryStringParameters": qs, "headers": dict(request.headers)}
+    if qs.get("format") == "ndjson":
+        res = await stream_images_handler(event)
+    else:
+        res = await list_images_handler(event)
     return _unwrap_handler_response(res)
 
 
 @app.delete("/v1/images/{image_id}")
 async def delete(image_id: str):
+    reserved = _reserved_segment(image_id)
+    if reserved is not None:
+        return reserved
     event = {"pathParameters": {"image_id": image_id}}
-    res = delete_image_handler(event)
+    res = await delete_image_handler(event)
+    return _unwrap_handler_response(res)
+
+
+@app.get("/v1/users/{user_id}/usage")
+async def usage(user_id: str):
+    event = {"pathParameters": {"user_id": user_id}}
+    res = await get_usage_handler(event)
     return _unwrap_handler_response(res)
 
 
+if storage.backend.name == "memory":
+    # STORAGE_BACKEND=memory: presigned URLs point here (MEMORY_PRESIGN_BASE_URL),
+    # so browsers and curl can upload/download exactly as they would with S3
+
+    def _memory_error(e: ClientError):
+        code = e.response.get("Error", {}).get("Code", "")
+        status = 404 if code in ("NoSuchKey", "NoSuchUpload", "404") else 400
+        return JSONResponse(content={"error": code}, status_code=status)
+
+    @app.put("/_memory/{bucket}/{key:path}")
+    async def memory_put(bucket: str, key: str, request: Request):
+        s3 = storage.backend.s3
+        query = dict(request.query_params)
+        content_type = request.headers.get("content-type")
+        if not s3.verify_presigned_url("PUT", bucket, key, query, content_type):
+            return JSONResponse(content={"error": "SignatureDoesNotMatch"}, status_code=403)
+        body = await request.body()
+        try:
+            if "uploadId" in query:
+                resp = s3.upload_part(
+                    Bucket=bucket, Key=key, UploadId=query["uploadId"], PartNumber=int(query["partNumber"]), Body=body
+                )
+            else:
+                resp = s3.put_object(Bucket=bucket, Key=key, Body=body, ContentType=content_type)
+        except ClientError as e:
+            return _memory_error(e)
+        return Response(status_code=200, headers={"ETag": resp["ETag"]})
+
+    @app.get("/_memory/{bucket}/{key:path}")
+    async def memory_get(bucket: str, key: str, request: Request):
+        s3 = storage.backend.s3
+        if not s3.verify_presigned_url("GET", bucket, key, dict(request.query_params)):
+            return JSONResponse(content={"error": "SignatureDoesNotMatch"}, status_code=403)
+        try:
+            obj = s3.get_object(Bucket=bucket, Key=key)
+        except ClientError as e:
+            return _memory_error(e)
+        return Response(content=obj["Body"].read(), media_type=obj["ContentType"], headers={"ETag": obj["ETag"]})
+
+
 if __name__ == "__main__":
     uvicorn.run("server:app", host="0.0.0.0", port=8080, log_level="info")
@@ -0,0 +1,57 @@
+# src/async_handler.py
+"""
+Async variants of the Lambda-style handlers for the HTTP adapter.
+
+Each handler runs on the async_storage I/O pool, so its whole sequence of
+blocking AWS calls happens off the event loop with a single thread hop. The
+sync handlers in src.handler stay the single source of truth for behaviour
+and remain the Lambda entry points.
+"""
+from . import handler
+from .async_storage import run_io
+
+
+async def request_upload(event, context=None):
+    return await run_io(handler.request_upload, event, context)
+
+
+async def batch_request_upload(event, context=None):
+    return await run_io(handler.batch_request_upload, event, context)
+
+
+async def request_multipart_upload(event, context=None):
+    return await run_io(handler.request_multipart_upload, event, context)
+
+
+async def complete_upload(event, context=None):
+    return await run_io(handler.complete_upload, event, context)
+
+
+async def get_image(event, context=None):
+    return await run_io(handler.get_image, event, context)
+
+
+async def list_images_handler(event, context=None):
+    return await run_io(handler.list_images_handler, event, context)
+
+
+async def stream_images_handler(event, context=None):
+    # only the eager first page runs here; later pages are pulled by the
+    # response iterator (Starlette iterates sync bodies in its threadpool)
+    return await run_io(handler.stream_images_handler, event, context)
+
+
+async def delete_image_handler(event, context=None):
+    return await run_io(handler.delete_image_handler, event, context)
+
+
+async def batch_get_images(event, context=None):
+    return await run_io(handler.batch_get_images, event, context)
+
+
+async def batch_delete_images(event, context=None):
+    return await run_io(handler.batch_delete_images, event, context)
+
+
+async def get_usage_handler(event, context=None):
+    return await run_io(handler.get_usage_handler, event, context)
@@ -0,0 +1,45 @@
+# src/async_storage.py
+"""
+The bounded I/O thread pool behind the async HTTP adapter.
+
+boto3 is blocking, so blocking work runs on a dedicated pool (IO_THREADS)
+instead of on the event loop. Awaiting run_io keeps the loop free to serve
+other requests while DynamoDB/S3 round trips are in flight. src.async_handler
+submits whole handlers here, so one request makes a single thread hop.
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from .config import IO_THREADS
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=IO_THREADS, thread_name_prefix="aws-io")
+    return _executor
+
+
+def shutdown(wait: bool = True) -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait)
+            _executor = None
+
+
+async def run_io(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """
+    Run a blocking callable on the I/O pool and await its result.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(fn, *args, **kwargs))
+
@@ -0,0 +1,68 @@
+# src/backends.py
+"""
+Storage backends: where src.storage gets its S3 client and DynamoDB tables.
+
+storage only talks to the objects handed out here, so index routing, cursors,
+batching and caching are shared by every backend:
+
+- "aws":    lazily created boto3 clients from src.clients (AWS, LocalStack
+            or moto); tables go through the low-level DynamoDB client
+            (src.dynamo) rather than the heavier resource layer
+- "memory": src.memory_backend, dict-backed tables and object store inside
+            the process, for fast tests, benchmarks and local dev
+
+The backend is chosen with STORAGE_BACKEND; storage.use_backend() swaps it
+at runtime.
+"""
+from typing import Any
+
+from .clients import LazyClient
+from .config import STORAGE_BACKEND
+from .dynamo import DocumentClient, Table
+
+
+class StorageBackend:
+    """
+    An S3 client and DynamoDB Table objects, i.e. the subset of the boto3 API
+    that src.storage calls. Errors surface as botocore ClientError.
+    """
+
+    name = "base"
+
+    @property
+    def s3(self) -> Any:
+        raise NotImplementedError
+
+    def table(self, name: str) -> Any:
+        raise NotImplementedError
+
+
+class AwsBackend(StorageBackend):
+    """
+    Nothing is created up front: the clients are built on their first call
+    and then shared by every warm invocation.
+    """
+
+    name = "aws"
+
+    def __init__(self):
+        self._s3 = LazyClient("s3")
+        self._dynamodb = DocumentClient(LazyClient("dynamodb"))
+
+    @property
+    def s3(self) -> Any:
+        return self._s3
+
+    def table(self, name: str) -> Table:
+        return Table(name, self._dynamodb)
+
+
+def get_backend(name: str = STORAGE_BACKEND) -> StorageBackend:
+    if name == "aws":
+        return AwsBackend()
+    if name == "memory":
+        # imported lazily: deployed code never needs it
+        from .memory_backend import MemoryBackend
+
+        return MemoryBackend()
+    raise ValueError(f"unknown storage backend {name!r} (expected 'aws' or 'memory')")
@@ -0,0 +1,223 @@
+# src/clients.py
+"""
+Shared, tuned boto3 clients.
+
+All S3/DynamoDB clients come from one boto3 Session with a single botocore
+Config (pool size, timeouts, adaptive retries, TCP keepalive) taken from
+src.config, and are created once per service under a lock so threads share
+the same connection pool. LazyClient defers that creation to the first call,
+so importing a module that holds clients costs nothing. Per-client
+connection usage is tracked via botocore events and exposed through
+pool_stats(); per-operation latency, errors, retries and throttles are
+recorded into src.metrics by the same hooks.
+"""
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import boto3
+from botocore.config import Config
+
+from .config import (
+    AWS_REGION,
+    AWS_MAX_POOL_CONNECTIONS,
+    AWS_CONNECT_TIMEOUT,
+    AWS_READ_TIMEOUT,
+    AWS_RETRY_MODE,
+    AWS_MAX_ATTEMPTS,
+    AWS_TCP_KEEPALIVE,
+)
+from . import metrics
+
+_lock = threading.Lock()
+_session: Optional[boto3.session.Session] = None
+_clients: Dict[str, Any] = {}
+_pool_metrics: Dict[str, "PoolMetrics"] = {}
+
+
+def _endpoint() -> Optional[str]:
+    return os.environ.get("AWS_ENDPOINT_URL")  # e.g. http://localstack:4566 or http://localhost:4566
+
+
+def client_config() -> Config:
+    return Config(
+        region_name=AWS_REGION,
+        max_pool_connections=AWS_MAX_POOL_CONNECTIONS,
+        connect_timeout=AWS_CONNECT_TIMEOUT,
+        read_timeout=AWS_READ_TIMEOUT,
+        retries={"mode": AWS_RETRY_MODE, "max_attempts": AWS_MAX_ATTEMPTS},
+        tcp_keepalive=AWS_TCP_KEEPALIVE,
+    )
+
+
+class PoolMetrics:
+    """
+    Counts HTTP attempts per service: total, currently in flight and the peak.
+    A peak close to max_pool_connections means the pool is the bottleneck.
+    """
+
+    def __init__(self, service: str, max_pool_connections: int):
+        self.service = service
+        self.max_pool_connections = max_pool_connections
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._lock = threading.Lock()
+
+    def attach(self, events) -> None:
+        events.register("before-send", self._on_send)
+        events.register("response-received", self._on_response)
+        events.register("before-call", _on_call_start)
+        events.register("after-call", _on_call_end)
+        events.register("after-call-error", _on_call_error)
+
+    def _on_send(self, **kwargs: Any) -> None:
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def _on_response(self, exception=None, **kwargs: Any) -> None:
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+            if exception is not None:
+                self.errors += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "max_pool_connections": self.max_pool_connections,
+                "requests": self.requests,
+                "errors": self.errors,
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+            }
+
+
+THROTTLE_CODES = frozenset({
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "RequestThrottled",
+    "RequestLimitExceeded",
+    "ProvisionedThroughputExceededException",
+    "TooManyRequestsException",
+    "SlowDown",
+})
+
+
+# one before-call / after-call pair per API call, retries included; the
+# start time travels in botocore's per-call context dict
+def _on_call_start(model=None, context=None, **kwargs: Any) -> None:
+    if context is not None and model is not None:
+        context["metrics"] = (model.service_model.service_name, model.name, time.perf_counter())
+
+
+def _on_call_end(parsed=None, context=None, **kwargs: Any) -> None:
+    started = (context or {}).get("metrics")
+    if not started:
+        return
+    service, operation, start = started
+    metrics.record_aws_call(service, operation, time.perf_counter() - start)
+    parsed = parsed or {}
+    retries = (parsed.get("ResponseMetadata") or {}).get("RetryAttempts") or 0
+    if retries:
+        metrics.aws_retries.inc(retries, service=service, operation=operation)
+    code = (parsed.get("Error") or {}).get("Code")
+    if code:
+        metrics.aws_call_errors.inc(service=service, operation=operation, code=code)
+        if code in THROTTLE_CODES:
+            metrics.aws_throttles.inc(service=service, operation=operation)
+    if "ScannedCount" in parsed:
+        metrics.ddb_items_scanned.inc(parsed["ScannedCount"], operation=operation)
+        metrics.ddb_items_returned.inc(parsed.get("Count", 0), operation=operation)
+
+
+def _on_call_error(exception=None, context=None, **kwargs: Any) -> None:
+    # transport failures (timeouts, connection errors) after all retries
+    started = (context or {}).get("metrics")
+    if not started:
+        return
+    service, operation, start = started
+    metrics.record_aws_call(service, operation, time.perf_counter() - start)
+    metrics.aws_call_errors.inc(service=service, operation=operation, code=type(exception).__name__)
+
+
+def _get_session() -> boto3.session.Session:
+    # the default boto3 session is not safe to build clients from concurrently
+    global _session
+    if _session is None:
+        _session = boto3.session.Session(region_name=AWS_REGION)
+    return _session
+
+
+def _kwargs() -> Dict[str, Any]:
+    kwargs: Dict[str, Any] = {"region_name": AWS_REGION, "config": client_config()}
+    endpoint = _endpoint()
+    if endpoint:
+        kwargs["endpoint_url"] = endpoint
+    return kwargs
+
+
+def _metrics_for(service: str) -> "PoolMetrics":
+    if service not in _pool_metrics:
+        _pool_metrics[service] = PoolMetrics(service, AWS_MAX_POOL_CONNECTIONS)
+    return _pool_metrics[service]
+
+
+def get_client(service: str):
+    """
+    Return the process-wide client for `service` (thread-safe, created once).
+    """
+    client = _clients.get(service)
+    if client is None:
+        with _lock:
+            client = _clients.get(service)
+            if client is None:
+                client = _get_session().client(service, **_kwargs())
+                _metrics_for(service).attach(client.meta.events)
+                _clients[service] = client
+    return client
+
+
+class LazyClient:
+    """
+    Module-level handle for get_client(service) that creates the client on
+    first attribute access; warm invocations reuse the process-wide client.
+    """
+
+    __slots__ = ("service",)
+
+    def __init__(self, service: str):
+        self.service = service
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(get_client(self.service), name)
+
+    def __repr__(self) -> str:
+        return f"LazyClient({self.service!r})"
+
+
+def pool_stats() -> Dict[str, Dict[str, Any]]:
+    return {name: m.snapshot() for name, m in list(_pool_metrics.items())}
+
+
+def _pool_families():
+    stats = pool_stats()
+    families = []
+    for key, type_, help_ in (
+        ("requests", "counter", "HTTP attempts sent by the client"),
+        ("errors", "counter", "HTTP attempts that failed at the transport level"),
+        ("in_flight", "gauge", "HTTP attempts currently in flight"),
+        ("peak_in_flight", "gauge", "Highest concurrent HTTP attempts seen"),
+        ("max_pool_connections", "gauge", "Configured connection pool size"),
+    ):
+        name = f"aws_pool_{key}" + ("_total" if type_ == "counter" else "")
+        samples = [(name, {"client": client}, snap[key]) for client, snap in stats.items()]
+        families.append((name, type_, help_, samples))
+    return families
+
+
+metrics.registry.add_collector(_pool_families)
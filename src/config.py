@@ -4,4 +4,100 @@ S3_BUCKET = os.environ.get("S3_BUCKET", "montycloud-images")
 DDB_TABLE = os.environ.get("DDB_TABLE", "Images")
 PRESIGNED_PUT_EXPIRES = int(os.environ.get("PRESIGNED_PUT_EXPIRES", "300"))
 PRESIGNED_GET_EXPIRES = int(os.environ.get("PRESIGNED_GET_EXPIRES", "300"))
-MAX_UPLOAD_SIZE = int(os.environ.get("MAX_UPLOAD_SIZE", 10 * 1024 * 1024))
+MAX_UPLOAD_SIZE = int(os.environ.get("MAX_UPLOAD_SIZE", 512 * 1024 * 1024))
+LIST_DEFAULT_LIMIT = int(os.environ.get("LIST_DEFAULT_LIMIT", "20"))
+LIST_MAX_LIMIT = int(os.environ.get("LIST_MAX_LIMIT", "100"))
+# DynamoDB reads one list page may make while topping up a filtered page; past
+# it the page comes back short with a next_cursor
+LIST_MAX_ROUND_TRIPS = int(os.environ.get("LIST_MAX_ROUND_TRIPS", "5"))
+DDB_USER_INDEX = os.environ.get("DDB_USER_INDEX", "gsi_user_created")
+DDB_CONTENT_TYPE_INDEX = os.environ.get("DDB_CONTENT_TYPE_INDEX", "gsi_content_type_created")
+# upload status (pending/complete) + created_at; the reaper's way to old pending items
+DDB_STATUS_INDEX = os.environ.get("DDB_STATUS_INDEX", "gsi_status_created")
+# fan-out table: one item per (tag, image) pair, keyed tag + "<created_at>#<image_id>"
+DDB_TAG_TABLE = os.environ.get("DDB_TAG_TABLE", "ImageTags")
+# content-hash index: sha256 -> shared S3 object + reference count
+DDB_CONTENT_TABLE = os.environ.get("DDB_CONTENT_TABLE", "ImageContent")
+# per-user counters (image count, bytes, per content type); one item per user_id
+DDB_USAGE_TABLE = os.environ.get("DDB_USAGE_TABLE", "ImageUsage")
+# per-user upload quotas enforced against those counters at request time (0 = unlimited)
+USER_QUOTA_IMAGES = int(os.environ.get("USER_QUOTA_IMAGES", "0"))
+USER_QUOTA_BYTES = int(os.environ.get("USER_QUOTA_BYTES", "0"))
+DEDUP_ENABLED = os.environ.get("DEDUP_ENABLED", "true").lower() in ("1", "true", "yes")
+SCAN_PAGE_SIZE = int(os.environ.get("SCAN_PAGE_SIZE", "500"))
+SCAN_SEGMENTS = int(os.environ.get("SCAN_SEGMENTS", "4"))
+SCAN_MAX_SEGMENTS = int(os.environ.get("SCAN_MAX_SEGMENTS", "64"))
+SCAN_MAX_WORKERS = int(os.environ.get("SCAN_MAX_WORKERS", "8"))
+METADATA_CACHE_SIZE = int(os.environ.get("METADATA_CACHE_SIZE", "1024"))
+METADATA_CACHE_TTL = float(os.environ.get("METADATA_CACHE_TTL", "60"))
+PRESIGNED_GET_CACHE_SIZE = int(os.environ.get("PRESIGNED_GET_CACHE_SIZE", "4096"))
+# a cached GET URL is reused until it has less than this many seconds left
+PRESIGNED_GET_REUSE_MARGIN = int(os.environ.get("PRESIGNED_GET_REUSE_MARGIN", "60"))
+# Cache-Control max-age of metadata and list responses; at 0 clients revalidate
+# on every poll, which a matching If-None-Match answers with a bodiless 304
+METADATA_MAX_AGE = int(os.environ.get("METADATA_MAX_AGE", "0"))
+# worker threads backing the async adapter (bounds concurrent blocking AWS calls)
+IO_THREADS = int(os.environ.get("IO_THREADS", "32"))
+# botocore client tuning (shared by every S3/DynamoDB client)
+AWS_MAX_POOL_CONNECTIONS = int(os.environ.get("AWS_MAX_POOL_CONNECTIONS", "50"))
+AWS_CONNECT_TIMEOUT = float(os.environ.get("AWS_CONNECT_TIMEOUT", "2"))
+AWS_READ_TIMEOUT = float(os.environ.get("AWS_READ_TIMEOUT", "5"))
+AWS_RETRY_MODE = os.environ.get("AWS_RETRY_MODE", "adaptive")
+AWS_MAX_ATTEMPTS = int(os.environ.get("AWS_MAX_ATTEMPTS", "5"))
+AWS_TCP_KEEPALIVE = os.environ.get("AWS_TCP_KEEPALIVE", "true").lower() in ("1", "true", "yes")
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "500"))
+DDB_BATCH_MAX_RETRIES = int(os.environ.get("DDB_BATCH_MAX_RETRIES", "5"))
+BATCH_DELETE_MAX_ITEMS = int(os.environ.get("BATCH_DELETE_MAX_ITEMS", "10000"))
+# derivative variants as "name:max_edge_px,..."; stored under derived/<image_id>/
+DERIVATIVE_SIZES = os.environ.get("DERIVATIVE_SIZES", "thumb:128,medium:512")
+DERIVATIVE_FORMAT = os.environ.get("DERIVATIVE_FORMAT", "JPEG")
+DERIVATIVE_QUALITY = int(os.environ.get("DERIVATIVE_QUALITY", "85"))
+DERIVATIVE_WORKERS = int(os.environ.get("DERIVATIVE_WORKERS", str(os.cpu_count() or 1)))
+# render in the calling process instead of a process pool; the default under
+# Lambda, where multiprocessing cannot start (no /dev/shm for its semaphores)
+DERIVATIVE_IN_PROCESS = os.environ.get(
+    "DERIVATIVE_IN_PROCESS", "true" if os.environ.get("AWS_LAMBDA_FUNCTION_NAME") else "false"
+).lower() in ("1", "true", "yes")
+# run the pipeline in-process after complete_upload (local stand-in for S3 events)
+DERIVATIVES_LOCAL_QUEUE = os.environ.get("DERIVATIVES_LOCAL_QUEUE", "true").lower() in ("1", "true", "yes")
+# objects are read server-side in chunks of this size into one reused buffer
+STREAM_CHUNK_SIZE = int(os.environ.get("STREAM_CHUNK_SIZE", 1024 * 1024))
+# complete_upload hashes objects up to this size itself; larger ones (GiB-scale
+# multipart uploads would outrun API Gateway's 29 s) answer 202 and are verified
+# by the S3 event pipeline (src.derivatives) instead
+INLINE_VERIFY_MAX_BYTES = int(os.environ.get("INLINE_VERIFY_MAX_BYTES", 256 * 1024 * 1024))
+# multipart uploads: parts are at least MULTIPART_MIN_PART_SIZE (S3 minimum is 5 MiB)
+MULTIPART_MAX_UPLOAD_SIZE = int(os.environ.get("MULTIPART_MAX_UPLOAD_SIZE", 5 * 1024 ** 3))
+MULTIPART_MIN_PART_SIZE = int(os.environ.get("MULTIPART_MIN_PART_SIZE", 8 * 1024 * 1024))
+PRESIGNED_PART_EXPIRES = int(os.environ.get("PRESIGNED_PART_EXPIRES", "3600"))
+# incomplete multipart uploads older than this are aborted by abort_stale_uploads
+MULTIPART_STALE_AFTER = int(os.environ.get("MULTIPART_STALE_AFTER", 24 * 3600))
+# "aws" (boto3: AWS, LocalStack or moto) or "memory" (in-process, see src/memory_backend.py)
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "aws").lower()
+# presigned URLs of the memory backend point here (served by server.py's /_memory routes)
+MEMORY_PRESIGN_BASE_URL = os.environ.get("MEMORY_PRESIGN_BASE_URL", "http://localhost:8080/_memory")
+# pending items older than this are reaped if their object never arrived; the
+# default outlives every presigned upload URL plus a margin for slow PUTs
+PENDING_REAP_AFTER = int(
+    os.environ.get("PENDING_REAP_AFTER", max(PRESIGNED_PUT_EXPIRES, PRESIGNED_PART_EXPIRES) + 900)
+)
+REAPER_PAGE_SIZE = int(os.environ.get("REAPER_PAGE_SIZE", "100"))
+REAPER_HEAD_WORKERS = int(os.environ.get("REAPER_HEAD_WORKERS", "16"))
+# metadata deletes per second, so a large backlog does not eat the table's write capacity
+REAPER_MAX_DELETES_PER_SECOND = float(os.environ.get("REAPER_MAX_DELETES_PER_SECOND", "50"))
+# admission control in the HTTP adapter (src/ratelimit.py): a token bucket per
+# user (RATE_LIMIT_RATE requests/s, bursts up to RATE_LIMIT_BURST), a wider one
+# per client address that a user_id cannot reset, and a cap on requests in
+# flight; all reject with 429 instead of queueing
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+RATE_LIMIT_RATE = float(os.environ.get("RATE_LIMIT_RATE", "20"))
+RATE_LIMIT_BURST = float(os.environ.get("RATE_LIMIT_BURST", "40"))
+RATE_LIMIT_IP_RATE = float(os.environ.get("RATE_LIMIT_IP_RATE", "100"))
+RATE_LIMIT_IP_BURST = float(os.environ.get("RATE_LIMIT_IP_BURST", "200"))
+RATE_LIMIT_MAX_INFLIGHT = int(os.environ.get("RATE_LIMIT_MAX_INFLIGHT", str(IO_THREADS * 4)))
+# proxies in front of the adapter (1 behind an ALB): the client address is the
+# entry that many places from the right of X-Forwarded-For; 0 trusts no header
+RATE_LIMIT_TRUSTED_PROXY_HOPS = int(os.environ.get("RATE_LIMIT_TRUSTED_PROXY_HOPS", "0"))
+# "memory" (per process) or "package.module:factory" for a shared backend
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_MAX_KEYS = int(os.environ.get("RATE_LIMIT_MAX_KEYS", "100000"))
@@ -0,0 +1,226 @@
+# src/derivatives.py
+"""
+Derivative (thumbnail / resized variant) pipeline.
+
+When an upload completes, the original is fetched, every configured variant
+is rendered on a process pool (resizing is CPU-bound), the results are written
+under derived/<image_id>/ and their keys recorded on the metadata item as
+`variants`. Triggered by S3 ObjectCreated events (handle_s3_event) or, for
+local runs, by LocalDerivativeQueue.
+
+Uploads too large to verify inside their complete request are verified
+here first (handler.verify_upload), so they turn complete before their
+variants are rendered.
+
+Under Lambda (DERIVATIVE_IN_PROCESS) rendering happens in the invoking
+process: one event at a time per container, and no process pool can start
+there. Images whose variants are already recorded are skipped, so S3 event
+redeliveries and repeated completes do not render twice.
+"""
+import io
+import logging
+import queue
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Set, Union
+from urllib.parse import unquote_plus
+
+from .config import (
+    DERIVATIVE_SIZES,
+    DERIVATIVE_FORMAT,
+    DERIVATIVE_QUALITY,
+    DERIVATIVE_WORKERS,
+    DERIVATIVE_IN_PROCESS,
+)
+from . import storage
+from .handler import verify_upload
+from .metrics import timed_handler
+
+logger = logging.getLogger("derivatives")
+logger.setLevel(logging.INFO)
+
+_FORMATS = {
+    "JPEG": ("jpg", "image/jpeg"),
+    "PNG": ("png", "image/png"),
+    "WEBP": ("webp", "image/webp"),
+}
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def parse_sizes(spec: str) -> Dict[str, int]:
+    """
+    Parse "thumb:128,medium:512" into {"thumb": 128, "medium": 512}.
+    """
+    sizes: Dict[str, int] = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        name, _, edge = part.partition(":")
+        if not name or not edge.isdigit() or int(edge) < 1:
+            raise ValueError(f"invalid derivative size {part!r}")
+        sizes[name] = int(edge)
+    return sizes
+
+
+def variant_key(image_id: str, name: str, fmt: str = DERIVATIVE_FORMAT) -> str:
+    return f"derived/{image_id}/{name}.{_FORMATS[fmt][0]}"
+
+
+def render_variants(
+    source: Union[bytes, str],
+    sizes: Dict[str, int],
+    fmt: str,
+    quality: int,
+) -> Dict[str, bytes]:
+    """
+    Decode once and encode one downscaled copy per size (max edge, aspect kept).
+    `source` is the encoded image or a path to it. Runs in a worker process, so
+    it only takes and returns plain bytes/strings.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as src:
+        # JPEG can decode straight at a reduced scale, saving most of the pixels
+        src.draft("RGB", (max(sizes.values()), max(sizes.values())))
+        src = ImageOps.exif_transpose(src)
+        if fmt == "JPEG" and src.mode not in ("RGB", "L"):
+            src = src.convert("RGB")
+        out: Dict[str, bytes] = {}
+        # largest first so each smaller variant resamples from fewer pixels
+        current = src
+        for name, edge in sorted(sizes.items(), key=lambda kv: -kv[1]):
+            current = current.copy()
+            current.thumbnail((edge, edge))
+            buf = io.BytesIO()
+            current.save(buf, format=fmt, quality=quality)
+            out[name] = buf.getvalue()
+        return out
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(max_workers=DERIVATIVE_WORKERS)
+    return _pool
+
+
+def _render(source: str, sizes: Dict[str, int]) -> Dict[str, bytes]:
+    if DERIVATIVE_IN_PROCESS:
+        return render_variants(source, sizes, DERIVATIVE_FORMAT, DERIVATIVE_QUALITY)
+    return get_pool().submit(render_variants, source, sizes, DERIVATIVE_FORMAT, DERIVATIVE_QUALITY).result()
+
+
+def generate_derivatives(image_id: str, sizes: Optional[Dict[str, int]] = None) -> Dict[str, str]:
+    """
+    Build and store every variant of image_id. Returns {name: s3_key}; when
+    the item already records all of them, nothing is rendered again. Only
+    complete (verified) images are rendered; anything else returns {}.
+    """
+    sizes = sizes if sizes is not None else parse_sizes(DERIVATIVE_SIZES)
+    if not sizes:
+        return {}
+    item = storage.get_item(image_id)
+    if not item or item.get("status") != "complete":
+        logger.info("not rendering derivatives of %s: not complete", image_id)
+        return {}
+    wanted = {name: variant_key(image_id, name) for name in sizes}
+    recorded = item.get("variants") or {}
+    if all(recorded.get(name) == key for name, key in wanted.items()):
+        logger.info("derivatives of %s already exist", image_id)
+        return wanted
+    # deduplicated images read the shared object recorded on their item
+    source_key = storage.object_key(item)
+    # spool the original to disk in chunks so large uploads never sit in memory
+    with tempfile.NamedTemporaryFile(prefix=f"{image_id}-") as spool:
+        for chunk in storage.iter_object_chunks(source_key):
+            spool.write(chunk)
+        spool.flush()
+        rendered = _render(spool.name, sizes)
+    content_type = _FORMATS[DERIVATIVE_FORMAT][1]
+    variants: Dict[str, str] = {}
+    for name, blob in rendered.items():
+        key = variant_key(image_id, name)
+        storage.put_object_bytes(key, blob, content_type)
+        variants[name] = key
+    storage.set_variants(image_id, variants)
+    logger.info("generated %d derivatives for %s", len(variants), image_id)
+    return variants
+
+
+def process_upload(image_id: str) -> Dict[str, str]:
+    """
+    Everything an uploaded object triggers: verification of the upload (the
+    event may beat the client's complete call, whatever the size), then its
+    variants once the item is complete.
+    """
+    res = verify_upload(image_id, large_only=False)
+    if res is not None and res["statusCode"] != 200:
+        raise RuntimeError(f"verification of {image_id} failed: {res['body']}")
+    return generate_derivatives(image_id)
+
+
+def image_ids_from_s3_event(event: Dict[str, Any]) -> List[str]:
+    ids = []
+    for record in event.get("Records") or []:
+        key = unquote_plus(((record.get("s3") or {}).get("object") or {}).get("key", ""))
+        if key.startswith("images/") and "/" not in key[len("images/"):]:
+            ids.append(key[len("images/"):])
+    return ids
+
+
+@timed_handler
+def handle_s3_event(event, context=None):
+    """
+    Lambda entry point for S3 ObjectCreated notifications on images/.
+    """
+    processed, failed = [], []
+    for image_id in image_ids_from_s3_event(event):
+        try:
+            process_upload(image_id)
+            processed.append(image_id)
+        except Exception:
+            logger.exception("derivative generation failed for %s", image_id)
+            failed.append(image_id)
+    return {"processed": processed, "failed": failed}
+
+
+class LocalDerivativeQueue:
+    """
+    In-process stand-in for the S3 event -> worker path: a background thread
+    drains submitted image_ids and runs generate_derivatives for each. An id
+    already waiting or in progress is not queued a second time.
+    """
+
+    def __init__(self):
+        self._queue: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._queued: Set[str] = set()
+
+    def submit(self, image_id: str) -> None:
+        with self._lock:
+            if image_id in self._queued:
+                return
+            self._queued.add(image_id)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="derivatives", daemon=True)
+                self._thread.start()
+        self._queue.put(image_id)
+
+    def join(self) -> None:
+        self._queue.join()
+
+    def _run(self) -> None:
+        while True:
+            image_id = self._queue.get()
+            try:
+                process_upload(image_id)
+            except Exception:
+                logger.exception("derivative generation failed for %s", image_id)
+            finally:
+                with self._lock:
+                    self._queued.discard(image_id)
+                self._queue.task_done()
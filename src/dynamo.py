@@ -0,0 +1,155 @@
+# src/dynamo.py
+"""
+boto3-Table-shaped access to DynamoDB on top of the low-level client.
+
+src.storage is written against the resource layer's conventions: plain
+Python values in and out, and Attr/Key objects for conditions. The resource
+layer itself is the slowest thing to build on a cold start (a second model
+to load, classes generated at runtime, per-call shape walking), so this
+module offers the same calls on the plain client and does the conversion
+with boto3's TypeSerializer/TypeDeserializer and ConditionExpressionBuilder.
+"""
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+from boto3.dynamodb.conditions import ConditionBase, ConditionExpressionBuilder
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+_CONDITIONS = ("KeyConditionExpression", "ConditionExpression", "FilterExpression")
+_MAPS = ("Item", "Key", "ExclusiveStartKey")
+
+
+def serialize(values: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: _serializer.serialize(v) for k, v in values.items()}
+
+
+def deserialize(values: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: _deserializer.deserialize(v) for k, v in values.items()}
+
+
+def _request(params: Dict[str, Any]) -> Dict[str, Any]:
+    """Python-typed request parameters -> wire parameters."""
+    params = dict(params)
+    names = dict(params.get("ExpressionAttributeNames") or {})
+    values = dict(params.get("ExpressionAttributeValues") or {})
+    # one builder per request keeps generated placeholders unique across conditions
+    builder = ConditionExpressionBuilder()
+    for name in _CONDITIONS:
+        condition = params.get(name)
+        if isinstance(condition, ConditionBase):
+            built = builder.build_expression(condition, is_key_condition=name == "KeyConditionExpression")
+            params[name] = built.condition_expression
+            names.update(built.attribute_name_placeholders)
+            values.update(built.attribute_value_placeholders)
+    if names:
+        params["ExpressionAttributeNames"] = names
+    if values:
+        params["ExpressionAttributeValues"] = serialize(values)
+    for name in _MAPS:
+        if name in params:
+            params[name] = serialize(params[name])
+    return params
+
+
+def _write_requests(requests: List[Dict[str, Any]], convert) -> List[Dict[str, Any]]:
+    out = []
+    for request in requests:
+        if "PutRequest" in request:
+            out.append({"PutRequest": {"Item": convert(request["PutRequest"]["Item"])}})
+        else:
+            out.append({"DeleteRequest": {"Key": convert(request["DeleteRequest"]["Key"])}})
+    return out
+
+
+def _key_spec(spec: Dict[str, Any], convert) -> Dict[str, Any]:
+    return dict(spec, Keys=[convert(k) for k in spec.get("Keys", [])])
+
+
+class DocumentClient:
+    """
+    The low-level client with Python values instead of attribute-value maps,
+    like a resource's meta.client. Responses keep their other fields
+    (Count, ScannedCount, ConsumedCapacity, ResponseMetadata).
+    """
+
+    def __init__(self, client: Any):
+        self.client = client
+
+    def _call(self, operation: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        resp = getattr(self.client, operation)(**_request(params))
+        for name in ("Item", "Attributes", "LastEvaluatedKey"):
+            if name in resp:
+                resp[name] = deserialize(resp[name])
+        if "Items" in resp:
+            resp["Items"] = [deserialize(i) for i in resp["Items"]]
+        return resp
+
+    def put_item(self, **params: Any) -> Dict[str, Any]:
+        return self._call("put_item", params)
+
+    def get_item(self, **params: Any) -> Dict[str, Any]:
+        return self._call("get_item", params)
+
+    def update_item(self, **params: Any) -> Dict[str, Any]:
+        return self._call("update_item", params)
+
+    def delete_item(self, **params: Any) -> Dict[str, Any]:
+        return self._call("delete_item", params)
+
+    def query(self, **params: Any) -> Dict[str, Any]:
+        return self._call("query", params)
+
+    def scan(self, **params: Any) -> Dict[str, Any]:
+        return self._call("scan", params)
+
+    def batch_write_item(self, RequestItems: Dict[str, List[Dict[str, Any]]], **params: Any) -> Dict[str, Any]:
+        items = {t: _write_requests(reqs, serialize) for t, reqs in RequestItems.items()}
+        resp = self.client.batch_write_item(RequestItems=items, **params)
+        if resp.get("UnprocessedItems"):
+            resp["UnprocessedItems"] = {
+                t: _write_requests(reqs, deserialize) for t, reqs in resp["UnprocessedItems"].items()
+            }
+        return resp
+
+    def batch_get_item(self, RequestItems: Dict[str, Dict[str, Any]], **params: Any) -> Dict[str, Any]:
+        items = {t: _key_spec(spec, serialize) for t, spec in RequestItems.items()}
+        resp = self.client.batch_get_item(RequestItems=items, **params)
+        if "Responses" in resp:
+            resp["Responses"] = {t: [deserialize(i) for i in found] for t, found in resp["Responses"].items()}
+        if resp.get("UnprocessedKeys"):
+            resp["UnprocessedKeys"] = {
+                t: _key_spec(spec, deserialize) for t, spec in resp["UnprocessedKeys"].items()
+            }
+        return resp
+
+
+class Table:
+    """
+    The subset of boto3's Table used by src.storage, bound to one table name.
+    Batch calls go through table.meta.client, as with the resource.
+    """
+
+    def __init__(self, name: str, client: DocumentClient):
+        self.name = self.table_name = name
+        self.meta = SimpleNamespace(client=client)
+
+    def put_item(self, **params: Any) -> Dict[str, Any]:
+        return self.meta.client.put_item(TableName=self.name, **params)
+
+    def get_item(self, **params: Any) -> Dict[str, Any]:
+        return self.meta.client.get_item(TableName=self.name, **params)
+
+    def update_item(self, **params: Any) -> Dict[str, Any]:
+        return self.meta.client.update_item(TableName=self.name, **params)
+
+    def delete_item(self, **params: Any) -> Dict[str, Any]:
+        return self.meta.client.delete_item(TableName=self.name, **params)
+
+    def query(self, **params: Any) -> Dict[str, Any]:
+        return self.meta.client.query(TableName=self.name, **params)
+
+    def scan(self, **params: Any) -> Dict[str, Any]:
+        return self.meta.client.scan(TableName=self.name, **params)
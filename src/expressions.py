@@ -0,0 +1,309 @@
+# src/expressions.py
+"""
+Evaluator for the slice of the DynamoDB expression language that src.storage
+emits, used by the in-memory backend.
+
+Conditions (condition, filter and key-condition expressions): comparisons,
+AND/OR with parentheses, attribute_exists, attribute_not_exists and contains.
+Updates: SET name = :value, ADD name :number, REMOVE name. Operands are
+top-level attribute names or #name placeholders, and :value placeholders.
+Anything else is an ExpressionError, so a new expression shape in storage
+fails loudly in the tests instead of being evaluated loosely.
+
+boto3 condition objects (Attr/Key) are compiled to the same string form with
+boto3's own ConditionExpressionBuilder, so both spellings share one evaluator.
+"""
+import re
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
+
+from boto3.dynamodb.conditions import ConditionBase, ConditionExpressionBuilder
+from boto3.dynamodb.types import Binary
+
+_MISSING = object()
+
+_TOKEN = re.compile(
+    r"\s*(?:"
+    r"(?P<op><>|<=|>=|=|<|>|\(|\)|,)"
+    r"|(?P<name>#[A-Za-z0-9_]+)"
+    r"|(?P<value>:[A-Za-z0-9_]+)"
+    r"|(?P<word>[A-Za-z_][A-Za-z0-9_\-]*)"
+    r")"
+)
+_COMPARATORS = {"=", "<>", "<", "<=", ">", ">="}
+
+
+class ExpressionError(ValueError):
+    """Malformed or unsupported expression, or an unknown placeholder."""
+
+
+def _tokenize(text: str) -> List[Tuple[str, str]]:
+    tokens, pos = [], 0
+    text = text.rstrip()
+    while pos < len(text):
+        m = _TOKEN.match(text, pos)
+        if not m or m.end() == pos:
+            raise ExpressionError(f"unexpected input at {pos}: {text[pos:pos + 20]!r}")
+        pos = m.end()
+        kind = m.lastgroup
+        tokens.append((kind, m.group(kind)))
+    return tokens
+
+
+class _Parser:
+    def __init__(self, text: str, names: Optional[Dict[str, str]], values: Optional[Dict[str, Any]]):
+        self.tokens = _tokenize(text)
+        self.pos = 0
+        self.names = names or {}
+        self.values = values or {}
+
+    # -- token helpers -----------------------------------------------------
+    def peek(self, offset: int = 0) -> Tuple[Optional[str], Optional[str]]:
+        i = self.pos + offset
+        return self.tokens[i] if i < len(self.tokens) else (None, None)
+
+    def next(self) -> Tuple[str, str]:
+        if self.pos >= len(self.tokens):
+            raise ExpressionError("unexpected end of expression")
+        tok = self.tokens[self.pos]
+        self.pos += 1
+        return tok
+
+    def accept_op(self, op: str) -> bool:
+        if self.peek() == ("op", op):
+            self.pos += 1
+            return True
+        return False
+
+    def expect_op(self, op: str) -> None:
+        if not self.accept_op(op):
+            raise ExpressionError(f"expected {op!r} at token {self.pos}")
+
+    def accept_word(self, word: str) -> bool:
+        kind, text = self.peek()
+        if kind == "word" and text.upper() == word:
+            self.pos += 1
+            return True
+        return False
+
+    def done(self) -> bool:
+        return self.pos >= len(self.tokens)
+
+    # -- operands ----------------------------------------------------------
+    def name(self) -> str:
+        kind, text = self.next()
+        if kind == "name":
+            if text not in self.names:
+                raise ExpressionError(f"undefined attribute name {text}")
+            return self.names[text]
+        if kind == "word":
+            return text
+        raise ExpressionError(f"expected attribute name, got {text!r}")
+
+    def value(self) -> Any:
+        kind, text = self.next()
+        if kind != "value":
+            raise ExpressionError(f"expected :value, got {text!r}")
+        if text not in self.values:
+            raise ExpressionError(f"undefined attribute value {text}")
+        return self.values[text]
+
+    def operand(self):
+        """Returns a callable item -> value (or _MISSING)."""
+        if self.peek()[0] == "value":
+            v = self.value()
+            return lambda item: v
+        name = self.name()
+        return lambda item: item.get(name, _MISSING)
+
+    # -- conditions --------------------------------------------------------
+    def condition(self):
+        left = self._and()
+        while self.accept_word("OR"):
+            right = self._and()
+            left = (lambda a, b: lambda item: a(item) or b(item))(left, right)
+        return left
+
+    def _and(self):
+        left = self._primary()
+        while self.accept_word("AND"):
+            right = self._primary()
+            left = (lambda a, b: lambda item: a(item) and b(item))(left, right)
+        return left
+
+    def _primary(self):
+        if self.accept_op("("):
+            inner = self.condition()
+            self.expect_op(")")
+            return inner
+        kind, text = self.peek()
+        if kind == "word" and self.peek(1) == ("op", "("):
+            func = _FUNCTIONS.get(text.lower())
+            if func is None:
+                raise ExpressionError(f"unsupported function {text}")
+            self.pos += 2
+            name = self.name()
+            arg = None
+            if self.accept_op(","):
+                arg = self.operand()
+            self.expect_op(")")
+            return func(name, arg)
+
+        left = self.operand()
+        kind, text = self.next()
+        if kind != "op" or text not in _COMPARATORS:
+            raise ExpressionError(f"expected comparison at token {self.pos - 1}")
+        right = self.operand()
+        return lambda item: _compare(text, left(item), right(item))
+
+
+def _type_code(value: Any) -> Optional[str]:
+    if isinstance(value, bool):
+        return "BOOL"
+    if value is None:
+        return "NULL"
+    if isinstance(value, str):
+        return "S"
+    if isinstance(value, (int, Decimal)):
+        return "N"
+    if isinstance(value, (bytes, Binary)):
+        return "B"
+    if isinstance(value, list):
+        return "L"
+    if isinstance(value, dict):
+        return "M"
+    if isinstance(value, (set, frozenset)):
+        return "SS"
+    return None
+
+
+def _compare(op: str, left: Any, right: Any) -> bool:
+    if left is _MISSING or right is _MISSING:
+        return False
+    left_type, right_type = _type_code(left), _type_code(right)
+    if op in ("=", "<>"):
+        equal = left_type == right_type and left == right
+        return equal if op == "=" else not equal
+    if left_type != right_type or left_type not in ("S", "N", "B"):
+        return False
+    return {"<": left < right, "<=": left <= right, ">": left > right, ">=": left >= right}[op]
+
+
+def _exists(name, arg):
+    return lambda item: name in item
+
+
+def _not_exists(name, arg):
+    return lambda item: name not in item
+
+
+def _contains(name, arg):
+    if arg is None:
+        raise ExpressionError("contains requires an operand")
+
+    def check(item):
+        value, needle = item.get(name, _MISSING), arg(item)
+        if isinstance(value, str):
+            return isinstance(needle, str) and needle in value
+        if isinstance(value, (list, set, frozenset)):
+            return needle in value
+        return False
+    return check
+
+
+_FUNCTIONS = {
+    "attribute_exists": _exists,
+    "attribute_not_exists": _not_exists,
+    "contains": _contains,
+}
+
+
+# ------------------------------------------------------------------------
+# public API
+# ------------------------------------------------------------------------
+def compile_condition(
+    expression: Union[str, ConditionBase],
+    names: Optional[Dict[str, str]] = None,
+    values: Optional[Dict[str, Any]] = None,
+    builder: Optional[ConditionExpressionBuilder] = None,
+    is_key_condition: bool = False,
+):
+    """
+    Compile a condition (string or boto3 Attr/Key object) into item -> bool.
+    Pass one `builder` for every object condition of a request so their
+    generated placeholders do not collide.
+    """
+    if isinstance(expression, ConditionBase):
+        built = (builder or ConditionExpressionBuilder()).build_expression(
+            expression, is_key_condition=is_key_condition
+        )
+        names = {**(names or {}), **built.attribute_name_placeholders}
+        values = {**(values or {}), **built.attribute_value_placeholders}
+        expression = built.condition_expression
+    parser = _Parser(expression, names, values)
+    check = parser.condition()
+    if not parser.done():
+        raise ExpressionError(f"unexpected trailing input at token {parser.pos}")
+    return check
+
+
+def evaluate_condition(expression, item: Dict[str, Any], names=None, values=None) -> bool:
+    return bool(compile_condition(expression, names, values)(item))
+
+
+def apply_update(
+    item: Dict[str, Any],
+    expression: str,
+    names: Optional[Dict[str, str]] = None,
+    values: Optional[Dict[str, Any]] = None,
+) -> Set[str]:
+    """
+    Apply an update expression to `item` in place. Returns the attribute
+    names that were touched.
+    """
+    parser = _Parser(expression, names, values)
+    actions: List[Tuple[str, str, Any]] = []
+    seen = set()
+    while not parser.done():
+        kind, text = parser.next()
+        clause = text.upper() if kind == "word" else None
+        if clause not in ("SET", "REMOVE", "ADD") or clause in seen:
+            raise ExpressionError(f"unexpected {text!r} in update expression")
+        seen.add(clause)
+        while True:
+            name = parser.name()
+            if clause == "SET":
+                parser.expect_op("=")
+                actions.append((clause, name, parser.value()))
+            elif clause == "ADD":
+                value = parser.value()
+                if _type_code(value) != "N":
+                    raise ExpressionError("ADD requires a number")
+                actions.append((clause, name, value))
+            else:
+                actions.append((clause, name, None))
+            if not parser.accept_op(","):
+                break
+
+    for clause, name, value in actions:
+        if clause == "SET":
+            item[name] = copy_value(value)
+        elif clause == "REMOVE":
+            item.pop(name, None)
+        else:
+            current = item.get(name, Decimal(0))
+            if _type_code(current) != "N":
+                raise ExpressionError("ADD requires a number attribute")
+            item[name] = Decimal(current) + Decimal(value)
+    return {name for _, name, _ in actions}
+
+
+def copy_value(value: Any) -> Any:
+    """Copy maps, lists and sets recursively; scalars are immutable and shared."""
+    if isinstance(value, dict):
+        return {k: copy_value(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [copy_value(v) for v in value]
+    if isinstance(value, (set, frozenset)):
+        return set(value)
+    return value
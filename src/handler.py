@@ -1,59 +1,395 @@
 # src/handler.py
+import base64
+import hashlib
 import json
 import os
+import re
+import threading
 import uuid
 import logging
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timezone
-from decimal import Decimal
-from typing import Any
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import unquote
 
-from .models import CreateUploadRequest
+from .metrics import bind_scope, timed_handler
+from .serialization import dumps, dumps_bytes
 from .storage import (
     generate_presigned_put,
+    generate_presigned_part,
+    multipart_part_size,
+    create_multipart_upload,
+    list_uploaded_parts,
+    complete_multipart_upload,
+    abort_multipart_upload,
+    abort_stale_multipart_uploads,
+    clear_upload_id,
     generate_presigned_get,
     head_object,
+    inspect_object,
+    record_object_info,
     create_metadata,
+    batch_create_metadata,
     delete_object,
+    copy_object,
     get_item,
-    scan_items,
+    batch_get_items,
+    delete_metadata,
+    batch_delete_metadata,
+    batch_delete_objects,
+    delete_keys,
+    object_key,
+    register_content,
+    acquire_content,
+    release_content,
+    index_tags,
+    unindex_tags,
+    set_variants,
+    list_items,
+    iter_item_pages,
+    iter_parallel_scan_pages,
+    usage_delta,
+    update_usage,
+    get_usage,
 )
-from .config import MAX_UPLOAD_SIZE
+from .config import (
+    MAX_UPLOAD_SIZE,
+    LIST_DEFAULT_LIMIT,
+    LIST_MAX_LIMIT,
+    SCAN_MAX_SEGMENTS,
+    BATCH_MAX_ITEMS,
+    BATCH_DELETE_MAX_ITEMS,
+    PRESIGNED_PUT_EXPIRES,
+    PRESIGNED_PART_EXPIRES,
+    PRESIGNED_GET_EXPIRES,
+    PRESIGNED_GET_REUSE_MARGIN,
+    METADATA_MAX_AGE,
+    MULTIPART_MAX_UPLOAD_SIZE,
+    MULTIPART_MIN_PART_SIZE,
+    MULTIPART_STALE_AFTER,
+    DEDUP_ENABLED,
+    IO_THREADS,
+    INLINE_VERIFY_MAX_BYTES,
+    USER_QUOTA_IMAGES,
+    USER_QUOTA_BYTES,
+)
+
+if TYPE_CHECKING:
+    from .models import CreateUploadRequest
 
 logger = logging.getLogger("image-handler")
 logger.setLevel(logging.INFO)
 
 
-def _decimal_to_native(obj: Any) -> Any:
+def _response(code: int, body: Any):
+    # Decimals are converted by the encoder itself; no intermediate copy
+    return {"statusCode": code, "body": dumps(body)}
+
+
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+
+# a presigned GET URL handed out (fresh or from the presign cache) is valid for
+# at least this long, so a response carrying one can be reused for as long
+URL_MAX_AGE = min(PRESIGNED_GET_EXPIRES, PRESIGNED_GET_REUSE_MARGIN)
+
+
+def _request_header(event, name: str) -> Optional[str]:
+    # REST API events keep the client's header case; HTTP API and server.py lowercase
+    for key, value in (event.get("headers") or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    # weak comparison, as If-None-Match requires: a W/ prefix is ignored
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or (tag[2:] if tag.startswith("W/") else tag) == etag:
+            return True
+    return False
+
+
+# stored fields that change whenever a response built from the item would:
+# the status flip and variants both stamp updated_at
+_VERSION_FIELDS = ("image_id", "status", "object_etag", "updated_at", "created_at")
+
+
+def _item_version(item: dict) -> str:
+    return "|".join(str(item.get(field) or "") for field in _VERSION_FIELDS)
+
+
+def _cacheable_response(event, body: Any, validator: str, max_age: int = METADATA_MAX_AGE):
     """
-    Recursively convert Decimal -> int/float (so json.dumps works).
+    200 with an ETag and Cache-Control, or a bodiless 304 when the request's
+    If-None-Match already names that ETag. The ETag hashes `validator`, a
+    short string of stored fields standing for the body, so a 304 is
+    answered without encoding the body at all.
     """
-    if isinstance(obj, Decimal):
-        # If it's an integer value, return int else float
-        if obj == obj.to_integral_value():
-            return int(obj)
-        return float(obj)
-    if isinstance(obj, dict):
-        return {k: _decimal_to_native(v) for k, v in obj.items()}
-    if isinstance(obj, list):
-        return [_decimal_to_native(v) for v in obj]
-    if isinstance(obj, tuple):
-        return tuple(_decimal_to_native(v) for v in obj)
-    return obj
+    headers: Dict[str, str] = {
+        "ETag": f'"{hashlib.blake2b(validator.encode("utf-8"), digest_size=16).hexdigest()}"',
+        # per-user data: never stored by shared caches
+        "Cache-Control": f"private, max-age={max_age}" if max_age > 0 else "private, no-cache",
+    }
+    if_none_match = _request_header(event, "if-none-match")
+    if if_none_match and _etag_matches(if_none_match, headers["ETag"]):
+        return {"statusCode": 304, "headers": headers, "body": ""}
+    return {"statusCode": 200, "headers": headers, "body": dumps(body)}
 
 
-def _response(code: int, body: Any):
-    safe = _decimal_to_native(body)
-    return {"statusCode": code, "body": json.dumps(safe)}
+def _ndjson_chunks(first: List[dict], rest: Iterator[List[dict]]) -> Iterator[bytes]:
+    """
+    Encode item pages as NDJSON, one chunk per DynamoDB page.
+    """
+    page = first
+    while True:
+        if page:
+            yield b"".join(dumps_bytes(i) + b"\n" for i in page)
+        try:
+            page = next(rest)
+        except StopIteration:
+            return
+        except Exception:
+            # headers are already sent; signal truncation in-band and stop
+            logger.exception("stream interrupted")
+            yield b'{"error": "stream interrupted"}\n'
+            return
+
+
+def _upload_request(payload: Any) -> "CreateUploadRequest":
+    # pydantic is imported on first use, so read-only cold starts skip it
+    from .models import CreateUploadRequest
+
+    return CreateUploadRequest(**payload)
+
+
+def _new_metadata_item(req: "CreateUploadRequest") -> dict:
+    item = {
+        "image_id": str(uuid.uuid4()),
+        "user_id": req.user_id,
+        "filename": req.filename,
+        "content_type": req.content_type,
+        "size": req.size,
+        "tags": req.tags or [],
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        # flipped to "complete" by complete_upload once the bytes are verified
+        "status": "pending",
+    }
+    if req.sha256:
+        # checked against the real hash in complete_upload
+        item["declared_sha256"] = req.sha256.lower()
+    return item
+
+
+# --------------------------------------------------------
+# CONTENT DEDUPLICATION — shared objects with reference counts
+# --------------------------------------------------------
+def _deduplicated_upload(req: "CreateUploadRequest"):
+    """
+    If the client declared a sha256 that is already stored (same size), take
+    a reference on that object and write a finished metadata item pointing at
+    it, so no upload URL is needed. Returns the response, or None on a miss.
+    """
+    if not (DEDUP_ENABLED and req.sha256):
+        return None
+    sha256 = req.sha256.lower()
+    try:
+        content = acquire_content(sha256, size=req.size)
+    except Exception:
+        # the index is an optimisation; fall back to a normal upload
+        logger.exception("acquire_content failed")
+        return None
+    if not content:
+        return None
+
+    item = _new_metadata_item(req)
+    item["status"] = "complete"
+    item["object_key"] = content["object_key"]
+    item["checksum_sha256"] = sha256
+    item["detected_content_type"] = content.get("content_type")
+    refused, counted = _reserve_usage([item])
+    if refused:
+        _release_content(sha256)
+        return _quota_exceeded()
+    try:
+        create_metadata(item)
+    except Exception as e:
+        logger.exception("Failed to create metadata")
+        _release_content(sha256)
+        _unreserve_usage([item], counted)
+        return _response(500, {"error": "ddb write error", "detail": str(e)})
+    try:
+        if item["tags"] and index_tags([item]):
+            raise RuntimeError("tag index write left unprocessed items")
+    except Exception as e:
+        logger.exception("Failed to index tags")
+        # as in request_upload: nothing of a failed request may stay counted.
+        # The reference goes only with the row, which would otherwise point
+        # at an object that might be deleted under it.
+        if item["image_id"] in _discard_written([item], counted):
+            _release_content(sha256)
+        return _response(500, {"error": "ddb write error", "detail": str(e)})
+
+    _copy_variants(item, content["object_key"])
+    return _response(201, {"image_id": item["image_id"], "deduplicated": True})
+
+
+def _copy_variants(item: dict, source_key: str) -> None:
+    """
+    Give a deduplicated image the variants of the image that registered its
+    content. No object is PUT for it, so no S3 event would ever render them;
+    the copies are server-side and belong to the new image alone, so deleting
+    either image leaves the other's intact. Best-effort: an image whose source
+    is gone or not rendered yet stays without variants.
+    """
+    if not source_key.startswith("images/"):
+        return
+    try:
+        source = get_item(source_key[len("images/"):])
+        recorded = (source or {}).get("variants") or {}
+        if not recorded:
+            return
+        variants = {
+            name: f"derived/{item['image_id']}/{key.rsplit('/', 1)[-1]}" for name, key in recorded.items()
+        }
+        list(_side_executor().map(bind_scope(lambda name: copy_object(recorded[name], variants[name])), variants))
+        set_variants(item["image_id"], variants)
+    except Exception:
+        logger.exception("copying variants to %s failed", item["image_id"])
+
+
+def _claim_content(image_id: str, info: dict) -> Tuple[Optional[str], bool]:
+    """
+    Register a freshly uploaded object under its hash, or take a reference on
+    the object already stored for it. Returns (object_key, shared); the key is
+    None when the object stays private to the image (dedup off, or a release
+    of the same content raced us).
+    """
+    if not DEDUP_ENABLED:
+        return None, False
+    own_key = f"images/{image_id}"
+    if register_content(info["sha256"], own_key, info["size"], info["detected_content_type"]):
+        return own_key, False
+    content = acquire_content(info["sha256"], size=info["size"])
+    if content:
+        # a retried complete finds its own registration: nothing to drop
+        return content["object_key"], content["object_key"] != own_key
+    return None, False
+
+
+def _release_content(sha256: str, keep: Optional[str] = None) -> None:
+    """
+    Drop one reference on shared content; the last one deletes the object,
+    unless it is `keep` (an image's own upload, which outlives the claim).
+    Best-effort: a failure is logged and leaks at most one object.
+    """
+    _release_contents([sha256], keep=keep)
+
+
+def _release_contents(sha256s: List[str], keep: Optional[str] = None) -> None:
+    """
+    _release_content for many references in one pass: one conditional
+    decrement per distinct hash (concurrently on the side pool), then a
+    single DeleteObjects for every object whose last reference went.
+    """
+    counts = Counter(sha256s)
+
+    def release(sha256: str) -> Optional[str]:
+        try:
+            return release_content(sha256, counts[sha256])
+        except Exception:
+            logger.exception("release_content failed for %s", sha256)
+            return None
+
+    if len(counts) == 1:
+        released = [release(next(iter(counts)))]
+    else:
+        released = list(_side_executor().map(bind_scope(release), counts))
+    keys = [key for key in released if key and key != keep]
+    try:
+        if keys and delete_keys(keys):
+            logger.warning("s3 delete failed for released content")
+    except Exception:
+        logger.exception("s3 delete failed for %d released objects", len(keys))
+
+
+# --------------------------------------------------------
+# USAGE COUNTERS — per-user totals maintained on every write
+# --------------------------------------------------------
+def _reserve_usage(items: List[dict]) -> Tuple[set, set]:
+    """
+    Count new metadata items against their owners' quotas before writing
+    them. Returns (refused, counted) user_ids. A counter failure is logged and
+    the upload goes ahead uncounted: accounting must not block uploads.
+    """
+    refused, counted = set(), set()
+    for user_id, delta in usage_delta(items).items():
+        try:
+            if update_usage(user_id, **delta, max_images=USER_QUOTA_IMAGES, max_bytes=USER_QUOTA_BYTES):
+                counted.add(user_id)
+            else:
+                refused.add(user_id)
+        except Exception:
+            logger.exception("usage reservation failed for %s", user_id)
+    return refused, counted
+
+
+def _adjust_usage(items: List[dict], sign: int = -1) -> None:
+    """Best-effort counter update for items deleted (or added) elsewhere."""
+    for user_id, delta in usage_delta(items, sign).items():
+        try:
+            update_usage(user_id, **delta)
+        except Exception:
+            logger.exception("usage update failed for %s", user_id)
+
+
+def _unreserve_usage(items: List[dict], counted: set) -> None:
+    # undo _reserve_usage for items that were never written
+    _adjust_usage([item for item in items if item.get("user_id") in counted])
+
+
+def _discard_written(items: List[dict], counted: set) -> set:
+    """
+    Roll back items whose request fails after their metadata was written:
+    tag entries, metadata rows and usage reservations. Best-effort; a row
+    left behind is still pending and the reaper removes it later. Returns
+    the image_ids whose rows were removed.
+    """
+    tagged = [item for item in items if item.get("tags")]
+    try:
+        if tagged:
+            unindex_tags(tagged)
+    except Exception:
+        logger.exception("tag index rollback failed")
+    try:
+        kept = set(batch_delete_metadata([item["image_id"] for item in items]))
+    except Exception:
+        logger.exception("metadata rollback failed")
+        kept = {item["image_id"] for item in items}
+    # a row that survived keeps its reservation until the reaper deletes it
+    removed = [item for item in items if item["image_id"] not in kept]
+    _unreserve_usage(removed, counted)
+    return {item["image_id"] for item in removed}
+
+
+def _quota_exceeded():
+    return _response(403, {
+        "error": "quota exceeded",
+        "max_images": USER_QUOTA_IMAGES or None,
+        "max_bytes": USER_QUOTA_BYTES or None,
+    })
 
 
 # --------------------------------------------------------
 # REQUEST UPLOAD — start upload & return presigned PUT URL
 # --------------------------------------------------------
+@timed_handler
 def request_upload(event, context=None):
     try:
         body = event.get("body") or "{}"
         payload = json.loads(body) if isinstance(body, str) else body
-        req = CreateUploadRequest(**payload)
+        req = _upload_request(payload)
     except Exception as e:
         logger.exception("request_upload invalid payload")
         return _response(400, {"error": "invalid payload", "detail": str(e)})
@@ -61,23 +397,29 @@ def request_upload(event, context=None):
     if req.size > MAX_UPLOAD_SIZE:
         return _response(413, {"error": "file too large"})
 
-    image_id = str(uuid.uuid4())
-    now = datetime.now(timezone.utc).isoformat()
+    deduplicated = _deduplicated_upload(req)
+    if deduplicated:
+        return deduplicated
 
-    metadata_item = {
-        "image_id": image_id,
-        "user_id": req.user_id,
-        "filename": req.filename,
-        "content_type": req.content_type,
-        "size": req.size,
-        "tags": req.tags or [],
-        "created_at": now,
-    }
+    metadata_item = _new_metadata_item(req)
+    image_id = metadata_item["image_id"]
+    refused, counted = _reserve_usage([metadata_item])
+    if refused:
+        return _quota_exceeded()
 
     try:
         create_metadata(metadata_item)
     except Exception as e:
         logger.exception("Failed to create metadata")
+        _unreserve_usage([metadata_item], counted)
+        return _response(500, {"error": "ddb write error", "detail": str(e)})
+    try:
+        if metadata_item["tags"] and index_tags([metadata_item]):
+            raise RuntimeError("tag index write left unprocessed items")
+    except Exception as e:
+        logger.exception("Failed to index tags")
+        # an upload missing from its tag listings must not outlive the 500
+        _discard_written([metadata_item], counted)
         return _response(500, {"error": "ddb write error", "detail": str(e)})
 
     try:
@@ -87,32 +429,404 @@ def request_upload(event, context=None):
         return _response(500, {"error": "s3 presign error", "detail": str(e)})
 
     # Use 201 Created for new resource
-    return _response(201, {"image_id": image_id, "upload_url": url, "expires_in": 300})
+    return _response(201, {"image_id": image_id, "upload_url": url, "expires_in": 300, "deduplicated": False})
+
+
+# --------------------------------------------------------
+# BATCH REQUEST UPLOAD — many presigned PUT URLs in one call
+# --------------------------------------------------------
+@timed_handler
+def batch_request_upload(event, context=None):
+    """
+    Body: {"items": [CreateUploadRequest, ...]}. Valid items are written with
+    one BatchWriteItem per 25 and signed in a single pass; the response has a
+    result per input index, each either an upload or an error.
+    """
+    try:
+        body = event.get("body") or "{}"
+        payload = json.loads(body) if isinstance(body, str) else body
+        raw_items = payload["items"]
+        if not isinstance(raw_items, list):
+            raise ValueError("items must be a list")
+    except Exception as e:
+        logger.exception("batch_request_upload invalid payload")
+        return _response(400, {"error": "invalid payload", "detail": str(e)})
+
+    if not raw_items:
+        return _response(400, {"error": "invalid payload", "detail": "items is empty"})
+    if len(raw_items) > BATCH_MAX_ITEMS:
+        return _response(413, {"error": "too many items", "max_items": BATCH_MAX_ITEMS})
+
+    results: List[dict] = [{} for _ in raw_items]
+    pending = []  # (index, metadata_item)
+    for index, raw in enumerate(raw_items):
+        try:
+            req = _upload_request(raw)
+        except Exception as e:
+            results[index] = {"index": index, "error": "invalid payload", "detail": str(e)}
+            continue
+        if req.size > MAX_UPLOAD_SIZE:
+            results[index] = {"index": index, "error": "file too large"}
+            continue
+        pending.append((index, _new_metadata_item(req)))
+
+    refused, counted = _reserve_usage([item for _, item in pending])
+    for index, item in pending:
+        if item["user_id"] in refused:
+            results[index] = {"index": index, "error": "quota exceeded"}
+    pending = [(index, item) for index, item in pending if item["user_id"] not in refused]
+
+    try:
+        unwritten = set(batch_create_metadata([item for _, item in pending]))
+    except Exception as e:
+        logger.exception("batch_create_metadata failed")
+        _unreserve_usage([item for _, item in pending], counted)
+        return _response(500, {"error": "ddb write error", "detail": str(e)})
+    _unreserve_usage([item for _, item in pending if item["image_id"] in unwritten], counted)
+    written = [item for _, item in pending if item["image_id"] not in unwritten]
+    try:
+        tagged = [item for item in written if item["tags"]]
+        untagged = set(index_tags(tagged)) if tagged else set()
+    except Exception as e:
+        logger.exception("index_tags failed")
+        _discard_written(written, counted)
+        return _response(500, {"error": "ddb write error", "detail": str(e)})
+    if untagged:
+        # reported as failed, so they must not linger as pending rows either
+        _discard_written([item for item in written if item["image_id"] in untagged], counted)
+        unwritten |= untagged
+
+    for index, item in pending:
+        image_id = item["image_id"]
+        if image_id in unwritten:
+            results[index] = {"index": index, "error": "ddb write error"}
+            continue
+        try:
+            url = generate_presigned_put(image_id, item["content_type"])
+        except Exception as e:
+            logger.exception("presigned put generation failed")
+            results[index] = {"index": index, "image_id": image_id, "error": "s3 presign error", "detail": str(e)}
+            continue
+        results[index] = {
+            "index": index,
+            "image_id": image_id,
+            "upload_url": url,
+            "expires_in": PRESIGNED_PUT_EXPIRES,
+        }
+
+    return _response(200, {"results": results})
+
+
+# --------------------------------------------------------
+# MULTIPART UPLOAD — presigned URL per part for large files
+# --------------------------------------------------------
+@timed_handler
+def request_multipart_upload(event, context=None):
+    """
+    Like request_upload, but starts an S3 multipart upload and returns one
+    presigned PUT URL per part so clients can upload parts in parallel and
+    retry them individually. Finish with the usual complete endpoint.
+    """
+    try:
+        body = event.get("body") or "{}"
+        payload = json.loads(body) if isinstance(body, str) else body
+        req = _upload_request(payload)
+    except Exception as e:
+        logger.exception("request_multipart_upload invalid payload")
+        return _response(400, {"error": "invalid payload", "detail": str(e)})
+
+    if req.size > MULTIPART_MAX_UPLOAD_SIZE:
+        return _response(413, {"error": "file too large"})
+
+    deduplicated = _deduplicated_upload(req)
+    if deduplicated:
+        return deduplicated
+
+    metadata_item = _new_metadata_item(req)
+    image_id = metadata_item["image_id"]
+    part_size = multipart_part_size(req.size, MULTIPART_MIN_PART_SIZE)
+    part_count = max(1, -(-req.size // part_size))
+    refused, counted = _reserve_usage([metadata_item])
+    if refused:
+        return _quota_exceeded()
+
+    try:
+        upload_id = create_multipart_upload(image_id, req.content_type)
+    except Exception as e:
+        logger.exception("create_multipart_upload failed")
+        _unreserve_usage([metadata_item], counted)
+        return _response(500, {"error": "s3 multipart error", "detail": str(e)})
+
+    metadata_item["upload_id"] = upload_id
+    try:
+        create_metadata(metadata_item)
+    except Exception as e:
+        logger.exception("Failed to create metadata")
+        _unreserve_usage([metadata_item], counted)
+        try:
+            abort_multipart_upload(image_id, upload_id)
+        except Exception:
+            logger.exception("abort after failed metadata write failed")
+        return _response(500, {"error": "ddb write error", "detail": str(e)})
+    try:
+        if metadata_item["tags"] and index_tags([metadata_item]):
+            raise RuntimeError("tag index write left unprocessed items")
+    except Exception as e:
+        logger.exception("Failed to index tags")
+        _discard_written([metadata_item], counted)
+        try:
+            abort_multipart_upload(image_id, upload_id)
+        except Exception:
+            logger.exception("abort after failed tag index write failed")
+        return _response(500, {"error": "ddb write error", "detail": str(e)})
+
+    try:
+        parts = [
+            {"part_number": n, "url": generate_presigned_part(image_id, upload_id, n)}
+            for n in range(1, part_count + 1)
+        ]
+    except Exception as e:
+        logger.exception("presigned part generation failed")
+        return _response(500, {"error": "s3 presign error", "detail": str(e)})
+
+    return _response(201, {
+        "image_id": image_id,
+        "upload_id": upload_id,
+        "part_size": part_size,
+        "parts": parts,
+        "expires_in": PRESIGNED_PART_EXPIRES,
+    })
+
+
+def _finish_multipart(image_id: str, upload_id: str, event):
+    """
+    Assemble a multipart upload. Parts come from the request body
+    ({"parts": [{"part_number", "etag"}]}) or, if omitted, from ListParts.
+    Returns an error response, or None on success.
+    """
+    body = event.get("body") or {}
+    try:
+        payload = json.loads(body) if isinstance(body, str) else body
+        parts = [{"PartNumber": int(p["part_number"]), "ETag": p["etag"]} for p in payload.get("parts") or []]
+    except Exception as e:
+        return _response(400, {"error": "invalid payload", "detail": str(e)})
+
+    try:
+        if not parts:
+            parts = list_uploaded_parts(image_id, upload_id)
+        if not parts:
+            return _response(400, {"error": "no parts uploaded"})
+        complete_multipart_upload(image_id, upload_id, parts)
+    except Exception as e:
+        # an earlier complete assembled the object but could not clear
+        # upload_id: S3 no longer knows the upload, and the object is there
+        if _error_code(e) != "NoSuchUpload" or not head_object(image_id):
+            logger.exception("complete_multipart_upload failed")
+            return _response(400, {"error": "multipart completion failed", "detail": str(e)})
+        logger.info("multipart upload of %s was already assembled", image_id)
+
+    try:
+        clear_upload_id(image_id)
+    except Exception:
+        # harmless: the next complete takes the NoSuchUpload path above, and
+        # record_object_info drops the attribute with the status flip
+        logger.exception("clear_upload_id failed")
+    return None
+
+
+def _error_code(e: Exception) -> str:
+    return (getattr(e, "response", None) or {}).get("Error", {}).get("Code", "")
+
+
+_side_pool: Optional[ThreadPoolExecutor] = None
+_side_pool_lock = threading.Lock()
+
+
+def _side_executor() -> ThreadPoolExecutor:
+    # separate from the async adapter's pool: handlers already run there, and
+    # waiting on work queued behind themselves could deadlock a full pool
+    global _side_pool
+    if _side_pool is None:
+        with _side_pool_lock:
+            if _side_pool is None:
+                _side_pool = ThreadPoolExecutor(max_workers=IO_THREADS, thread_name_prefix="handler-io")
+    return _side_pool
+
+
+def _item_and_head(image_id: str) -> Tuple[Optional[dict], Future]:
+    """
+    Read the metadata item while the object's HEAD is in flight, so the two
+    round trips cost one. The HEAD comes back as a future: callers that return
+    early (unknown image, already complete) never wait for it.
+    """
+    head = _side_executor().submit(bind_scope(lambda: head_object(image_id)))
+    return get_item(image_id), head
+
+
+def _complete_response(image_id: str, item: dict):
+    item["url"] = generate_presigned_get(image_id, key=object_key(item))
+    return _response(200, item)
 
 
 # --------------------------------------------------------
 # COMPLETE UPLOAD — verify S3 object exists, return metadata
 # --------------------------------------------------------
+@timed_handler
 def complete_upload(event, context=None):
     image_id = (event.get("pathParameters") or {}).get("image_id")
     if not image_id:
         return _response(400, {"error": "missing image_id"})
 
-    item = get_item(image_id)
+    item, head_future = _item_and_head(image_id)
     if not item:
         return _response(404, {"error": "not found"})
 
-    if not head_object(image_id):
+    if item.get("status") == "complete" or item.get("object_key"):
+        # deduplicated at request time, or already completed
+        return _complete_response(image_id, item)
+
+    upload_id = item.pop("upload_id", None)
+    if upload_id:
+        error = _finish_multipart(image_id, upload_id, event)
+        if error:
+            return error
+        # the concurrent HEAD ran before the parts were assembled
+        head = head_object(image_id)
+    else:
+        head = head_future.result()
+    if not head:
         return _response(404, {"error": "object missing in s3"})
+    if isinstance(head, dict) and (head.get("ContentLength") or 0) > INLINE_VERIFY_MAX_BYTES:
+        # hashing GiBs does not fit in one API request: the object's S3 event
+        # runs verify_upload instead, and clients poll until status is complete
+        return _response(202, {"image_id": image_id, "status": "pending", "verification": "queued"})
+    return _verify_and_record(image_id, item, head)
 
-    url = generate_presigned_get(image_id)
-    item["url"] = url
-    return _response(200, item)
+
+def verify_upload(image_id: str, large_only: bool = True):
+    """
+    Out-of-band completion of an upload too large to verify inside its
+    complete request (over INLINE_VERIFY_MAX_BYTES). Called for every
+    uploaded object by the S3 event pipeline; returns None when there is
+    nothing to do here (not pending, small, or not uploaded yet), else the
+    handler-style response of the verification. The reaper passes
+    large_only=False to settle uploads whose client never called complete.
+    """
+    item = get_item(image_id)
+    if not item or item.get("status") != "pending" or item.get("object_key"):
+        return None
+    head = head_object(image_id)
+    if not isinstance(head, dict):
+        return None
+    if large_only and (head.get("ContentLength") or 0) <= INLINE_VERIFY_MAX_BYTES:
+        return None
+    item.pop("upload_id", None)
+    return _verify_and_record(image_id, item, head)
+
+
+def _verify_and_record(image_id: str, item: dict, head: Any):
+    """
+    The verifying half of completion: charge bytes beyond the declared size
+    against the quota, then record the upload and settle usage on the
+    outcome. Returns the response.
+    """
+    user_id = item.get("user_id") if item.get("status") == "pending" else None
+    actual = head.get("ContentLength") if isinstance(head, dict) else None
+    delta = int(actual) - int(item.get("size") or 0) if user_id and actual is not None else 0
+    charged = 0
+    if delta > 0:
+        # the declared size was reserved under the quota at request time; the
+        # excess goes through the same check before any work is done. A refused
+        # upload stays pending with its object, so a complete retried after
+        # freeing space succeeds; otherwise the reaper removes it.
+        try:
+            if not update_usage(user_id, size=delta, max_bytes=USER_QUOTA_BYTES):
+                return _quota_exceeded()
+            charged = delta
+        except Exception:
+            logger.exception("usage reservation failed for %s", user_id)
+
+    res, recorded = _record_upload(image_id, item, head)
+    if user_id:
+        # recorded: drop the pending count and settle on the real size;
+        # otherwise give back what was charged above
+        settle = {"pending": -1, "size": delta - charged} if recorded else {"size": -charged}
+        if any(settle.values()):
+            try:
+                update_usage(user_id, **settle)
+            except Exception:
+                logger.exception("usage update failed for %s", user_id)
+    return res
+
+
+def _record_upload(image_id: str, item: dict, head: Any) -> Tuple[dict, bool]:
+    """
+    Hash and sniff the object, claim its content and flip the status.
+    Returns (response, whether this call flipped the status).
+    """
+    # one streamed pass over the object: checksum + header sniff, flat memory
+    try:
+        info = inspect_object(image_id)
+    except Exception as e:
+        logger.exception("inspect_object failed")
+        return _response(500, {"error": "s3 read error", "detail": str(e)}), False
+    if not info["detected_content_type"]:
+        return _response(415, {"error": "unsupported media type"}), False
+    if item.get("declared_sha256") not in (None, info["sha256"]):
+        return _response(400, {"error": "checksum mismatch"}), False
+    if isinstance(head, dict):
+        info["object_size"] = head.get("ContentLength")
+        info["etag"] = head.get("ETag")
+
+    try:
+        key, shared = _claim_content(image_id, info)
+    except Exception as e:
+        logger.exception("content registration failed")
+        return _response(500, {"error": "ddb write error", "detail": str(e)}), False
+    if key:
+        info["object_key"] = key
+
+    own_key = f"images/{image_id}"
+    try:
+        completed = record_object_info(image_id, info)
+    except Exception as e:
+        logger.exception("record_object_info failed")
+        # undo only the claim: the image is still pending on its own upload,
+        # which a retried complete needs (and may have just registered)
+        if key:
+            _release_content(info["sha256"], keep=own_key)
+        return _response(500, {"error": "ddb write error", "detail": str(e)}), False
+    if not completed:
+        # a concurrent complete won the status flip (or the image was deleted);
+        # give back our reference and report whatever it recorded
+        if key:
+            _release_content(info["sha256"], keep=own_key)
+        current = get_item(image_id)
+        if not current:
+            return _response(404, {"error": "not found"}), False
+        return _complete_response(image_id, current), False
+
+    item["status"] = "complete"
+    item["checksum_sha256"] = info["sha256"]
+    item["detected_content_type"] = info["detected_content_type"]
+    for attr, field in (("object_key", "object_key"), ("object_size", "object_size"), ("etag", "object_etag")):
+        if info.get(attr) is not None:
+            item[field] = info[attr]
+
+    if shared:
+        # identical bytes are already stored; drop this upload's copy
+        try:
+            delete_object(image_id)
+        except Exception:
+            logger.exception("delete of duplicate upload failed for %s", image_id)
+
+    return _complete_response(image_id, item), True
 
 
 # --------------------------------------------------------
 # VIEW IMAGE (metadata or ?download=true → presigned URL)
 # --------------------------------------------------------
+@timed_handler
 def get_image(event, context=None):
     image_id = (event.get("pathParameters") or {}).get("image_id")
     if not image_id:
@@ -123,69 +837,382 @@ def get_image(event, context=None):
         return _response(404, {"error": "not found"})
 
     qs = event.get("queryStringParameters") or {}
+    size = qs.get("size")
     download = qs.get("download")
-    if download in ("1", "true", "True"):
-        url = generate_presigned_get(image_id)
+    if size:
+        # derivative rendered by the pipeline, e.g. ?size=thumb
+        key = (item.get("variants") or {}).get(size)
+        if not key:
+            return _response(404, {"error": "variant not available"})
+        item["url"] = generate_presigned_get(image_id, key=key)
+    elif download in ("1", "true", "True"):
+        # the stored status is the source of truth: complete_upload only
+        # flips it after verifying the object, so S3 is not asked again
+        if item.get("status") == "pending":
+            return _response(409, {"error": "upload not complete"})
+        url = generate_presigned_get(image_id, key=object_key(item))
         if not url:
             return _response(404, {"error": "object missing in s3"})
         item["url"] = url
 
-    return _response(200, item)
+    # the URL is part of the body, so a re-signed URL is a new ETag
+    validator = f"{_item_version(item)}|{item.get('url') or ''}"
+    return _cacheable_response(event, item, validator, URL_MAX_AGE if "url" in item else METADATA_MAX_AGE)
 
 
 # --------------------------------------------------------
-# LIST IMAGES (supports user_id, content_type, tag)
+# LIST IMAGES (supports user_id, content_type, tag, limit, cursor)
 # --------------------------------------------------------
+@timed_handler
 def list_images_handler(event, context=None):
     qs = event.get("queryStringParameters") or {}
 
     user_id = qs.get("user_id")
     content_type = qs.get("content_type")
     tag = qs.get("tag")
+    cursor = qs.get("cursor")
 
     logger.info("list_images_handler called with qs=%s", qs)
 
     try:
-        items = scan_items()
-    except Exception as e:
-        logger.exception("scan_items failed")
-        return _response(500, {"error": "scan_items failed", "detail": str(e)})
+        limit = int(qs.get("limit") or LIST_DEFAULT_LIMIT)
+    except (TypeError, ValueError):
+        return _response(400, {"error": "invalid limit"})
+    if limit < 1:
+        return _response(400, {"error": "invalid limit"})
+    limit = min(limit, LIST_MAX_LIMIT)
 
     try:
-        if user_id:
-            items = [i for i in items if i.get("user_id") == user_id]
+        items, next_cursor = list_items(
+            user_id=user_id,
+            content_type=content_type,
+            tag=tag,
+            limit=limit,
+            cursor=cursor,
+        )
+    except ValueError as e:
+        return _response(400, {"error": "invalid cursor", "detail": str(e)})
+    except Exception as e:
+        logger.exception("list_items failed")
+        return _response(500, {"error": "list_items failed", "detail": str(e)})
 
-        if content_type:
-            items = [i for i in items if i.get("content_type") == content_type]
+    validator = "\n".join([next_cursor or "", *map(_item_version, items)])
+    return _cacheable_response(event, {"items": items, "next_cursor": next_cursor}, validator)
 
-        if tag:
-            items = [i for i in items if tag in (i.get("tags") or [])]
+
+# --------------------------------------------------------
+# STREAM IMAGES — NDJSON export over a full scan/query
+# --------------------------------------------------------
+@timed_handler
+def stream_images_handler(event, context=None):
+    """
+    Like list_images_handler but without paging: body is an iterator of NDJSON
+    chunks produced page-by-page, so memory stays flat regardless of table size.
+    The first page is fetched eagerly so storage errors still map to a 500.
+    `segments=N` switches a full-table export to an N-way parallel scan.
+    """
+    qs = event.get("queryStringParameters") or {}
+    logger.info("stream_images_handler called with qs=%s", qs)
+
+    segments = qs.get("segments")
+    if segments:
+        try:
+            segments = int(segments)
+        except (TypeError, ValueError):
+            return _response(400, {"error": "invalid segments"})
+        if not 1 <= segments <= SCAN_MAX_SEGMENTS:
+            return _response(400, {"error": "invalid segments"})
+        if qs.get("user_id"):
+            return _response(400, {"error": "segments cannot be combined with user_id"})
+        pages = iter_parallel_scan_pages(
+            total_segments=segments,
+            content_type=qs.get("content_type"),
+            tag=qs.get("tag"),
+        )
+    else:
+        pages = iter_item_pages(
+            user_id=qs.get("user_id"),
+            content_type=qs.get("content_type"),
+            tag=qs.get("tag"),
+        )
+    try:
+        first = next(pages, [])
     except Exception as e:
-        logger.exception("filtering failed")
-        return _response(500, {"error": "filtering failed", "detail": str(e)})
+        logger.exception("iter_item_pages failed")
+        return _response(500, {"error": "stream failed", "detail": str(e)})
 
-    return _response(200, {"items": items})
+    return {
+        "statusCode": 200,
+        "headers": {"Content-Type": NDJSON_CONTENT_TYPE},
+        "body": _ndjson_chunks(first, pages),
+    }
 
 
 # --------------------------------------------------------
 # DELETE IMAGE — remove S3 object + DynamoDB item
 # --------------------------------------------------------
+@timed_handler
 def delete_image_handler(event, context=None):
     image_id = (event.get("pathParameters") or {}).get("image_id")
 
     if not image_id:
         return _response(400, {"error": "missing image_id"})
 
+    # the item's tags are needed to clean up the tag index afterwards
     try:
-        delete_object(image_id)
+        item = get_item(image_id)
+    except Exception:
+        logger.exception("ddb get before delete failed")
+        item = None
+
+    try:
+        if item and item.get("upload_id"):
+            abort_multipart_upload(image_id, item["upload_id"])
+        # a registered object may be shared: it goes with its last reference
+        # below. Without the item we can't tell, so leave the object alone.
+        if item and not item.get("object_key"):
+            delete_object(image_id)
+        if item and item.get("variants"):
+            delete_keys(list(item["variants"].values()))
     except Exception:
         logger.exception("s3 delete failed")
 
     try:
-        from .storage import table
-        table.delete_item(Key={"image_id": image_id})
+        delete_metadata(image_id)
     except Exception as e:
         logger.exception("ddb delete failed")
         return _response(500, {"error": "ddb delete failed", "detail": str(e)})
 
+    if item and item.get("object_key"):
+        _release_content(item["checksum_sha256"])
+    if item:
+        _adjust_usage([item])
+
+    if item and item.get("tags"):
+        try:
+            if unindex_tags([item]):
+                logger.warning("tag index cleanup incomplete for %s", image_id)
+        except Exception:
+            logger.exception("tag index cleanup failed for %s", image_id)
+
     return _response(200, {"deleted": image_id})
+
+
+def _parse_image_ids(event, max_items: int):
+    """
+    Parse {"image_ids": [...]} from the event body. Returns (ids, error_response).
+    """
+    try:
+        body = event.get("body") or "{}"
+        payload = json.loads(body) if isinstance(body, str) else body
+        image_ids = payload["image_ids"]
+        if not isinstance(image_ids, list) or not all(isinstance(i, str) and i for i in image_ids):
+            raise ValueError("image_ids must be a list of non-empty strings")
+    except Exception as e:
+        return None, _response(400, {"error": "invalid payload", "detail": str(e)})
+    if not image_ids:
+        return None, _response(400, {"error": "invalid payload", "detail": "image_ids is empty"})
+    image_ids = list(dict.fromkeys(image_ids))
+    if len(image_ids) > max_items:
+        return None, _response(413, {"error": "too many items", "max_items": max_items})
+    return image_ids, None
+
+
+# --------------------------------------------------------
+# BATCH GET — metadata for many images (BatchGetItem)
+# --------------------------------------------------------
+@timed_handler
+def batch_get_images(event, context=None):
+    image_ids, error = _parse_image_ids(event, BATCH_MAX_ITEMS)
+    if error:
+        return error
+
+    try:
+        found, failed = batch_get_items(image_ids)
+    except Exception as e:
+        logger.exception("batch_get_items failed")
+        return _response(500, {"error": "batch get failed", "detail": str(e)})
+
+    failed = set(failed)
+    results = []
+    for image_id in image_ids:
+        if image_id in found:
+            results.append({"image_id": image_id, "item": found[image_id]})
+        elif image_id in failed:
+            results.append({"image_id": image_id, "error": "ddb read error"})
+        else:
+            results.append({"image_id": image_id, "error": "not found"})
+    return _response(200, {"results": results})
+
+
+# --------------------------------------------------------
+# BATCH DELETE — S3 DeleteObjects + batched DynamoDB deletes
+# --------------------------------------------------------
+@timed_handler
+def batch_delete_images(event, context=None):
+    """
+    Same semantics as delete_image_handler per id: S3 removal is best-effort
+    (failures are logged), the metadata delete decides the outcome.
+    """
+    image_ids, error = _parse_image_ids(event, BATCH_DELETE_MAX_ITEMS)
+    if error:
+        return error
+
+    try:
+        items, _ = batch_get_items(image_ids)
+    except Exception:
+        logger.exception("batch get before delete failed")
+        items = {}
+
+    # as in delete_image_handler, only unregistered objects of known items are
+    # deleted directly; registered ones are released after the metadata delete
+    private = [i for i, item in items.items() if not item.get("object_key")]
+    try:
+        s3_failed = batch_delete_objects(private) if private else []
+        if s3_failed:
+            logger.warning("s3 delete failed for %d of %d objects", len(s3_failed), len(private))
+        variant_keys = [k for item in items.values() for k in (item.get("variants") or {}).values()]
+        if variant_keys:
+            delete_keys(variant_keys)
+    except Exception:
+        logger.exception("s3 batch delete failed")
+
+    try:
+        ddb_failed = set(batch_delete_metadata(image_ids))
+    except Exception as e:
+        logger.exception("ddb batch delete failed")
+        return _response(500, {"error": "ddb delete failed", "detail": str(e)})
+
+    _release_contents([
+        item["checksum_sha256"] for image_id, item in items.items()
+        if item.get("object_key") and image_id not in ddb_failed
+    ])
+    _adjust_usage([item for image_id, item in items.items() if image_id not in ddb_failed])
+
+    tagged = [item for image_id, item in items.items() if item.get("tags") and image_id not in ddb_failed]
+    if tagged:
+        try:
+            if unindex_tags(tagged):
+                logger.warning("tag index cleanup incomplete for batch delete")
+        except Exception:
+            logger.exception("tag index cleanup failed for batch delete")
+
+    results = [
+        {"image_id": i, "error": "ddb delete failed"} if i in ddb_failed else {"image_id": i, "deleted": True}
+        for i in image_ids
+    ]
+    return _response(200, {"results": results})
+
+
+# --------------------------------------------------------
+# USER USAGE — precomputed counters, one item per user
+# --------------------------------------------------------
+@timed_handler
+def get_usage_handler(event, context=None):
+    user_id = (event.get("pathParameters") or {}).get("user_id")
+    if not user_id:
+        return _response(400, {"error": "missing user_id"})
+    try:
+        usage = get_usage(user_id)
+    except Exception as e:
+        logger.exception("get_usage failed")
+        return _response(500, {"error": "ddb read error", "detail": str(e)})
+    usage["quota"] = {"max_images": USER_QUOTA_IMAGES or None, "max_bytes": USER_QUOTA_BYTES or None}
+    return _response(200, usage)
+
+
+# --------------------------------------------------------
+# ABORT STALE UPLOADS — scheduled cleanup of abandoned multipart uploads
+# --------------------------------------------------------
+@timed_handler
+def abort_stale_uploads(event=None, context=None):
+    """
+    Schedulable entry point: abort multipart uploads older than
+    MULTIPART_STALE_AFTER seconds (override with event["max_age_seconds"]).
+    """
+    max_age = int((event or {}).get("max_age_seconds") or MULTIPART_STALE_AFTER)
+    try:
+        aborted = abort_stale_multipart_uploads(max_age)
+    except Exception as e:
+        logger.exception("abort_stale_multipart_uploads failed")
+        return _response(500, {"error": "abort failed", "detail": str(e)})
+    logger.info("aborted %d stale multipart uploads", len(aborted))
+    return _response(200, {"aborted": len(aborted)})
+
+
+# --------------------------------------------------------
+# ROUTER — one Lambda behind an API Gateway proxy integration
+# --------------------------------------------------------
+def _list_or_stream(event, context=None):
+    qs = event.get("queryStringParameters") or {}
+    if qs.get("format") == "ndjson":
+        return stream_images_handler(event, context)
+    return list_images_handler(event, context)
+
+
+# literal segments under /images; never an image id, so GET /images/batch is
+# a 405 for the batch route rather than a lookup of an image called "batch"
+RESERVED_PATH_SEGMENTS = ("batch", "batch-get", "batch-delete", "multipart")
+_IMAGE_ID = rf"(?P<image_id>(?!(?:{'|'.join(map(re.escape, RESERVED_PATH_SEGMENTS))})(?:/|$))[^/]+)"
+
+# (method, path under /v1, handler); first match wins
+ROUTES: List[Tuple[str, str, Callable]] = [
+    ("POST", "/images", request_upload),
+    ("POST", "/images/batch", batch_request_upload),
+    ("POST", "/images/batch-get", batch_get_images),
+    ("POST", "/images/batch-delete", batch_delete_images),
+    ("POST", "/images/multipart", request_multipart_upload),
+    ("POST", f"/images/{_IMAGE_ID}/complete", complete_upload),
+    ("GET", "/images", _list_or_stream),
+    ("GET", f"/images/{_IMAGE_ID}", get_image),
+    ("DELETE", f"/images/{_IMAGE_ID}", delete_image_handler),
+    ("GET", "/users/(?P<user_id>[^/]+)/usage", get_usage_handler),
+]
+_COMPILED_ROUTES = [(method, re.compile(rf"^(?:/v1)?{path}/?$"), fn) for method, path, fn in ROUTES]
+
+
+def _method_and_path(event) -> Tuple[str, str]:
+    # REST API (payload v1) sends httpMethod/path; HTTP API (v2) sends
+    # requestContext.http.method and a rawPath that includes a named stage
+    ctx = event.get("requestContext") or {}
+    method = event.get("httpMethod") or (ctx.get("http") or {}).get("method") or ""
+    path = event.get("path") or event.get("rawPath") or "/"
+    stage = ctx.get("stage")
+    if "rawPath" in event and stage and stage != "$default" and path.startswith(f"/{stage}/"):
+        path = path[len(stage) + 1:]
+    return method.upper(), path
+
+
+def router(event, context=None):
+    """
+    Single entry point for every HTTP route (Dockerfile.lambda CMD), so one
+    function's warm containers, clients and caches serve all of them instead
+    of each route keeping its own cold-start pool.
+
+    Dispatches on method and path (REST or HTTP API proxy events, with or
+    without the /v1 prefix), fills pathParameters from the matched path and
+    decodes base64 bodies. Streaming NDJSON bodies are buffered, as Lambda
+    proxy responses cannot stream.
+    """
+    method, path = _method_and_path(event)
+    allowed = []
+    for route_method, pattern, fn in _COMPILED_ROUTES:
+        match = pattern.match(path)
+        if not match:
+            continue
+        if route_method != method:
+            allowed.append(route_method)
+            continue
+        body = event.get("body")
+        if body and event.get("isBase64Encoded"):
+            body = base64.b64decode(body).decode("utf-8")
+        params = {k: unquote(v) for k, v in match.groupdict().items()}
+        res = fn(dict(event, body=body, pathParameters={**(event.get("pathParameters") or {}), **params}), context)
+        if isinstance(res.get("body"), Iterator):
+            res = dict(res, body=b"".join(res["body"]).decode("utf-8"))
+        return res
+    if allowed:
+        res = _response(405, {"error": "method not allowed"})
+        res["headers"] = {"Allow": ", ".join(dict.fromkeys(allowed))}
+        return res
+    return _response(404, {"error": "route not found", "method": method, "path": path})
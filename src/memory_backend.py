@@ -0,0 +1,787 @@
+# src/memory_backend.py
+"""
+In-memory storage backend (STORAGE_BACKEND=memory).
+
+Implements the slice of the boto3 S3 client and DynamoDB Table API that
+src.storage uses, with the semantics storage relies on:
+
+- tables: key schema and GSIs mirroring create_resources.sh, sparse indexes,
+  condition/update/filter expressions (string or Attr/Key objects, evaluated
+  by src.expressions), Query/Scan ordering, Limit counted before the filter,
+  LastEvaluatedKey/ExclusiveStartKey paging and Segment/TotalSegments, and
+  BatchWriteItem/BatchGetItem through table.meta.client
+- values are normalised the way DynamoDB stores them (ints become Decimal,
+  floats are rejected) and every read returns a copy
+- objects: put/get/head/delete, multipart uploads with S3's part rules, and
+  deterministic fake presigned URLs (HMAC over method, bucket, key and
+  parameters; no clock involved) that server.py's /_memory routes accept
+- failures are raised as botocore ClientError with the real error codes
+
+Everything lives in one process behind one lock: nothing is persisted.
+"""
+import bisect
+import hashlib
+import hmac
+import io
+import re
+import threading
+import uuid
+import zlib
+from datetime import datetime, timezone
+from decimal import Decimal
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import quote, urlencode
+
+from boto3.dynamodb.conditions import ConditionBase, ConditionExpressionBuilder, Key
+from boto3.dynamodb.types import Binary, TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError
+
+from .backends import StorageBackend
+from .config import (
+    DDB_TABLE,
+    DDB_USER_INDEX,
+    DDB_CONTENT_TYPE_INDEX,
+    DDB_STATUS_INDEX,
+    DDB_TAG_TABLE,
+    DDB_CONTENT_TABLE,
+    DDB_USAGE_TABLE,
+    MEMORY_PRESIGN_BASE_URL,
+)
+from .expressions import ExpressionError, apply_update, compile_condition, copy_value
+
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+DDB_BATCH_WRITE_LIMIT = 25
+DDB_BATCH_GET_LIMIT = 100
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+
+def _error(code: str, message: str, operation: str, status: int = 400) -> ClientError:
+    return ClientError(
+        {"Error": {"Code": code, "Message": message}, "ResponseMetadata": {"HTTPStatusCode": status}},
+        operation,
+    )
+
+
+def _normalize(value: Any) -> Any:
+    """Round-trip through the DynamoDB wire format (int -> Decimal, bytes -> Binary)."""
+    try:
+        return _deserializer.deserialize(_serializer.serialize(value))
+    except TypeError as e:
+        raise _error("ValidationException", str(e), "Normalize") from e
+
+
+def _normalize_item(item: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: _normalize(v) for k, v in item.items()}
+
+
+def _order(value: Any) -> Tuple[int, Any]:
+    # key attributes are S, N or B; rank by type so mixed values still sort
+    if isinstance(value, str):
+        return (0, value)
+    if isinstance(value, Decimal):
+        return (1, value)
+    if isinstance(value, Binary):
+        return (2, value.value)
+    return (3, repr(value))
+
+
+def _project(item: Dict[str, Any], projection: Optional[str], names: Optional[Dict[str, str]]) -> Dict[str, Any]:
+    if not projection:
+        return item
+    wanted = []
+    for part in projection.split(","):
+        part = part.strip()
+        wanted.append((names or {}).get(part, part))
+    return {k: item[k] for k in wanted if k in item}
+
+
+class MemoryTable:
+    """
+    A DynamoDB table (and its GSIs) held in a dict. Indexes project ALL
+    attributes and are sparse: items lacking an index key are not in it.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        hash_key: str,
+        range_key: Optional[str] = None,
+        indexes: Optional[Dict[str, Tuple[str, Optional[str]]]] = None,
+        client: Any = None,
+        lock: Optional[threading.RLock] = None,
+    ):
+        self.name = self.table_name = name
+        self.hash_key = hash_key
+        self.range_key = range_key
+        self.indexes = dict(indexes or {})
+        self.meta = SimpleNamespace(client=client)
+        self._lock = lock or threading.RLock()
+        self._items: Dict[Tuple[Any, ...], Dict[str, Any]] = {}
+        # index name (None = table) -> partition value -> primary keys
+        self._partitions: Dict[Optional[str], Dict[Any, set]] = {None: {}, **{i: {} for i in self.indexes}}
+        self._sorted_keys: Optional[List[Tuple[Any, ...]]] = None
+
+    # -- keys ----------------------------------------------------------------
+    def _key_names(self, index: Optional[str] = None) -> Tuple[str, Optional[str]]:
+        if index is None:
+            return self.hash_key, self.range_key
+        if index not in self.indexes:
+            raise _error("ValidationException", f"The table does not have the specified index: {index}", "Query")
+        return self.indexes[index]
+
+    def _primary_key(self, key: Dict[str, Any], operation: str) -> Tuple[Any, ...]:
+        expected = {self.hash_key} | ({self.range_key} if self.range_key else set())
+        if set(key) != expected:
+            raise _error("ValidationException", "The provided key element does not match the schema", operation)
+        key = _normalize_item(key)
+        return tuple(key[n] for n in (self.hash_key, self.range_key) if n)
+
+    def _item_key(self, item: Dict[str, Any], operation: str) -> Tuple[Any, ...]:
+        names = [n for n in (self.hash_key, self.range_key) if n]
+        missing = [n for n in names if n not in item]
+        if missing:
+            raise _error(
+                "ValidationException",
+                f"One or more parameter values were invalid: Missing the key {missing[0]} in the item",
+                operation,
+            )
+        return self._primary_key({n: item[n] for n in names}, operation)
+
+    def _key_order(self, pk: Tuple[Any, ...]) -> Tuple[Tuple[int, Any], ...]:
+        return tuple(_order(v) for v in pk)
+
+    def _key_dict(self, item: Dict[str, Any], index: Optional[str] = None) -> Dict[str, Any]:
+        return {n: copy_value(item[n]) for n in self._all_key_names(index)}
+
+    # -- storage (callers hold the lock) --------------------------------------
+    def _store(self, pk: Tuple[Any, ...], item: Optional[Dict[str, Any]]) -> None:
+        old = self._items.get(pk)
+        if old is not None:
+            for index, partitions in self._partitions.items():
+                value = old.get(self._key_names(index)[0])
+                if value is not None and pk in partitions.get(value, ()):
+                    partitions[value].discard(pk)
+                    if not partitions[value]:
+                        del partitions[value]
+        if item is None:
+            self._items.pop(pk, None)
+        else:
+            self._items[pk] = item
+            for index, partitions in self._partitions.items():
+                hash_key, range_key = self._key_names(index)
+                if hash_key in item and (range_key is None or range_key in item):
+                    partitions.setdefault(item[hash_key], set()).add(pk)
+        if (old is None) != (item is None):
+            self._sorted_keys = None
+
+    def _check(self, current: Optional[Dict[str, Any]], condition, names, values, operation: str) -> None:
+        if condition is None:
+            return
+        try:
+            ok = compile_condition(condition, names, values)(current or {})
+        except ExpressionError as e:
+            raise _error("ValidationException", str(e), operation) from e
+        if not ok:
+            raise _error("ConditionalCheckFailedException", "The conditional request failed", operation)
+
+    # -- item operations -------------------------------------------------------
+    def put_item(
+        self,
+        Item: Dict[str, Any],
+        ConditionExpression=None,
+        ExpressionAttributeNames=None,
+        ExpressionAttributeValues=None,
+        ReturnValues: str = "NONE",
+    ) -> Dict[str, Any]:
+        item = _normalize_item(Item)
+        values = _normalize_item(ExpressionAttributeValues or {})
+        with self._lock:
+            pk = self._item_key(item, "PutItem")
+            old = self._items.get(pk)
+            self._check(old, ConditionExpression, ExpressionAttributeNames, values, "PutItem")
+            self._store(pk, item)
+        return {"Attributes": copy_value(old)} if ReturnValues == "ALL_OLD" and old else {}
+
+    def get_item(self, Key: Dict[str, Any], ConsistentRead: bool = False, ProjectionExpression=None,
+                 ExpressionAttributeNames=None) -> Dict[str, Any]:
+        with self._lock:
+            item = self._items.get(self._primary_key(Key, "GetItem"))
+            if item is None:
+                return {}
+            return {"Item": _project(copy_value(item), ProjectionExpression, ExpressionAttributeNames)}
+
+    def update_item(
+        self,
+        Key: Dict[str, Any],
+        UpdateExpression: Optional[str] = None,
+        ConditionExpression=None,
+        ExpressionAttributeNames=None,
+        ExpressionAttributeValues=None,
+        ReturnValues: str = "NONE",
+    ) -> Dict[str, Any]:
+        values = _normalize_item(ExpressionAttributeValues or {})
+        with self._lock:
+            pk = self._primary_key(Key, "UpdateItem")
+            old = self._items.get(pk)
+            self._check(old, ConditionExpression, ExpressionAttributeNames, values, "UpdateItem")
+            new = copy_value(old) if old is not None else _normalize_item(Key)
+            touched = set()
+            if UpdateExpression:
+                try:
+                    touched = apply_update(new, UpdateExpression, ExpressionAttributeNames, values)
+                except ExpressionError as e:
+                    raise _error("ValidationException", str(e), "UpdateItem") from e
+            if touched & {self.hash_key, self.range_key}:
+                raise _error(
+                    "ValidationException",
+                    "One or more parameter values were invalid: Cannot update attribute "
+                    "that is part of the key",
+                    "UpdateItem",
+                )
+            self._store(pk, new)
+        if ReturnValues == "ALL_NEW":
+            return {"Attributes": copy_value(new)}
+        if ReturnValues == "ALL_OLD":
+            return {"Attributes": copy_value(old)} if old else {}
+        if ReturnValues == "UPDATED_NEW":
+            return {"Attributes": {k: copy_value(new[k]) for k in touched if k in new}}
+        if ReturnValues == "UPDATED_OLD":
+            return {"Attributes": {k: copy_value(old[k]) for k in touched if old and k in old}}
+        return {}
+
+    def delete_item(
+        self,
+        Key: Dict[str, Any],
+        ConditionExpression=None,
+        ExpressionAttributeNames=None,
+        ExpressionAttributeValues=None,
+        ReturnValues: str = "NONE",
+    ) -> Dict[str, Any]:
+        values = _normalize_item(ExpressionAttributeValues or {})
+        with self._lock:
+            pk = self._primary_key(Key, "DeleteItem")
+            old = self._items.get(pk)
+            self._check(old, ConditionExpression, ExpressionAttributeNames, values, "DeleteItem")
+            self._store(pk, None)
+        return {"Attributes": copy_value(old)} if ReturnValues == "ALL_OLD" and old else {}
+
+    # -- reads -------------------------------------------------------------------
+    def query(
+        self,
+        KeyConditionExpression,
+        IndexName: Optional[str] = None,
+        FilterExpression=None,
+        ProjectionExpression: Optional[str] = None,
+        ExpressionAttributeNames=None,
+        ExpressionAttributeValues=None,
+        Limit: Optional[int] = None,
+        ExclusiveStartKey: Optional[Dict[str, Any]] = None,
+        ScanIndexForward: bool = True,
+        Select: Optional[str] = None,
+        ConsistentRead: bool = False,
+    ) -> Dict[str, Any]:
+        hash_key, range_key = self._key_names(IndexName)
+        values = _normalize_item(ExpressionAttributeValues or {})
+        builder = ConditionExpressionBuilder()
+        key_check = self._compile(KeyConditionExpression, ExpressionAttributeNames, values, builder, "Query", True)
+        partition = _partition_value(KeyConditionExpression, hash_key, ExpressionAttributeNames, values)
+        with self._lock:
+            if partition is not None:
+                pks = self._partitions[IndexName].get(partition, ())
+            else:
+                pks = [pk for keys in self._partitions[IndexName].values() for pk in keys]
+            rows = [self._items[pk] for pk in pks]
+            rows = [item for item in rows if key_check(item)]
+
+            def position(item):
+                pk = tuple(_order(item[n]) for n in (self.hash_key, self.range_key) if n)
+                return ((_order(item[range_key]),) if range_key else ()) + pk
+
+            rows.sort(key=position, reverse=not ScanIndexForward)
+            start = 0
+            if ExclusiveStartKey:
+                at = position(self._start_key(ExclusiveStartKey, IndexName, "Query"))
+                positions = [position(item) for item in rows]
+                if ScanIndexForward:
+                    start = bisect.bisect_right(positions, at)
+                else:
+                    start = sum(1 for p in positions if p >= at)
+            return self._page(rows[start:], IndexName, FilterExpression, ExpressionAttributeNames, values,
+                              builder, Limit, ProjectionExpression, Select, "Query")
+
+    def scan(
+        self,
+        FilterExpression=None,
+        IndexName: Optional[str] = None,
+        ProjectionExpression: Optional[str] = None,
+        ExpressionAttributeNames=None,
+        ExpressionAttributeValues=None,
+        Limit: Optional[int] = None,
+        ExclusiveStartKey: Optional[Dict[str, Any]] = None,
+        Segment: Optional[int] = None,
+        TotalSegments: Optional[int] = None,
+        Select: Optional[str] = None,
+        ConsistentRead: bool = False,
+    ) -> Dict[str, Any]:
+        if (Segment is None) != (TotalSegments is None) or (
+            TotalSegments is not None and not 0 <= Segment < TotalSegments
+        ):
+            raise _error("ValidationException", "Segment must be >= 0 and < TotalSegments", "Scan")
+        values = _normalize_item(ExpressionAttributeValues or {})
+        with self._lock:
+            if self._sorted_keys is None:
+                self._sorted_keys = sorted(self._items, key=self._key_order)
+            keys = self._sorted_keys
+            start = 0
+            if ExclusiveStartKey:
+                start_key = self._start_key(ExclusiveStartKey, IndexName, "Scan")
+                at = tuple(_order(start_key[n]) for n in (self.hash_key, self.range_key) if n)
+                start = bisect.bisect_right(keys, at, key=self._key_order)
+            hash_key, range_key = self._key_names(IndexName)
+            rows = []
+            for pk in keys[start:]:
+                item = self._items[pk]
+                if IndexName and (hash_key not in item or (range_key and range_key not in item)):
+                    continue
+                if TotalSegments and zlib.crc32(repr(pk[0]).encode()) % TotalSegments != Segment:
+                    continue
+                rows.append(item)
+            return self._page(rows, IndexName, FilterExpression, ExpressionAttributeNames, values,
+                              ConditionExpressionBuilder(), Limit, ProjectionExpression, Select, "Scan")
+
+    def _compile(self, condition, names, values, builder, operation: str, is_key_condition: bool = False):
+        try:
+            return compile_condition(condition, names, values, builder, is_key_condition=is_key_condition)
+        except ExpressionError as e:
+            raise _error("ValidationException", str(e), operation) from e
+
+    def _start_key(self, start: Dict[str, Any], index: Optional[str], operation: str) -> Dict[str, Any]:
+        if not set(self._all_key_names(index)) <= set(start):
+            raise _error("ValidationException", "The provided starting key is invalid", operation)
+        return _normalize_item(start)
+
+    def _all_key_names(self, index: Optional[str]) -> List[str]:
+        names = [self.hash_key, self.range_key] + (list(self.indexes[index]) if index else [])
+        return list(dict.fromkeys(n for n in names if n))
+
+    def _page(self, rows, index, filter_expr, names, values, builder, limit, projection, select, operation):
+        if limit is not None and int(limit) < 1:
+            raise _error("ValidationException", "Limit must be greater than or equal to 1", operation)
+        keep: Callable[[Dict[str, Any]], bool] = lambda item: True  # noqa: E731
+        if filter_expr is not None:
+            keep = self._compile(filter_expr, names, values, builder, operation)
+        evaluated = rows[:limit] if limit is not None else rows
+        matched = [item for item in evaluated if keep(item)]
+        resp: Dict[str, Any] = {"Count": len(matched), "ScannedCount": len(evaluated)}
+        if select != "COUNT":
+            resp["Items"] = [_project(copy_value(item), projection, names) for item in matched]
+        if limit is not None and len(rows) > len(evaluated):
+            resp["LastEvaluatedKey"] = self._key_dict(evaluated[-1], index)
+        return resp
+
+    # -- maintenance ---------------------------------------------------------------
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            for partitions in self._partitions.values():
+                partitions.clear()
+            self._sorted_keys = None
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+_EQUALITY = re.compile(r"(#?[A-Za-z0-9_]+)\s*=\s*(:[A-Za-z0-9_]+)")
+
+
+def _partition_value(condition, hash_key: str, names, values) -> Any:
+    """
+    The value a key condition pins the partition key to, so a query only
+    looks at that partition. None if it cannot be determined (full pass).
+    """
+    if isinstance(condition, ConditionBase):
+        fmt = condition.get_expression()
+        if fmt["operator"] == "=" and isinstance(fmt["values"][0], Key) and fmt["values"][0].name == hash_key:
+            return _normalize(fmt["values"][1])
+        if fmt["operator"] == "AND":
+            for part in fmt["values"]:
+                found = _partition_value(part, hash_key, names, values)
+                if found is not None:
+                    return found
+        return None
+    for name, placeholder in _EQUALITY.findall(condition or ""):
+        if (names or {}).get(name, name) == hash_key and placeholder in values:
+            return values[placeholder]
+    return None
+
+
+class MemoryDynamoClient:
+    """The low-level client behind table.meta.client: batch operations only."""
+
+    def __init__(self, backend: "MemoryBackend"):
+        self._backend = backend
+
+    def batch_write_item(self, RequestItems: Dict[str, List[Dict[str, Any]]]) -> Dict[str, Any]:
+        total = sum(len(reqs) for reqs in RequestItems.values())
+        if total > DDB_BATCH_WRITE_LIMIT:
+            raise _error("ValidationException", "Too many items requested for the BatchWriteItem call",
+                         "BatchWriteItem")
+        with self._backend.lock:
+            for name, requests in RequestItems.items():
+                target = self._backend.table(name, "BatchWriteItem")
+                for request in requests:
+                    if "PutRequest" in request:
+                        target.put_item(Item=request["PutRequest"]["Item"])
+                    else:
+                        target.delete_item(Key=request["DeleteRequest"]["Key"])
+        return {"UnprocessedItems": {}}
+
+    def batch_get_item(self, RequestItems: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        total = sum(len(spec.get("Keys", [])) for spec in RequestItems.values())
+        if total > DDB_BATCH_GET_LIMIT:
+            raise _error("ValidationException", "Too many items requested for the BatchGetItem call",
+                         "BatchGetItem")
+        responses: Dict[str, List[Dict[str, Any]]] = {}
+        with self._backend.lock:
+            for name, spec in RequestItems.items():
+                target = self._backend.table(name, "BatchGetItem")
+                found = responses.setdefault(name, [])
+                for key in spec.get("Keys", []):
+                    item = target.get_item(
+                        Key=key,
+                        ProjectionExpression=spec.get("ProjectionExpression"),
+                        ExpressionAttributeNames=spec.get("ExpressionAttributeNames"),
+                    ).get("Item")
+                    if item is not None:
+                        found.append(item)
+        return {"Responses": responses, "UnprocessedKeys": {}}
+
+
+def _etag(data: bytes) -> str:
+    return f'"{hashlib.md5(data).hexdigest()}"'
+
+
+def _read_body(body: Any) -> bytes:
+    if body is None:
+        return b""
+    if isinstance(body, str):
+        return body.encode("utf-8")
+    if isinstance(body, (bytes, bytearray, memoryview)):
+        return bytes(body)
+    return body.read()
+
+
+class MemoryS3:
+    """
+    S3 client stand-in: objects and multipart uploads keyed by (bucket, key).
+    """
+
+    _PRESIGN_METHODS = {"get_object": "GET", "head_object": "HEAD", "put_object": "PUT", "upload_part": "PUT"}
+
+    def __init__(self, lock: threading.RLock, base_url: str, secret: str, min_part_size: int = S3_MIN_PART_SIZE):
+        self._lock = lock
+        self.base_url = base_url.rstrip("/")
+        self._secret = secret.encode("utf-8")
+        self.min_part_size = int(min_part_size)
+        self._objects: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._uploads: Dict[str, Dict[str, Any]] = {}
+
+    # -- presigning ------------------------------------------------------------------
+    def _signature(self, method: str, bucket: str, key: str, query: Dict[str, str],
+                   content_type: Optional[str]) -> str:
+        canonical = "\n".join([
+            method.upper(),
+            bucket,
+            key,
+            urlencode(sorted((k, v) for k, v in query.items() if k != "X-Amz-Signature")),
+            content_type or "",
+        ])
+        return hmac.new(self._secret, canonical.encode("utf-8"), hashlib.sha256).hexdigest()
+
+    def generate_presigned_url(
+        self,
+        ClientMethod: str,
+        Params: Optional[Dict[str, Any]] = None,
+        ExpiresIn: int = 3600,
+        HttpMethod: Optional[str] = None,
+    ) -> str:
+        if ClientMethod not in self._PRESIGN_METHODS:
+            raise ValueError(f"memory backend cannot presign {ClientMethod}")
+        params = Params or {}
+        method = HttpMethod or self._PRESIGN_METHODS[ClientMethod]
+        bucket, key = params["Bucket"], params["Key"]
+        query = {"X-Amz-Expires": str(int(ExpiresIn))}
+        if ClientMethod == "upload_part":
+            query["partNumber"] = str(int(params["PartNumber"]))
+            query["uploadId"] = params["UploadId"]
+        content_type = params.get("ContentType")
+        query["X-Amz-SignedHeaders"] = "content-type;host" if content_type else "host"
+        query["X-Amz-Signature"] = self._signature(method, bucket, key, query, content_type)
+        return f"{self.base_url}/{bucket}/{quote(key, safe='/')}?{urlencode(query)}"
+
+    def verify_presigned_url(
+        self,
+        method: str,
+        bucket: str,
+        key: str,
+        query: Dict[str, str],
+        content_type: Optional[str] = None,
+    ) -> bool:
+        """
+        True if `query` carries a signature issued for this method/bucket/key
+        (and Content-Type, when it was signed). URLs do not expire.
+        """
+        signed_type = content_type if "content-type" in query.get("X-Amz-SignedHeaders", "").split(";") else None
+        expected = self._signature(method, bucket, key, query, signed_type)
+        return hmac.compare_digest(expected, query.get("X-Amz-Signature", ""))
+
+    # -- objects ---------------------------------------------------------------------
+    def put_object(self, Bucket: str, Key: str, Body: Any = None, ContentType: Optional[str] = None,
+                   **kwargs: Any) -> Dict[str, Any]:
+        data = _read_body(Body)
+        obj = {
+            "Body": data,
+            "ContentType": ContentType or "binary/octet-stream",
+            "ETag": _etag(data),
+            "LastModified": datetime.now(timezone.utc),
+        }
+        with self._lock:
+            self._objects[(Bucket, Key)] = obj
+        return {"ETag": obj["ETag"]}
+
+    def _object(self, bucket: str, key: str, operation: str) -> Dict[str, Any]:
+        with self._lock:
+            obj = self._objects.get((bucket, key))
+        if obj is None:
+            if operation == "HeadObject":
+                raise _error("404", "Not Found", operation, 404)
+            raise _error("NoSuchKey", "The specified key does not exist.", operation, 404)
+        return obj
+
+    def head_object(self, Bucket: str, Key: str, **kwargs: Any) -> Dict[str, Any]:
+        obj = self._object(Bucket, Key, "HeadObject")
+        return {
+            "ContentLength": len(obj["Body"]),
+            "ContentType": obj["ContentType"],
+            "ETag": obj["ETag"],
+            "LastModified": obj["LastModified"],
+        }
+
+    def get_object(self, Bucket: str, Key: str, **kwargs: Any) -> Dict[str, Any]:
+        obj = self._object(Bucket, Key, "GetObject")
+        return {
+            "Body": io.BytesIO(obj["Body"]),
+            "ContentLength": len(obj["Body"]),
+            "ContentType": obj["ContentType"],
+            "ETag": obj["ETag"],
+            "LastModified": obj["LastModified"],
+        }
+
+    def copy_object(self, Bucket: str, Key: str, CopySource: Dict[str, str], **kwargs: Any) -> Dict[str, Any]:
+        source = self._object(CopySource["Bucket"], CopySource["Key"], "CopyObject")
+        obj = {**source, "LastModified": datetime.now(timezone.utc)}
+        with self._lock:
+            self._objects[(Bucket, Key)] = obj
+        return {"CopyObjectResult": {"ETag": obj["ETag"], "LastModified": obj["LastModified"]}}
+
+    def delete_object(self, Bucket: str, Key: str, **kwargs: Any) -> Dict[str, Any]:
+        with self._lock:
+            self._objects.pop((Bucket, Key), None)
+        return {}
+
+    def delete_objects(self, Bucket: str, Delete: Dict[str, Any], **kwargs: Any) -> Dict[str, Any]:
+        keys = [o["Key"] for o in Delete.get("Objects", [])]
+        if len(keys) > 1000:
+            raise _error("MalformedXML", "The XML you provided was not well-formed", "DeleteObjects")
+        with self._lock:
+            for key in keys:
+                self._objects.pop((Bucket, key), None)
+        return {} if Delete.get("Quiet") else {"Deleted": [{"Key": k} for k in keys]}
+
+    # -- multipart -------------------------------------------------------------------
+    def _upload(self, bucket: str, key: str, upload_id: str, operation: str) -> Dict[str, Any]:
+        upload = self._uploads.get(upload_id)
+        if upload is None or (upload["Bucket"], upload["Key"]) != (bucket, key):
+            raise _error("NoSuchUpload", "The specified upload does not exist.", operation, 404)
+        return upload
+
+    def create_multipart_upload(self, Bucket: str, Key: str, ContentType: Optional[str] = None,
+                                **kwargs: Any) -> Dict[str, Any]:
+        upload_id = uuid.uuid4().hex
+        with self._lock:
+            self._uploads[upload_id] = {
+                "Bucket": Bucket,
+                "Key": Key,
+                "ContentType": ContentType,
+                "Initiated": datetime.now(timezone.utc),
+                "Parts": {},
+            }
+        return {"Bucket": Bucket, "Key": Key, "UploadId": upload_id}
+
+    def upload_part(self, Bucket: str, Key: str, UploadId: str, PartNumber: int, Body: Any = None,
+                    **kwargs: Any) -> Dict[str, Any]:
+        if not 1 <= int(PartNumber) <= 10000:
+            raise _error("InvalidArgument", "Part number must be an integer between 1 and 10000", "UploadPart")
+        data = _read_body(Body)
+        with self._lock:
+            upload = self._upload(Bucket, Key, UploadId, "UploadPart")
+            upload["Parts"][int(PartNumber)] = {
+                "ETag": _etag(data), "Body": data, "LastModified": datetime.now(timezone.utc),
+            }
+        return {"ETag": _etag(data)}
+
+    def list_parts(self, Bucket: str, Key: str, UploadId: str, PartNumberMarker: int = 0, MaxParts: int = 1000,
+                   **kwargs: Any) -> Dict[str, Any]:
+        with self._lock:
+            upload = self._upload(Bucket, Key, UploadId, "ListParts")
+            numbers = sorted(n for n in upload["Parts"] if n > int(PartNumberMarker))
+            page = numbers[:int(MaxParts)]
+            parts = [
+                {
+                    "PartNumber": n,
+                    "ETag": upload["Parts"][n]["ETag"],
+                    "Size": len(upload["Parts"][n]["Body"]),
+                    "LastModified": upload["Parts"][n]["LastModified"],
+                }
+                for n in page
+            ]
+        resp: Dict[str, Any] = {"Parts": parts, "IsTruncated": len(numbers) > len(page)}
+        if resp["IsTruncated"]:
+            resp["NextPartNumberMarker"] = page[-1]
+        return resp
+
+    def complete_multipart_upload(self, Bucket: str, Key: str, UploadId: str,
+                                  MultipartUpload: Dict[str, Any], **kwargs: Any) -> Dict[str, Any]:
+        requested = MultipartUpload.get("Parts", [])
+        numbers = [int(p["PartNumber"]) for p in requested]
+        if not numbers:
+            raise _error("MalformedXML", "The XML you provided was not well-formed", "CompleteMultipartUpload")
+        if numbers != sorted(set(numbers)):
+            raise _error("InvalidPartOrder", "The list of parts was not in ascending order.",
+                         "CompleteMultipartUpload")
+        with self._lock:
+            upload = self._upload(Bucket, Key, UploadId, "CompleteMultipartUpload")
+            chosen = []
+            for i, part in enumerate(requested):
+                stored = upload["Parts"].get(int(part["PartNumber"]))
+                if stored is None or stored["ETag"] != part["ETag"]:
+                    raise _error("InvalidPart", "One or more of the specified parts could not be found.",
+                                 "CompleteMultipartUpload")
+                if i < len(requested) - 1 and len(stored["Body"]) < self.min_part_size:
+                    raise _error("EntityTooSmall", "Your proposed upload is smaller than the minimum allowed size",
+                                 "CompleteMultipartUpload")
+                chosen.append(stored)
+            data = b"".join(p["Body"] for p in chosen)
+            digest = hashlib.md5(b"".join(bytes.fromhex(p["ETag"].strip('"')) for p in chosen)).hexdigest()
+            etag = f'"{digest}-{len(chosen)}"'
+            self._objects[(Bucket, Key)] = {
+                "Body": data,
+                "ContentType": upload["ContentType"] or "binary/octet-stream",
+                "ETag": etag,
+                "LastModified": datetime.now(timezone.utc),
+            }
+            del self._uploads[UploadId]
+        return {"Bucket": Bucket, "Key": Key, "ETag": etag}
+
+    def abort_multipart_upload(self, Bucket: str, Key: str, UploadId: str, **kwargs: Any) -> Dict[str, Any]:
+        with self._lock:
+            self._upload(Bucket, Key, UploadId, "AbortMultipartUpload")
+            del self._uploads[UploadId]
+        return {}
+
+    def list_multipart_uploads(self, Bucket: str, Prefix: str = "", KeyMarker: str = "",
+                               UploadIdMarker: str = "", MaxUploads: int = 1000, **kwargs: Any) -> Dict[str, Any]:
+        with self._lock:
+            uploads = sorted(
+                (u["Key"], upload_id, u["Initiated"])
+                for upload_id, u in self._uploads.items()
+                if u["Bucket"] == Bucket and u["Key"].startswith(Prefix or "")
+            )
+        if KeyMarker:
+            uploads = [u for u in uploads if (u[0], u[1]) > (KeyMarker, UploadIdMarker or "")]
+        page = uploads[:int(MaxUploads)]
+        resp: Dict[str, Any] = {
+            "Uploads": [{"Key": k, "UploadId": i, "Initiated": t} for k, i, t in page],
+            "IsTruncated": len(uploads) > len(page),
+        }
+        if resp["IsTruncated"]:
+            resp["NextKeyMarker"], resp["NextUploadIdMarker"] = page[-1][0], page[-1][1]
+        return resp
+
+    # -- maintenance -----------------------------------------------------------------
+    def clear(self) -> None:
+        with self._lock:
+            self._objects.clear()
+            self._uploads.clear()
+
+    def keys(self, bucket: str) -> List[str]:
+        with self._lock:
+            return sorted(k for b, k in self._objects if b == bucket)
+
+
+def default_tables() -> List[Tuple[str, str, Optional[str], Dict[str, Tuple[str, Optional[str]]]]]:
+    """(name, hash key, range key, {index: (hash key, range key)}) as in create_resources.sh."""
+    return [
+        (DDB_TABLE, "image_id", None, {
+            DDB_USER_INDEX: ("user_id", "created_at"),
+            DDB_CONTENT_TYPE_INDEX: ("content_type", "created_at"),
+            DDB_STATUS_INDEX: ("status", "created_at"),
+        }),
+        (DDB_TAG_TABLE, "tag", "sort_key", {}),
+        (DDB_CONTENT_TABLE, "sha256", None, {}),
+        (DDB_USAGE_TABLE, "user_id", None, {}),
+    ]
+
+
+class MemoryBackend(StorageBackend):
+    """
+    One in-process S3 + DynamoDB. Tables from default_tables() exist from the
+    start; create_table() adds more.
+    """
+
+    name = "memory"
+
+    def __init__(
+        self,
+        presign_base_url: str = MEMORY_PRESIGN_BASE_URL,
+        secret: str = "memory-backend",
+        min_part_size: int = S3_MIN_PART_SIZE,
+    ):
+        self.lock = threading.RLock()
+        self.client = MemoryDynamoClient(self)
+        self._s3 = MemoryS3(self.lock, presign_base_url, secret, min_part_size)
+        self._tables: Dict[str, MemoryTable] = {}
+        for name, hash_key, range_key, indexes in default_tables():
+            self.create_table(name, hash_key, range_key, indexes)
+
+    @property
+    def s3(self) -> MemoryS3:
+        return self._s3
+
+    def create_table(
+        self,
+        name: str,
+        hash_key: str,
+        range_key: Optional[str] = None,
+        indexes: Optional[Dict[str, Tuple[str, Optional[str]]]] = None,
+    ) -> MemoryTable:
+        with self.lock:
+            self._tables[name] = MemoryTable(name, hash_key, range_key, indexes, client=self.client, lock=self.lock)
+            return self._tables[name]
+
+    def table(self, name: str, operation: str = "DescribeTable") -> MemoryTable:
+        try:
+            return self._tables[name]
+        except KeyError:
+            raise _error("ResourceNotFoundException", f"Requested resource not found: Table: {name} not found",
+                         operation) from None
+
+    def reset(self) -> None:
+        """Drop every item and object (tables and indexes stay defined)."""
+        with self.lock:
+            for t in self._tables.values():
+                t.clear()
+            self._s3.clear()
@@ -0,0 +1,302 @@
+# src/metrics.py
+"""
+In-process metrics with Prometheus text exposition.
+
+Counters and histograms are small thread-safe objects held in one registry;
+render() produces the text format served on /metrics. Components that already
+keep their own numbers (connection pools, caches) register a collector that
+is read at scrape time instead of mirroring every update.
+
+Per-request accounting: timed_handler() opens a thread-local scope in which
+every AWS call (recorded by the botocore hooks in src.clients) is added up,
+and logs one structured timing line when the handler returns.
+"""
+import functools
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from .serialization import dumps
+
+logger = logging.getLogger("metrics")
+logger.setLevel(logging.INFO)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# (sample name, labels, value) rows of one metric family
+Samples = List[Tuple[str, Dict[str, str], float]]
+# collector output: (name, type, help, samples)
+Family = Tuple[str, str, str, Samples]
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """
+    Monotonic counter with a fixed set of label names.
+    """
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: Any) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+    def collect(self) -> List[Family]:
+        with self._lock:
+            samples = [(self.name, dict(zip(self.labelnames, k)), v) for k, v in self._values.items()]
+        return [(self.name, self.type, self.help, samples)]
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram (seconds by convention) per label set.
+    """
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # label key -> [bucket counts..., sum, count]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+                    break
+            row[-2] += value
+            row[-1] += 1
+
+    def count(self, **labels: Any) -> int:
+        with self._lock:
+            row = self._values.get(self._key(labels))
+            return int(row[-1]) if row else 0
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+    def collect(self) -> List[Family]:
+        with self._lock:
+            rows = [(dict(zip(self.labelnames, k)), list(v)) for k, v in self._values.items()]
+        samples: Samples = []
+        for labels, row in rows:
+            cumulative = 0
+            for bound, n in zip(self.buckets, row):
+                cumulative += n
+                samples.append((self.name + "_bucket", {**labels, "le": _format_value(bound)}, cumulative))
+            samples.append((self.name + "_sum", labels, row[-2]))
+            samples.append((self.name + "_count", labels, row[-1]))
+        return [(self.name, self.type, self.help, samples)]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[Any] = []
+        self._collectors: List[Callable[[], Iterable[Family]]] = []
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help, labelnames)
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), **kwargs: Any) -> Histogram:
+        metric = Histogram(name, help, labelnames, **kwargs)
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], Iterable[Family]]) -> None:
+        """
+        Register a callable returning (name, type, help, samples) families,
+        evaluated on every render.
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def clear(self) -> None:
+        """Reset every owned metric (collectors report their own state)."""
+        for metric in list(self._metrics):
+            metric.clear()
+
+    def render(self) -> str:
+        families: List[Family] = []
+        for metric in list(self._metrics):
+            families.extend(metric.collect())
+        for collector in list(self._collectors):
+            try:
+                families.extend(collector())
+            except Exception:
+                logger.exception("metrics collector failed")
+        lines: List[str] = []
+        for name, type_, help_, samples in families:
+            lines.append(f"# HELP {name} {help_}")
+            lines.append(f"# TYPE {name} {type_}")
+            for sample, labels, value in samples:
+                lines.append(f"{sample}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+aws_call_seconds = registry.histogram(
+    "aws_call_duration_seconds", "Latency of AWS API calls, retries included", ("service", "operation")
+)
+aws_call_errors = registry.counter(
+    "aws_call_errors_total", "AWS API calls that ended in an error", ("service", "operation", "code")
+)
+aws_retries = registry.counter(
+    "aws_call_retries_total", "Retry attempts made by botocore", ("service", "operation")
+)
+aws_throttles = registry.counter(
+    "aws_call_throttles_total", "AWS API calls that ended throttled", ("service", "operation")
+)
+ddb_items_scanned = registry.counter(
+    "ddb_items_scanned_total", "Items read by Query/Scan before filtering", ("operation",)
+)
+ddb_items_returned = registry.counter(
+    "ddb_items_returned_total", "Items returned by Query/Scan after filtering", ("operation",)
+)
+presign_seconds = registry.histogram(
+    "presign_duration_seconds", "Time to sign a presigned URL (local, no network)", ("method",)
+)
+handler_seconds = registry.histogram(
+    "handler_duration_seconds", "Handler latency by response status", ("handler", "status")
+)
+http_seconds = registry.histogram(
+    "http_request_duration_seconds", "HTTP adapter latency by route", ("method", "route", "status")
+)
+
+_scope = threading.local()
+
+
+def record_aws_call(service: str, operation: str, seconds: float) -> None:
+    aws_call_seconds.observe(seconds, service=service, operation=operation)
+    scope = getattr(_scope, "current", None)
+    if scope is not None:
+        scope["aws_calls"] += 1
+        scope["aws_seconds"] += seconds
+
+
+def bind_scope(fn: Callable) -> Callable:
+    """
+    Wrap fn so the AWS calls it makes on a worker thread are counted in the
+    log line of the handler that submitted it.
+    """
+    scope = getattr(_scope, "current", None)
+
+    @functools.wraps(fn)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        outer = getattr(_scope, "current", None)
+        _scope.current = scope
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _scope.current = outer
+
+    return wrapper
+
+
+@contextmanager
+def timer(histogram: Histogram, **labels: Any) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start, **labels)
+
+
+def timed_handler(fn: Callable) -> Callable:
+    """
+    Time a Lambda-style handler: observe handler_duration_seconds and log one
+    structured line with the status and the AWS time spent inside it.
+    """
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(event=None, context=None):
+        outer = getattr(_scope, "current", None)
+        scope = _scope.current = {"aws_calls": 0, "aws_seconds": 0.0}
+        start = time.perf_counter()
+        status: Optional[int] = 500
+        try:
+            res = fn(event, context)
+            status = res.get("statusCode") if isinstance(res, dict) else None
+            return res
+        finally:
+            elapsed = time.perf_counter() - start
+            _scope.current = outer
+            handler_seconds.observe(elapsed, handler=name, status=status)
+            logger.info(dumps({
+                "event": "request",
+                "handler": name,
+                "status": status,
+                "duration_ms": round(elapsed * 1000, 2),
+                "aws_calls": scope["aws_calls"],
+                "aws_ms": round(scope["aws_seconds"] * 1000, 2),
+            }))
+
+    return wrapper
+
+
+def render() -> str:
+    return registry.render()
@@ -7,6 +7,8 @@ class CreateUploadRequest(BaseModel):
     content_type: constr(min_length=3)
     size: conint(ge=1)
     tags: Optional[List[str]] = None
+    # optional hex SHA-256 of the file; lets the server skip the upload for known content
+    sha256: Optional[constr(pattern=r"^[0-9a-fA-F]{64}$")] = None
 
 class CompleteUploadRequest(BaseModel):
     user_id: constr(min_length=1)
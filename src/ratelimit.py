@@ -0,0 +1,301 @@
+# src/ratelimit.py
+"""
+Admission control for the HTTP adapter.
+
+These checks run before a request reaches FastAPI, cheapest first:
+
+- a cap on requests in flight (RATE_LIMIT_MAX_INFLIGHT): past it, requests
+  are rejected at once rather than queued behind the I/O pool until they
+  time out
+- a token bucket per client address (RATE_LIMIT_IP_RATE tokens/s,
+  RATE_LIMIT_IP_BURST deep), which every request pays into, so a client
+  cannot reset its budget by sending a new user_id each time. The address
+  is the peer's, or behind RATE_LIMIT_TRUSTED_PROXY_HOPS proxies (an ALB is
+  one) the X-Forwarded-For entry that many places from the right: proxies
+  append the address they saw, so entries further left are client-supplied
+- a token bucket per user (RATE_LIMIT_RATE tokens/s, RATE_LIMIT_BURST
+  deep), so one noisy user cannot use up the table's write capacity
+
+All answer 429 with Retry-After. The user is the X-User-Id header, else the
+user_id query parameter, else the user_id of a JSON body (the first item's
+for batches). A batch costs one token per item (`items` or `image_ids`); a
+POST body too large to inspect is charged as the largest batch. One larger
+than a bucket is admitted only from a full bucket and leaves it in debt, so
+the client waits out the whole cost before its next request.
+
+Buckets live in a RateLimitBackend. MemoryRateLimitBackend keeps them in
+the process; deployments with several instances plug in a shared store
+(Redis, DynamoDB) through RATE_LIMIT_BACKEND="package.module:factory".
+"""
+import importlib
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from urllib.parse import parse_qs
+
+from . import metrics
+from .serialization import dumps_bytes
+from .config import (
+    BATCH_DELETE_MAX_ITEMS,
+    BATCH_MAX_ITEMS,
+    RATE_LIMIT_BACKEND,
+    RATE_LIMIT_BURST,
+    RATE_LIMIT_IP_BURST,
+    RATE_LIMIT_IP_RATE,
+    RATE_LIMIT_MAX_INFLIGHT,
+    RATE_LIMIT_MAX_KEYS,
+    RATE_LIMIT_RATE,
+    RATE_LIMIT_TRUSTED_PROXY_HOPS,
+)
+
+# bodies larger than this are not parsed for a user_id and cost (uploads go to
+# S3 directly); it fits the largest batch, BATCH_DELETE_MAX_ITEMS image_ids
+MAX_KEY_BODY_BYTES = 1024 * 1024
+# what a body that is not inspected is charged
+MAX_BATCH_COST = max(BATCH_MAX_ITEMS, BATCH_DELETE_MAX_ITEMS)
+
+rejected = metrics.registry.counter(
+    "http_rejected_total", "Requests rejected by admission control", ("reason",)
+)
+
+
+class RateLimitBackend:
+    """
+    Token buckets keyed by client. take() is async so shared implementations
+    can make a network round trip without blocking the event loop.
+    """
+
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        """
+        Take `cost` tokens from the bucket for `key`. Returns 0.0 if they were
+        taken, else the seconds until the bucket will hold enough. A cost
+        above `burst` is taken from a full bucket, leaving it negative.
+        """
+        raise NotImplementedError
+
+
+class MemoryRateLimitBackend(RateLimitBackend):
+    """
+    Buckets in a dict, least recently used first; past max_keys the oldest are
+    dropped (a dropped client comes back with a full bucket).
+    """
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS, clock: Callable[[], float] = time.monotonic):
+        self.max_keys = int(max_keys)
+        self.clock = clock
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()  # key -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        now = self.clock()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            needed = min(cost, burst)
+            if tokens >= needed:
+                tokens -= cost
+                wait = 0.0
+            else:
+                wait = (needed - tokens) / rate if rate > 0 else math.inf
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+def load_backend(spec: str = RATE_LIMIT_BACKEND) -> RateLimitBackend:
+    if spec == "memory":
+        return MemoryRateLimitBackend()
+    module, sep, attr = spec.partition(":")
+    if not sep:
+        raise ValueError(f"unknown rate limit backend {spec!r} (expected 'memory' or 'module:factory')")
+    return getattr(importlib.import_module(module), attr)()
+
+
+class ConcurrencyLimiter:
+    """Counts requests in flight; never waits. Used from the event loop only."""
+
+    def __init__(self, limit: int):
+        self.limit = int(limit)
+        self.inflight = 0
+
+    def try_acquire(self) -> bool:
+        if self.limit > 0 and self.inflight >= self.limit:
+            return False
+        self.inflight += 1
+        return True
+
+    def release(self) -> None:
+        self.inflight -= 1
+
+
+def _header(scope: Dict[str, Any], name: bytes) -> Optional[str]:
+    for key, value in scope.get("headers") or []:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+def _client_address(scope: Dict[str, Any], trusted_hops: int) -> str:
+    peer = (scope.get("client") or ("unknown", 0))[0]
+    if trusted_hops <= 0:
+        return peer
+    forwarded = [
+        part.strip()
+        for key, value in scope.get("headers") or []
+        if key == b"x-forwarded-for"
+        for part in value.decode("latin-1").split(",")
+    ]
+    forwarded = [part for part in forwarded if part]
+    # fewer entries than proxies: the request did not come through all of them
+    return forwarded[-trusted_hops] if len(forwarded) >= trusted_hops else peer
+
+
+def _query_user(scope: Dict[str, Any]) -> Optional[str]:
+    values = parse_qs((scope.get("query_string") or b"").decode("latin-1")).get("user_id")
+    return values[0] if values else None
+
+
+def _body_key(body: bytes) -> Tuple[Optional[str], int]:
+    """(user_id, cost) from a JSON request body; batches cost one per item or id."""
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return None, 1
+    if not isinstance(payload, dict):
+        return None, 1
+    items = payload.get("items")
+    if isinstance(items, list):
+        first = items[0] if items and isinstance(items[0], dict) else {}
+        return first.get("user_id"), max(1, len(items))
+    image_ids = payload.get("image_ids")
+    if isinstance(image_ids, list):
+        return payload.get("user_id"), max(1, len(image_ids))
+    return payload.get("user_id"), 1
+
+
+class AdmissionControl:
+    """
+    Pure ASGI middleware (no per-request Request/Response objects, so a
+    rejection costs next to nothing). Paths starting with an `exempt` prefix
+    skip both checks.
+    """
+
+    def __init__(
+        self,
+        app: Any,
+        backend: Optional[RateLimitBackend] = None,
+        rate: float = RATE_LIMIT_RATE,
+        burst: float = RATE_LIMIT_BURST,
+        ip_rate: float = RATE_LIMIT_IP_RATE,
+        ip_burst: float = RATE_LIMIT_IP_BURST,
+        max_inflight: int = RATE_LIMIT_MAX_INFLIGHT,
+        trusted_proxy_hops: int = RATE_LIMIT_TRUSTED_PROXY_HOPS,
+        exempt: Tuple[str, ...] = ("/metrics", "/_memory/"),
+    ):
+        self.app = app
+        self.backend = backend if backend is not None else load_backend()
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.ip_rate = float(ip_rate)
+        self.ip_burst = float(ip_burst)
+        self.limiter = ConcurrencyLimiter(max_inflight)
+        self.trusted_proxy_hops = int(trusted_proxy_hops)
+        self.exempt = exempt
+        metrics.registry.add_collector(self._families)
+
+    def _families(self):
+        return [("http_inflight_requests", "gauge", "Requests currently admitted",
+                 [("http_inflight_requests", {}, self.limiter.inflight)])]
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable[[], Awaitable[Dict[str, Any]]], send):
+        if scope["type"] != "http" or scope["path"].startswith(self.exempt):
+            await self.app(scope, receive, send)
+            return
+        if not self.limiter.try_acquire():
+            rejected.inc(reason="concurrency")
+            await _reject(send, {"error": "server busy"}, retry_after=1)
+            return
+        try:
+            user, cost, receive = await self._client_user(scope, receive)
+            client = _client_address(scope, self.trusted_proxy_hops)
+            wait = await self.backend.take(f"ip:{client}", self.ip_rate, self.ip_burst, cost)
+            if not wait and user:
+                wait = await self.backend.take(f"user:{user}", self.rate, self.burst, cost)
+            if wait > 0:
+                rejected.inc(reason="rate")
+                retry_after = math.ceil(wait) if math.isfinite(wait) else 60
+                await _reject(send, {"error": "rate limited", "retry_after": retry_after}, retry_after)
+                return
+            await self.app(scope, receive, send)
+        finally:
+            self.limiter.release()
+
+    async def _client_user(self, scope, receive) -> Tuple[Optional[str], int, Callable]:
+        user = _header(scope, b"x-user-id") or _query_user(scope)
+        cost = 1
+        if scope["method"] == "POST":
+            # the handlers parse any body as JSON, whatever its content-type
+            length = _header(scope, b"content-length")
+            if length is not None and length.isdigit() and int(length) > MAX_KEY_BODY_BYTES:
+                return user, MAX_BATCH_COST, receive
+            body, receive = await _buffer_body(receive, MAX_KEY_BODY_BYTES)
+            if body is None:
+                # no (or a false) content-length and more than the limit sent
+                return user, MAX_BATCH_COST, receive
+            body_user, cost = _body_key(body)
+            user = user or body_user
+        return user, cost, receive
+
+
+async def _buffer_body(receive, limit: int) -> Tuple[Optional[bytes], Callable]:
+    """
+    Read the body and return it with a receive() that replays it. Past
+    `limit` bytes reading stops and the body is None; the receive() then
+    replays what was read and passes the rest through.
+    """
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            # client went away before sending the body; pass that on as-is
+            return b"", _replay(chunks + [message], receive)
+        chunks.append(message)
+        size += len(message.get("body", b""))
+        if size > limit:
+            return None, _replay(chunks, receive)
+        if not message.get("more_body"):
+            break
+    body = b"".join(m.get("body", b"") for m in chunks)
+    return body, _replay([{"type": "http.request", "body": body, "more_body": False}], receive)
+
+
+def _replay(messages, receive):
+    pending = list(messages)
+
+    async def replay():
+        if pending:
+            return pending.pop(0)
+        return await receive()
+
+    return replay
+
+
+async def _reject(send, body: Dict[str, Any], retry_after: int) -> None:
+    payload = dumps_bytes(body)
+    await send({
+        "type": "http.response.start",
+        "status": 429,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(payload)).encode()),
+            (b"retry-after", str(retry_after).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": payload})
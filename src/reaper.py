@@ -0,0 +1,251 @@
+# src/reaper.py
+"""
+Reaper for abandoned uploads.
+
+request_upload writes a "pending" metadata item before the client has sent
+any bytes; a client that never PUTs leaves that row behind, and every scan
+and list pays for it. The reaper walks the status index for pending items
+older than PENDING_REAP_AFTER (longer than any presigned upload URL lives),
+checks a page at a time that the object never arrived, and deletes the dead
+rows with BatchWriteItem, paced to REAPER_MAX_DELETES_PER_SECOND.
+
+Pending items whose object *is* in S3 were uploaded but never completed.
+The reaper completes them itself (handler.verify_upload), which settles
+their pending count and reserved bytes. One that fails verification for
+good (a 4xx: not an image, checksum mismatch, over quota) is deleted with
+its object like a dead item; one that fails for a transient reason is left
+for the next run.
+
+Multipart uploads that received a part more recently than the cutoff are
+skipped: a large upload can outlive the age threshold while its client is
+still sending parts, and deleting its row would orphan the object it is
+about to assemble.
+
+The exit status is 0 when every dead item was deleted and 1 otherwise.
+
+    python -m src.reaper --dry-run
+    python -m src.reaper --max-items 10000
+
+On Lambda, schedule handle_scheduled_event (e.g. an hourly EventBridge rule).
+"""
+import argparse
+import logging
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from . import storage
+from .handler import verify_upload
+from .config import PENDING_REAP_AFTER, REAPER_MAX_DELETES_PER_SECOND, REAPER_PAGE_SIZE
+from .metrics import timed_handler
+from .serialization import dumps
+
+logger = logging.getLogger("reaper")
+logger.setLevel(logging.INFO)
+
+# stop this long before the Lambda deadline so the last batch can finish
+_DEADLINE_MARGIN_SECONDS = 10.0
+
+
+class _Pacer:
+    """
+    Spaces out batches so the long-run rate stays at `rate` deletes per
+    second; the first batch goes out immediately. rate <= 0 disables pacing.
+    """
+
+    def __init__(self, rate: float, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.rate = float(rate)
+        self.clock = clock
+        self.sleep = sleep
+        self._next = clock()
+
+    def wait(self, n: int) -> None:
+        if self.rate <= 0 or n <= 0:
+            return
+        delay = self._next - self.clock()
+        if delay > 0:
+            self.sleep(delay)
+        self._next = max(self._next, self.clock()) + n / self.rate
+
+
+def _still_uploading(items: List[Dict[str, Any]], cutoff: datetime) -> List[str]:
+    """Ids of multipart items whose latest part (ListParts) arrived after cutoff."""
+    active = []
+    for item in items:
+        if not item.get("upload_id"):
+            continue
+        try:
+            last = storage.last_part_uploaded(item["image_id"], item["upload_id"])
+        except Exception:
+            # cannot tell: leave it for the next run rather than guess
+            logger.exception("list_parts failed for %s", item["image_id"])
+            active.append(item["image_id"])
+            continue
+        if last is not None and last >= cutoff:
+            active.append(item["image_id"])
+    return active
+
+
+def _delete_dead(items: List[Dict[str, Any]]) -> List[str]:
+    """Delete the rows (tag entries, usage, variants) of dead items. Returns ids not deleted."""
+    for item in items:
+        if item.get("upload_id"):
+            # a multipart upload that was started but never assembled
+            try:
+                storage.abort_multipart_upload(item["image_id"], item["upload_id"])
+            except Exception:
+                logger.exception("abort_multipart_upload failed for %s", item["image_id"])
+    failed = set(storage.batch_delete_metadata([i["image_id"] for i in items]))
+    # give the never-used reservations back to their owners' usage counters
+    for user_id, delta in storage.usage_delta([i for i in items if i["image_id"] not in failed], -1).items():
+        try:
+            storage.update_usage(user_id, **delta)
+        except Exception:
+            logger.exception("usage update failed for %s", user_id)
+    variant_keys = [
+        k for i in items if i["image_id"] not in failed for k in (i.get("variants") or {}).values()
+    ]
+    if variant_keys:
+        try:
+            if storage.delete_keys(variant_keys):
+                logger.warning("variant cleanup incomplete for reaped items")
+        except Exception:
+            logger.exception("variant cleanup failed for reaped items")
+    tagged = [i for i in items if i.get("tags") and i["image_id"] not in failed]
+    if tagged:
+        try:
+            if storage.unindex_tags(tagged):
+                logger.warning("tag index cleanup incomplete for reaped items")
+        except Exception:
+            logger.exception("tag index cleanup failed for reaped items")
+    return sorted(failed)
+
+
+def _settle_uploaded(items: List[Dict[str, Any]]) -> Tuple[int, List[Dict[str, Any]]]:
+    """
+    Complete uploaded items whose client never did. Returns (settled, rejected):
+    the rejected items failed verification and should be deleted.
+    """
+    settled, rejected = 0, []
+    for item in items:
+        try:
+            res = verify_upload(item["image_id"], large_only=False)
+        except Exception:
+            logger.exception("verify_upload failed for %s", item["image_id"])
+            continue
+        status = 200 if res is None else res["statusCode"]  # None: completed meanwhile
+        if status == 200:
+            settled += 1
+        elif 400 <= status < 500:
+            logger.warning("reaping %s: verification answered %s", item["image_id"], status)
+            rejected.append(item)
+    return settled, rejected
+
+
+def reap_pending(
+    older_than: int = PENDING_REAP_AFTER,
+    max_items: Optional[int] = None,
+    rate: float = REAPER_MAX_DELETES_PER_SECOND,
+    page_size: int = REAPER_PAGE_SIZE,
+    dry_run: bool = False,
+    deadline: Optional[float] = None,
+    pacer: Optional[_Pacer] = None,
+) -> Dict[str, Any]:
+    """
+    Reap pending items created more than `older_than` seconds ago whose object
+    is missing and, for multipart uploads, whose last part is older than that
+    too; complete the ones whose object is there. Stops after examining
+    `max_items` items or at `deadline` (a time.monotonic() value). Returns
+    counters for the run.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=int(older_than))
+    created_before = cutoff.isoformat()
+    pacer = pacer or _Pacer(rate)
+    stats = {
+        "examined": 0, "uploaded": 0, "settled": 0, "rejected": 0, "uploading": 0,
+        "dead": 0, "deleted": 0, "failed": 0, "complete": True,
+    }
+    for page in storage.iter_pending_pages(created_before, page_size=page_size):
+        if max_items is not None:
+            page = page[:max(0, max_items - stats["examined"])]
+        stats["examined"] += len(page)
+        present = set(storage.existing_objects([i["image_id"] for i in page]))
+        stats["uploaded"] += len(present)
+        missing = [i for i in page if i["image_id"] not in present]
+        uploading = set(_still_uploading(missing, cutoff))
+        stats["uploading"] += len(uploading)
+        dead = [i for i in missing if i["image_id"] not in uploading]
+        if present and not dry_run:
+            settled, rejected = _settle_uploaded([i for i in page if i["image_id"] in present])
+            stats["settled"] += settled
+            stats["rejected"] += len(rejected)
+            if rejected:
+                failed_keys = storage.delete_keys([f"images/{i['image_id']}" for i in rejected])
+                dead += [i for i in rejected if f"images/{i['image_id']}" not in failed_keys]
+        stats["dead"] += len(dead)
+        if dead and not dry_run:
+            pacer.wait(len(dead))
+            failed = _delete_dead(dead)
+            stats["deleted"] += len(dead) - len(failed)
+            stats["failed"] += len(failed)
+        if max_items is not None and stats["examined"] >= max_items:
+            stats["complete"] = False
+            break
+        if deadline is not None and time.monotonic() >= deadline:
+            stats["complete"] = False
+            break
+    stats["dry_run"] = dry_run
+    return stats
+
+
+@timed_handler
+def handle_scheduled_event(event=None, context=None):
+    """
+    Lambda entry point for a scheduled run. The event may override
+    older_than_seconds, max_items and dry_run; the run stops short of the
+    invocation's deadline and leaves the rest to the next one.
+    """
+    event = event or {}
+    deadline = None
+    if context is not None and hasattr(context, "get_remaining_time_in_millis"):
+        remaining = context.get_remaining_time_in_millis() / 1000.0
+        deadline = time.monotonic() + max(0.0, remaining - _DEADLINE_MARGIN_SECONDS)
+    max_items = event.get("max_items")
+    try:
+        stats = reap_pending(
+            older_than=int(event.get("older_than_seconds") or PENDING_REAP_AFTER),
+            max_items=int(max_items) if max_items else None,
+            dry_run=bool(event.get("dry_run")),
+            deadline=deadline,
+        )
+    except Exception as e:
+        logger.exception("reap_pending failed")
+        return {"statusCode": 500, "body": dumps({"error": "reap failed", "detail": str(e)})}
+    logger.info(dumps({"event": "reap", **stats}))
+    return {"statusCode": 200, "body": dumps(stats)}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--older-than", type=int, default=PENDING_REAP_AFTER, help="minimum age in seconds")
+    parser.add_argument("--max-items", type=int, help="stop after examining this many pending items")
+    parser.add_argument("--rate", type=float, default=REAPER_MAX_DELETES_PER_SECOND,
+                        help="max deletes per second (0 = unpaced)")
+    parser.add_argument("--dry-run", action="store_true", help="count what would be deleted, delete nothing")
+    args = parser.parse_args(argv)
+    try:
+        stats = reap_pending(
+            older_than=args.older_than, max_items=args.max_items, rate=args.rate, dry_run=args.dry_run
+        )
+    except Exception:
+        logger.exception("reap_pending failed")
+        return 1
+    print(dumps(stats))
+    return 0 if not stats["failed"] else 1
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
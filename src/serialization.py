@@ -0,0 +1,40 @@
+# src/serialization.py
+"""
+Single-pass JSON encoding for handler responses.
+
+DynamoDB returns numbers as Decimal (and sets for SS/NS attributes). Instead
+of rebuilding the whole structure to convert them first, the encoder's
+`default` hook converts each value as it is reached. orjson is used when it is
+installed; the stdlib encoder is the fallback.
+"""
+import json
+from decimal import Decimal
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - exercised only without orjson
+    orjson = None
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, Decimal):
+        # integral values become int, everything else float (as before)
+        if obj == obj.to_integral_value():
+            return int(obj)
+        return float(obj)
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default)
+    return json.dumps(obj, default=_default, separators=(",", ":")).encode("utf-8")
+
+
+def dumps(obj: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default).decode("utf-8")
+    return json.dumps(obj, default=_default, separators=(",", ":"))
@@ -1,46 +1,107 @@
 # src/storage.py
-import os
+import json
+import time
+import queue
+import hashlib
+import base64
 import logging
-from typing import Optional, List, Dict, Any
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Optional, List, Dict, Any, Tuple, Iterator
 from urllib.parse import urlparse, urlunparse
 
-import boto3
+from boto3.dynamodb.conditions import Attr, Key
 from botocore.exceptions import ClientError
 
 from .config import (
-    AWS_REGION,
     S3_BUCKET,
     DDB_TABLE,
+    DDB_USER_INDEX,
+    DDB_CONTENT_TYPE_INDEX,
+    DDB_STATUS_INDEX,
+    DDB_TAG_TABLE,
+    DDB_CONTENT_TABLE,
+    DDB_USAGE_TABLE,
     PRESIGNED_GET_EXPIRES,
     PRESIGNED_PUT_EXPIRES,
+    SCAN_PAGE_SIZE,
+    SCAN_SEGMENTS,
+    SCAN_MAX_WORKERS,
+    METADATA_CACHE_SIZE,
+    METADATA_CACHE_TTL,
+    PRESIGNED_GET_CACHE_SIZE,
+    PRESIGNED_GET_REUSE_MARGIN,
+    DDB_BATCH_MAX_RETRIES,
+    STREAM_CHUNK_SIZE,
+    PRESIGNED_PART_EXPIRES,
+    REAPER_HEAD_WORKERS,
+    LIST_MAX_ROUND_TRIPS,
 )
+from . import metrics
+from .backends import StorageBackend, get_backend
+from .cache import TTLCache
+from .utils import sniff_image_type
 
 logger = logging.getLogger("storage")
 logger.setLevel(logging.INFO)
 
 
-def _endpoint() -> Optional[str]:
-    return os.environ.get("AWS_ENDPOINT_URL")  # e.g. http://localstack:4566 or http://localhost:4566
+# S3 client and tables of the configured backend (STORAGE_BACKEND)
+backend = get_backend()
+s3 = backend.s3
+table = backend.table(DDB_TABLE)
+tag_table = backend.table(DDB_TAG_TABLE)
+content_table = backend.table(DDB_CONTENT_TABLE)
+usage_table = backend.table(DDB_USAGE_TABLE)
 
+# read-through cache for get_item/batch_get_items, holding complete items only:
+# a pending item's status is flipped by whichever container handles its
+# complete, so caching it here would serve a stale 409 (and stale claim and
+# usage state) from every other container for up to the TTL
+metadata_cache = TTLCache(METADATA_CACHE_SIZE, METADATA_CACHE_TTL)
 
-def boto3_client(service: str):
-    endpoint = _endpoint()
-    if endpoint:
-        return boto3.client(service, region_name=AWS_REGION, endpoint_url=endpoint)
-    return boto3.client(service, region_name=AWS_REGION)
 
+def _cache_item(item: Dict[str, Any]) -> None:
+    if item.get("status") == "complete":
+        metadata_cache.set(item["image_id"], item)
 
-def boto3_resource(service: str):
-    endpoint = _endpoint()
-    if endpoint:
-        return boto3.resource(service, region_name=AWS_REGION, endpoint_url=endpoint)
-    return boto3.resource(service, region_name=AWS_REGION)
 
+# presigned GET URLs keyed by image_id, reused until near expiry
+presign_cache = TTLCache(PRESIGNED_GET_CACHE_SIZE, PRESIGNED_GET_EXPIRES - PRESIGNED_GET_REUSE_MARGIN)
 
-# clients / resources
-s3 = boto3_client("s3")
-dynamodb = boto3_resource("dynamodb")
-table = dynamodb.Table(DDB_TABLE)
+
+def use_backend(new_backend: StorageBackend) -> None:
+    """
+    Point this module at another backend (tests, benchmarks) and drop the
+    caches, which would otherwise serve entries from the previous one.
+    """
+    global backend, s3, table, tag_table, content_table, usage_table
+    backend = new_backend
+    s3 = new_backend.s3
+    table = new_backend.table(DDB_TABLE)
+    tag_table = new_backend.table(DDB_TAG_TABLE)
+    content_table = new_backend.table(DDB_CONTENT_TABLE)
+    usage_table = new_backend.table(DDB_USAGE_TABLE)
+    metadata_cache.clear()
+    presign_cache.clear()
+
+
+def _cache_families():
+    caches = {"metadata": metadata_cache.stats(), "presign_get": presign_cache.stats()}
+    families = []
+    for key, type_, help_ in (
+        ("hits", "counter", "Cache lookups served from memory"),
+        ("misses", "counter", "Cache lookups that went to AWS"),
+        ("evictions", "counter", "Entries evicted to stay within maxsize"),
+        ("size", "gauge", "Entries currently cached"),
+    ):
+        name = f"cache_{key}" + ("_total" if type_ == "counter" else "")
+        families.append((name, type_, help_, [(name, {"cache": c}, st[key]) for c, st in caches.items()]))
+    return families
+
+
+metrics.registry.add_collector(_cache_families)
 
 
 def _fix_presigned_host(url: str) -> str:
@@ -63,28 +124,46 @@ def generate_presigned_put(image_id: str, content_type: str, expires: int = PRES
     key = f"images/{image_id}"
     params = {"Bucket": S3_BUCKET, "Key": key, "ContentType": content_type}
 
-    url = s3.generate_presigned_url(
-        ClientMethod="put_object",
-        Params=params,
-        ExpiresIn=int(expires),
-        HttpMethod="PUT",
-    )
+    with metrics.timer(metrics.presign_seconds, method="put_object"):
+        url = s3.generate_presigned_url(
+            ClientMethod="put_object",
+            Params=params,
+            ExpiresIn=int(expires),
+            HttpMethod="PUT",
+        )
     return _fix_presigned_host(url)
 
 
-def generate_presigned_get(image_id: str, expires: int = PRESIGNED_GET_EXPIRES) -> Optional[str]:
+def generate_presigned_get(
+    image_id: str,
+    expires: int = PRESIGNED_GET_EXPIRES,
+    key: Optional[str] = None,
+) -> Optional[str]:
     """
     Return a presigned GET URL for downloading the image (or None if object missing).
+    `key` overrides the S3 key, e.g. to sign a derivative of the image.
+
+    URLs are cached per S3 key and the same URL is handed out until it has less
+    than PRESIGNED_GET_REUSE_MARGIN seconds of validity left, which skips SigV4
+    signing for hot images and keeps the URL stable for CDN caching.
     """
-    key = f"images/{image_id}"
+    key = key or f"images/{image_id}"
+    cached = presign_cache.get(key)
+    if cached is not None and cached[0] == int(expires):
+        return cached[1]
     try:
-        url = s3.generate_presigned_url(
-            ClientMethod="get_object",
-            Params={"Bucket": S3_BUCKET, "Key": key},
-            ExpiresIn=int(expires),
-            HttpMethod="GET",
-        )
-        return _fix_presigned_host(url)
+        with metrics.timer(metrics.presign_seconds, method="get_object"):
+            url = s3.generate_presigned_url(
+                ClientMethod="get_object",
+                Params={"Bucket": S3_BUCKET, "Key": key},
+                ExpiresIn=int(expires),
+                HttpMethod="GET",
+            )
+        url = _fix_presigned_host(url)
+        reuse_for = int(expires) - PRESIGNED_GET_REUSE_MARGIN
+        if reuse_for > 0:
+            presign_cache.set(key, (int(expires), url), ttl=reuse_for)
+        return url
     except ClientError as e:
         # If the underlying error indicates missing key, return None, else re-raise
         code = e.response.get("Error", {}).get("Code", "")
@@ -108,6 +187,161 @@ def head_object(image_id: str) -> Optional[Dict[str, Any]]:
         raise
 
 
+def existing_objects(image_ids: List[str], max_workers: int = REAPER_HEAD_WORKERS) -> List[str]:
+    """
+    The subset of image_ids whose original object exists. S3 has no batch
+    HEAD, so a batch is checked with concurrent HEADs on a short-lived pool.
+    """
+    if not image_ids:
+        return []
+    workers = max(1, min(int(max_workers), len(image_ids)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="s3-head") as pool:
+        heads = list(pool.map(metrics.bind_scope(head_object), image_ids))
+    return [image_id for image_id, head in zip(image_ids, heads) if head]
+
+
+S3_MAX_PARTS = 10000  # multipart upload hard limit
+
+
+def multipart_part_size(size: int, min_part_size: int) -> int:
+    """
+    Smallest part size >= min_part_size (rounded up to 1 MiB) that fits `size`
+    into at most 10000 parts.
+    """
+    mib = 1024 * 1024
+    needed = max(int(min_part_size), -(-int(size) // S3_MAX_PARTS))
+    return -(-needed // mib) * mib
+
+
+def create_multipart_upload(image_id: str, content_type: str) -> str:
+    key = f"images/{image_id}"
+    try:
+        resp = s3.create_multipart_upload(Bucket=S3_BUCKET, Key=key, ContentType=content_type)
+    except ClientError:
+        logger.exception("create_multipart_upload failed for %s", image_id)
+        raise
+    return resp["UploadId"]
+
+
+def generate_presigned_part(
+    image_id: str,
+    upload_id: str,
+    part_number: int,
+    expires: int = PRESIGNED_PART_EXPIRES,
+) -> str:
+    """
+    Return a presigned PUT URL for one part of a multipart upload.
+    """
+    with metrics.timer(metrics.presign_seconds, method="upload_part"):
+        url = s3.generate_presigned_url(
+            ClientMethod="upload_part",
+            Params={
+                "Bucket": S3_BUCKET,
+                "Key": f"images/{image_id}",
+                "UploadId": upload_id,
+                "PartNumber": int(part_number),
+            },
+            ExpiresIn=int(expires),
+            HttpMethod="PUT",
+        )
+    return _fix_presigned_host(url)
+
+
+def _iter_parts(image_id: str, upload_id: str) -> Iterator[Dict[str, Any]]:
+    params: Dict[str, Any] = {"Bucket": S3_BUCKET, "Key": f"images/{image_id}", "UploadId": upload_id}
+    while True:
+        resp = s3.list_parts(**params)
+        yield from resp.get("Parts", [])
+        if not resp.get("IsTruncated"):
+            return
+        params["PartNumberMarker"] = resp["NextPartNumberMarker"]
+
+
+def list_uploaded_parts(image_id: str, upload_id: str) -> List[Dict[str, Any]]:
+    """
+    Return [{"PartNumber", "ETag"}] for every part uploaded so far (paginated).
+    """
+    try:
+        return [{"PartNumber": p["PartNumber"], "ETag": p["ETag"]} for p in _iter_parts(image_id, upload_id)]
+    except ClientError:
+        logger.exception("list_parts failed for %s", image_id)
+        raise
+
+
+def last_part_uploaded(image_id: str, upload_id: str) -> Optional[datetime]:
+    """
+    When the most recent part of a multipart upload arrived, or None if no
+    part has been uploaded or the upload no longer exists.
+    """
+    try:
+        return max((p["LastModified"] for p in _iter_parts(image_id, upload_id)), default=None)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code", "") == "NoSuchUpload":
+            return None
+        logger.exception("list_parts failed for %s", image_id)
+        raise
+
+
+def complete_multipart_upload(image_id: str, upload_id: str, parts: List[Dict[str, Any]]) -> None:
+    try:
+        s3.complete_multipart_upload(
+            Bucket=S3_BUCKET,
+            Key=f"images/{image_id}",
+            UploadId=upload_id,
+            MultipartUpload={"Parts": sorted(parts, key=lambda p: p["PartNumber"])},
+        )
+    except ClientError:
+        logger.exception("complete_multipart_upload failed for %s", image_id)
+        raise
+
+
+def abort_multipart_upload(image_id: str, upload_id: str, key: Optional[str] = None) -> None:
+    try:
+        s3.abort_multipart_upload(Bucket=S3_BUCKET, Key=key or f"images/{image_id}", UploadId=upload_id)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code", "") == "NoSuchUpload":
+            return
+        logger.exception("abort_multipart_upload failed for %s", image_id)
+        raise
+
+
+def abort_stale_multipart_uploads(max_age_seconds: int) -> List[str]:
+    """
+    Abort every incomplete multipart upload under images/ initiated more than
+    max_age_seconds ago. Returns the keys whose uploads were aborted.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=int(max_age_seconds))
+    params: Dict[str, Any] = {"Bucket": S3_BUCKET, "Prefix": "images/"}
+    aborted: List[str] = []
+    while True:
+        resp = s3.list_multipart_uploads(**params)
+        for upload in resp.get("Uploads", []):
+            if upload["Initiated"] < cutoff:
+                abort_multipart_upload(upload["Key"][len("images/"):], upload["UploadId"], key=upload["Key"])
+                aborted.append(upload["Key"])
+        if not resp.get("IsTruncated"):
+            return aborted
+        params["KeyMarker"] = resp.get("NextKeyMarker")
+        params["UploadIdMarker"] = resp.get("NextUploadIdMarker")
+
+
+def clear_upload_id(image_id: str) -> None:
+    """
+    Drop the pending multipart upload_id once the object has been assembled.
+    """
+    try:
+        table.update_item(
+            Key={"image_id": image_id},
+            UpdateExpression="SET updated_at = :now REMOVE upload_id",
+            ExpressionAttributeValues={":now": datetime.now(timezone.utc).isoformat()},
+        )
+    except ClientError:
+        logger.exception("clear_upload_id failed for %s", image_id)
+        raise
+    finally:
+        metadata_cache.invalidate(image_id)
+
+
 def delete_object(image_id: str) -> None:
     key = f"images/{image_id}"
     try:
@@ -115,6 +349,331 @@ def delete_object(image_id: str) -> None:
     except ClientError:
         logger.exception("delete_object failed for %s", image_id)
         raise
+    finally:
+        presign_cache.invalidate(key)
+
+
+def iter_object_chunks(key: str, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[memoryview]:
+    """
+    Stream an object in fixed-size chunks without loading it into memory.
+
+    Every chunk is a memoryview over ONE reused buffer filled with readinto,
+    so there is no per-chunk allocation or copy: a chunk is only valid until
+    the next one is requested (copy it with bytes() if it must be kept).
+    StreamingBody only has readinto from botocore 1.39; older bodies are read
+    with read(chunk_size), one new buffer per chunk.
+    """
+    resp = s3.get_object(Bucket=S3_BUCKET, Key=key)
+    body = resp["Body"]
+    if not hasattr(body, "readinto"):
+        try:
+            while True:
+                chunk = body.read(int(chunk_size))
+                if not chunk:
+                    return
+                yield memoryview(chunk)
+        finally:
+            body.close()
+    buf = memoryview(bytearray(int(chunk_size)))
+    try:
+        while True:
+            filled = 0
+            while filled < len(buf):
+                n = body.readinto(buf[filled:])
+                if not n:
+                    break
+                filled += n
+            if not filled:
+                return
+            yield buf[:filled]
+            if filled < len(buf):
+                return
+    finally:
+        body.close()
+
+
+def inspect_object(image_id: str, chunk_size: int = STREAM_CHUNK_SIZE) -> Dict[str, Any]:
+    """
+    Stream the uploaded object once to compute its SHA-256 and sniff the
+    image type from its header. Memory use is one chunk regardless of size.
+    """
+    digest = hashlib.sha256()
+    header = b""
+    size = 0
+    try:
+        for chunk in iter_object_chunks(f"images/{image_id}", chunk_size):
+            if len(header) < 16:
+                header += bytes(chunk[:16 - len(header)])
+            digest.update(chunk)
+            size += len(chunk)
+    except ClientError:
+        logger.exception("inspect_object failed for %s", image_id)
+        raise
+    return {"sha256": digest.hexdigest(), "size": size, "detected_content_type": sniff_image_type(header)}
+
+
+def record_object_info(image_id: str, info: Dict[str, Any]) -> bool:
+    """
+    Mark an upload complete: flip status from "pending" to "complete" and
+    store checksum / detected type from inspect_object, the object's size and
+    ETag from its HEAD, and the registered object_key when info carries one.
+
+    The flip is conditional, so exactly one complete_upload wins a race.
+    Returns False if the image is gone or was already completed. Any
+    upload_id left behind by a failed clear_upload_id goes with the flip.
+    """
+    expression = "SET #status = :complete, checksum_sha256 = :h, detected_content_type = :t, updated_at = :now"
+    values = {
+        ":complete": "complete",
+        ":pending": "pending",
+        ":h": info["sha256"],
+        ":t": info["detected_content_type"],
+        ":now": datetime.now(timezone.utc).isoformat(),
+    }
+    for attr, field in (("object_key", "object_key"), ("object_size", "object_size"), ("etag", "object_etag")):
+        if info.get(attr) is not None:
+            expression += f", {field} = :{field}"
+            values[f":{field}"] = info[attr]
+    try:
+        table.update_item(
+            Key={"image_id": image_id},
+            UpdateExpression=expression + " REMOVE upload_id",
+            # items written before the status field existed count as pending
+            ConditionExpression=(
+                "attribute_exists(image_id) AND (attribute_not_exists(#status) OR #status = :pending)"
+            ),
+            ExpressionAttributeNames={"#status": "status"},
+            ExpressionAttributeValues=values,
+        )
+    except ClientError as e:
+        if _is_conditional_failure(e):
+            return False
+        logger.exception("record_object_info failed for %s", image_id)
+        raise
+    finally:
+        metadata_cache.invalidate(image_id)
+    return True
+
+
+def object_key(item: Dict[str, Any]) -> str:
+    """
+    S3 key holding an image's bytes: the shared object once its content is
+    registered (see register_content), else the image's own upload key.
+    """
+    return item.get("object_key") or f"images/{item['image_id']}"
+
+
+def _is_conditional_failure(e: ClientError) -> bool:
+    return e.response.get("Error", {}).get("Code") == "ConditionalCheckFailedException"
+
+
+def register_content(sha256: str, key: str, size: int, content_type: Optional[str]) -> bool:
+    """
+    Record `key` as the object for this content hash with one reference.
+    Returns False if the hash is already registered.
+    """
+    try:
+        content_table.put_item(
+            Item={
+                "sha256": sha256,
+                "object_key": key,
+                "size": size,
+                "content_type": content_type,
+                "refcount": 1,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+            },
+            ConditionExpression="attribute_not_exists(sha256)",
+        )
+    except ClientError as e:
+        if _is_conditional_failure(e):
+            return False
+        logger.exception("register_content failed for %s", sha256)
+        raise
+    return True
+
+
+def acquire_content(sha256: str, size: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """
+    Take a reference on registered content and return its record, or None if
+    the hash is unknown, is being released (refcount 0) or has another size.
+    """
+    params: Dict[str, Any] = {
+        "Key": {"sha256": sha256},
+        "UpdateExpression": "ADD refcount :one",
+        "ConditionExpression": "attribute_exists(sha256) AND refcount > :zero",
+        "ExpressionAttributeValues": {":one": 1, ":zero": 0},
+        "ReturnValues": "ALL_NEW",
+    }
+    if size is not None:
+        params["ConditionExpression"] += " AND #size = :size"
+        params["ExpressionAttributeNames"] = {"#size": "size"}
+        params["ExpressionAttributeValues"][":size"] = size
+    try:
+        resp = content_table.update_item(**params)
+    except ClientError as e:
+        if _is_conditional_failure(e):
+            return None
+        logger.exception("acquire_content failed for %s", sha256)
+        raise
+    return resp.get("Attributes")
+
+
+def release_content(sha256: str, count: int = 1) -> Optional[str]:
+    """
+    Drop `count` references. When they were the last ones the hash record is
+    deleted and its object key returned; the caller then deletes the S3 object.
+    """
+    try:
+        resp = content_table.update_item(
+            Key={"sha256": sha256},
+            UpdateExpression="ADD refcount :minus",
+            ConditionExpression="attribute_exists(sha256)",
+            ExpressionAttributeValues={":minus": -int(count)},
+            ReturnValues="ALL_NEW",
+        )
+    except ClientError as e:
+        if _is_conditional_failure(e):
+            return None
+        logger.exception("release_content failed for %s", sha256)
+        raise
+    record = resp.get("Attributes") or {}
+    if record.get("refcount", 0) > 0:
+        return None
+    try:
+        # acquire_content refuses refcount 0, so nobody can revive it meanwhile
+        content_table.delete_item(
+            Key={"sha256": sha256},
+            ConditionExpression="refcount <= :zero",
+            ExpressionAttributeValues={":zero": 0},
+        )
+    except ClientError as e:
+        if _is_conditional_failure(e):
+            return None
+        logger.exception("release_content delete failed for %s", sha256)
+        raise
+    return record.get("object_key")
+
+
+# per-content-type counters are top-level attributes ("type:image/png"),
+# since ADD only works on top-level attributes
+USAGE_TYPE_PREFIX = "type:"
+
+
+def usage_delta(items: List[Dict[str, Any]], sign: int = 1) -> Dict[str, Dict[str, Any]]:
+    """
+    Counter changes per user for adding (sign=1) or removing (sign=-1) these
+    metadata items, as keyword arguments for update_usage. Bytes are the
+    stored object's size once known, else the declared size.
+    """
+    deltas: Dict[str, Dict[str, Any]] = {}
+    for item in items:
+        user_id = item.get("user_id")
+        if not user_id or "status" not in item:
+            # items written before the counters existed were never counted
+            continue
+        delta = deltas.setdefault(user_id, {"images": 0, "size": 0, "pending": 0, "content_types": {}})
+        delta["images"] += sign
+        delta["size"] += sign * int(item.get("object_size") or item.get("size") or 0)
+        if item.get("status") == "pending":
+            delta["pending"] += sign
+        content_type = item.get("content_type")
+        if content_type:
+            delta["content_types"][content_type] = delta["content_types"].get(content_type, 0) + sign
+    return deltas
+
+
+def update_usage(
+    user_id: str,
+    images: int = 0,
+    size: int = 0,
+    pending: int = 0,
+    content_types: Optional[Dict[str, int]] = None,
+    max_images: int = 0,
+    max_bytes: int = 0,
+) -> bool:
+    """
+    Apply deltas to a user's counters in one atomic UpdateItem (ADD). With
+    max_images / max_bytes (0 = no limit) the update only goes through if the
+    new totals stay within them; returns False when it would not.
+    """
+    names = {"#images": "image_count", "#bytes": "total_bytes", "#pending": "pending_count"}
+    values: Dict[str, Any] = {
+        ":images": int(images),
+        ":bytes": int(size),
+        ":pending": int(pending),
+        ":now": datetime.now(timezone.utc).isoformat(),
+    }
+    adds = ["#images :images", "#bytes :bytes", "#pending :pending"]
+    for n, (content_type, delta) in enumerate(sorted((content_types or {}).items())):
+        names[f"#t{n}"] = USAGE_TYPE_PREFIX + content_type
+        values[f":t{n}"] = int(delta)
+        adds.append(f"#t{n} :t{n}")
+    conditions = []
+    for limit, delta, attr, placeholder in (
+        (max_images, images, "#images", ":images_left"),
+        (max_bytes, size, "#bytes", ":bytes_left"),
+    ):
+        if limit > 0 and delta > 0:
+            if delta > limit:
+                return False
+            conditions.append(f"(attribute_not_exists({attr}) OR {attr} <= {placeholder})")
+            values[placeholder] = int(limit) - int(delta)
+    params: Dict[str, Any] = {
+        "Key": {"user_id": user_id},
+        "UpdateExpression": "SET updated_at = :now ADD " + ", ".join(adds),
+        "ExpressionAttributeNames": names,
+        "ExpressionAttributeValues": values,
+    }
+    if conditions:
+        params["ConditionExpression"] = " AND ".join(conditions)
+    try:
+        usage_table.update_item(**params)
+    except ClientError as e:
+        if _is_conditional_failure(e):
+            return False
+        logger.exception("update_usage failed for %s", user_id)
+        raise
+    return True
+
+
+def get_usage(user_id: str) -> Dict[str, Any]:
+    """
+    A user's counters from their single usage item (zeros if they have none).
+    """
+    try:
+        item = usage_table.get_item(Key={"user_id": user_id}).get("Item") or {}
+    except ClientError:
+        logger.exception("get_usage failed for %s", user_id)
+        raise
+    return {
+        "user_id": user_id,
+        "image_count": int(item.get("image_count", 0)),
+        "total_bytes": int(item.get("total_bytes", 0)),
+        "pending_count": int(item.get("pending_count", 0)),
+        "content_types": {
+            name[len(USAGE_TYPE_PREFIX):]: int(count)
+            for name, count in sorted(item.items())
+            if name.startswith(USAGE_TYPE_PREFIX) and count
+        },
+        "updated_at": item.get("updated_at"),
+    }
+
+
+def put_object_bytes(key: str, data: bytes, content_type: str) -> None:
+    try:
+        s3.put_object(Bucket=S3_BUCKET, Key=key, Body=data, ContentType=content_type)
+    except ClientError:
+        logger.exception("put_object failed for %s", key)
+        raise
+
+
+def copy_object(source_key: str, key: str) -> None:
+    """Server-side copy of source_key to key within the bucket."""
+    try:
+        s3.copy_object(Bucket=S3_BUCKET, Key=key, CopySource={"Bucket": S3_BUCKET, "Key": source_key})
+    except ClientError:
+        logger.exception("copy_object failed for %s -> %s", source_key, key)
+        raise
 
 
 def create_metadata(item: Dict[str, Any]) -> None:
@@ -126,30 +685,522 @@ def create_metadata(item: Dict[str, Any]) -> None:
     except ClientError:
         logger.exception("Failed put_item into DynamoDB for item=%s", item.get("image_id"))
         raise
+    finally:
+        metadata_cache.invalidate(item.get("image_id"))
+
+
+DDB_BATCH_WRITE_SIZE = 25  # BatchWriteItem hard limit
+DDB_BATCH_GET_SIZE = 100  # BatchGetItem hard limit
+S3_DELETE_BATCH_SIZE = 1000  # DeleteObjects hard limit
+
+
+def _chunks(seq: List[Any], size: int) -> Iterator[List[Any]]:
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+
+def _batch_write(requests: List[Dict[str, Any]], target=None) -> List[Dict[str, Any]]:
+    """
+    Send WriteRequests via BatchWriteItem in chunks of 25, retrying
+    UnprocessedItems with exponential backoff. Returns the requests that could
+    not be written (after retries, or because their chunk failed outright).
+    `target` defaults to the Images table.
+    """
+    target = target if target is not None else table
+    client = target.meta.client
+    failed: List[Dict[str, Any]] = []
+    for chunk in _chunks(requests, DDB_BATCH_WRITE_SIZE):
+        pending = chunk
+        try:
+            for attempt in range(DDB_BATCH_MAX_RETRIES + 1):
+                resp = client.batch_write_item(RequestItems={target.name: pending})
+                pending = resp.get("UnprocessedItems", {}).get(target.name, [])
+                if not pending or attempt == DDB_BATCH_MAX_RETRIES:
+                    break
+                time.sleep(min(0.05 * 2 ** attempt, 1.0))
+        except ClientError:
+            logger.exception("batch_write_item failed for %d requests", len(pending))
+        failed.extend(pending)
+    return failed
+
+
+def batch_create_metadata(items: List[Dict[str, Any]]) -> List[str]:
+    """
+    Put many items with BatchWriteItem. Returns image_ids that were NOT written.
+    """
+    failed = _batch_write([{"PutRequest": {"Item": item}} for item in items])
+    for item in items:
+        metadata_cache.invalidate(item["image_id"])
+    return [r["PutRequest"]["Item"]["image_id"] for r in failed]
+
+
+def _tag_key(tag: str, item: Dict[str, Any]) -> Dict[str, Any]:
+    return {"tag": tag, "sort_key": f"{item['created_at']}#{item['image_id']}"}
+
+
+def index_tags(items: List[Dict[str, Any]]) -> List[str]:
+    """
+    Write one tag-table entry per (tag, image) pair for the given metadata items.
+    Entries carry the immutable filter fields so tag queries can filter on them.
+    Returns image_ids that have at least one entry NOT written.
+    """
+    requests = []
+    for item in items:
+        for tag in dict.fromkeys(item.get("tags") or []):
+            entry = dict(
+                _tag_key(tag, item),
+                image_id=item["image_id"],
+                user_id=item["user_id"],
+                content_type=item["content_type"],
+                created_at=item["created_at"],
+            )
+            requests.append({"PutRequest": {"Item": entry}})
+    failed = _batch_write(requests, target=tag_table)
+    return list(dict.fromkeys(r["PutRequest"]["Item"]["image_id"] for r in failed))
+
+
+def unindex_tags(items: List[Dict[str, Any]]) -> List[str]:
+    """
+    Remove the tag-table entries of the given metadata items.
+    Returns image_ids that have at least one entry NOT removed.
+    """
+    requests = []
+    keys_by_sort_key: Dict[str, str] = {}
+    for item in items:
+        for tag in dict.fromkeys(item.get("tags") or []):
+            key = _tag_key(tag, item)
+            keys_by_sort_key[key["sort_key"]] = item["image_id"]
+            requests.append({"DeleteRequest": {"Key": key}})
+    failed = _batch_write(requests, target=tag_table)
+    return list(dict.fromkeys(keys_by_sort_key[r["DeleteRequest"]["Key"]["sort_key"]] for r in failed))
 
 
 def get_item(image_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Return the metadata item, or None. Complete items are served from
+    metadata_cache when fresh; pending ones are always read from the table.
+    Callers get their own shallow copy and may add keys (e.g. "url") freely.
+    """
+    cached = metadata_cache.get(image_id)
+    if cached is not None:
+        return dict(cached)
     try:
         resp = table.get_item(Key={"image_id": image_id})
-        return resp.get("Item")
     except ClientError:
         logger.exception("get_item failed for %s", image_id)
         raise
+    item = resp.get("Item")
+    if item is None:
+        return None
+    _cache_item(item)
+    return dict(item)
+
+
+def delete_metadata(image_id: str) -> None:
+    """
+    Delete the metadata item and drop it from metadata_cache. Raises on failure.
+    """
+    try:
+        table.delete_item(Key={"image_id": image_id})
+    except ClientError:
+        logger.exception("delete_item failed for %s", image_id)
+        raise
+    finally:
+        metadata_cache.invalidate(image_id)
+
+
+def batch_get_items(image_ids: List[str]) -> Tuple[Dict[str, Dict[str, Any]], List[str]]:
+    """
+    Fetch many items with BatchGetItem (100 keys per call), serving fresh
+    complete entries from metadata_cache and retrying UnprocessedKeys with
+    backoff.
+
+    Returns (found, failed): found maps image_id -> item copy (missing ids are
+    simply absent); failed lists ids whose lookup errored or stayed unprocessed.
+    """
+    found: Dict[str, Dict[str, Any]] = {}
+    to_fetch: List[str] = []
+    for image_id in dict.fromkeys(image_ids):
+        cached = metadata_cache.get(image_id)
+        if cached is not None:
+            found[image_id] = dict(cached)
+        else:
+            to_fetch.append(image_id)
+
+    client = table.meta.client
+    failed: List[str] = []
+    for chunk in _chunks(to_fetch, DDB_BATCH_GET_SIZE):
+        keys = [{"image_id": image_id} for image_id in chunk]
+        try:
+            for attempt in range(DDB_BATCH_MAX_RETRIES + 1):
+                resp = client.batch_get_item(RequestItems={table.name: {"Keys": keys}})
+                for item in resp.get("Responses", {}).get(table.name, []):
+                    _cache_item(item)
+                    found[item["image_id"]] = dict(item)
+                keys = resp.get("UnprocessedKeys", {}).get(table.name, {}).get("Keys", [])
+                if not keys or attempt == DDB_BATCH_MAX_RETRIES:
+                    break
+                time.sleep(min(0.05 * 2 ** attempt, 1.0))
+        except ClientError:
+            logger.exception("batch_get_item failed for %d keys", len(keys))
+        failed.extend(k["image_id"] for k in keys)
+    return found, failed
+
+
+def batch_delete_metadata(image_ids: List[str]) -> List[str]:
+    """
+    Delete many items with BatchWriteItem. Returns image_ids that were NOT deleted.
+    """
+    failed = _batch_write([{"DeleteRequest": {"Key": {"image_id": i}}} for i in image_ids])
+    for image_id in image_ids:
+        metadata_cache.invalidate(image_id)
+    return [r["DeleteRequest"]["Key"]["image_id"] for r in failed]
+
+
+def delete_keys(keys: List[str]) -> List[str]:
+    """
+    Delete many S3 keys with DeleteObjects (1000 keys per call).
+    Returns the keys whose delete failed.
+    """
+    failed: List[str] = []
+    for chunk in _chunks(list(keys), S3_DELETE_BATCH_SIZE):
+        for key in chunk:
+            presign_cache.invalidate(key)
+        try:
+            resp = s3.delete_objects(
+                Bucket=S3_BUCKET,
+                Delete={"Objects": [{"Key": k} for k in chunk], "Quiet": True},
+            )
+        except ClientError:
+            logger.exception("delete_objects failed for %d keys", len(chunk))
+            failed.extend(chunk)
+            continue
+        failed.extend(err["Key"] for err in resp.get("Errors", []))
+    return failed
+
+
+def batch_delete_objects(image_ids: List[str]) -> List[str]:
+    """
+    Delete the original objects of many images. Returns image_ids whose delete failed.
+    """
+    failed = delete_keys([f"images/{i}" for i in image_ids])
+    return [k[len("images/"):] for k in failed]
+
+
+def set_variants(image_id: str, variants: Dict[str, str]) -> None:
+    """
+    Record derivative S3 keys ({name: key}) on an existing metadata item.
+    """
+    try:
+        table.update_item(
+            Key={"image_id": image_id},
+            UpdateExpression="SET variants = :v, updated_at = :now",
+            ConditionExpression="attribute_exists(image_id)",
+            ExpressionAttributeValues={":v": variants, ":now": datetime.now(timezone.utc).isoformat()},
+        )
+    except ClientError:
+        logger.exception("set_variants failed for %s", image_id)
+        raise
+    finally:
+        metadata_cache.invalidate(image_id)
 
 
 def scan_items() -> List[Dict[str, Any]]:
     """
     Scan the DynamoDB table and return all items (handles pagination).
-    Note: scans can be slow for large tables; acceptable for dev/local use.
+    Note: this materialises the whole table; use iter_items to stream it instead.
+    """
+    return list(iter_items())
+
+
+def encode_cursor(last_key: Optional[Dict[str, Any]]) -> Optional[str]:
+    """
+    Encode a DynamoDB LastEvaluatedKey as an opaque, URL-safe cursor string.
+    """
+    if not last_key:
+        return None
+    raw = json.dumps(last_key, separators=(",", ":"), sort_keys=True).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Dict[str, Any]]:
+    """
+    Decode a cursor produced by encode_cursor. Raises ValueError if it is malformed.
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except Exception as e:
+        raise ValueError("invalid cursor") from e
+    if not isinstance(key, dict) or not key:
+        raise ValueError("invalid cursor")
+    return key
+
+
+def _filter_expression(content_type: Optional[str] = None, tag: Optional[str] = None,
+                       user_id: Optional[str] = None):
+    expr = None
+    for cond in (
+        Attr("user_id").eq(user_id) if user_id else None,
+        Attr("content_type").eq(content_type) if content_type else None,
+        Attr("tags").contains(tag) if tag else None,
+    ):
+        if cond is not None:
+            expr = cond if expr is None else expr & cond
+    return expr
+
+
+def _list_request(
+    user_id: Optional[str] = None,
+    content_type: Optional[str] = None,
+    tag: Optional[str] = None,
+):
+    """
+    Pick the cheapest access path and build its request parameters:
+
+    - tag: query the tag fan-out table, user_id/content_type as filters. A
+      tag partition only holds images carrying that tag, so it is the
+      narrower read even when a user_id is given too: the user's partition
+      would have to be read in full to find the few tagged ones
+    - user_id: query the user/created_at GSI, content_type as filter
+    - content_type: query the content_type/created_at GSI
+    - otherwise: scan
+
+    Returns (operation, params, hydrate, key_attributes); when hydrate is True
+    the pages hold tag-table entries that must be resolved to metadata via
+    _hydrate. key_attributes are the attributes of a LastEvaluatedKey on that
+    path (table key plus index key).
+    """
+    params: Dict[str, Any] = {}
+    if tag:
+        params["KeyConditionExpression"] = Key("tag").eq(tag)
+        params["ScanIndexForward"] = False
+        filter_expr = _filter_expression(content_type, user_id=user_id)
+        op, hydrate, keys = tag_table.query, True, ("tag", "sort_key")
+    elif user_id:
+        params["IndexName"] = DDB_USER_INDEX
+        params["KeyConditionExpression"] = Key("user_id").eq(user_id)
+        params["ScanIndexForward"] = False
+        filter_expr = _filter_expression(content_type)
+        op, hydrate, keys = table.query, False, ("image_id", "user_id", "created_at")
+    elif content_type:
+        params["IndexName"] = DDB_CONTENT_TYPE_INDEX
+        params["KeyConditionExpression"] = Key("content_type").eq(content_type)
+        params["ScanIndexForward"] = False
+        filter_expr = None
+        op, hydrate, keys = table.query, False, ("image_id", "content_type", "created_at")
+    else:
+        filter_expr = None
+        op, hydrate, keys = table.scan, False, ("image_id",)
+    if filter_expr is not None:
+        params["FilterExpression"] = filter_expr
+    return op, params, hydrate, keys
+
+
+def _hydrate(entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Resolve tag-table entries to full metadata items, keeping their order.
+    Entries whose image no longer exists are dropped.
+    """
+    if not entries:
+        return []
+    found, failed = batch_get_items([e["image_id"] for e in entries])
+    if failed:
+        raise RuntimeError(f"batch_get_items could not read {len(failed)} items")
+    return [found[e["image_id"]] for e in entries if e["image_id"] in found]
+
+
+def _check_cursor(start_key: Dict[str, Any], key_attributes: Tuple[str, ...], query: Dict[str, Any]) -> None:
+    """
+    Reject a cursor that is not a key of this listing's access path (wrong
+    attributes, or another user's/type's/tag's partition) with ValueError,
+    before DynamoDB turns it into a ValidationException.
+    """
+    if set(start_key) != set(key_attributes) or not all(isinstance(v, str) and v for v in start_key.values()):
+        raise ValueError("cursor does not match this listing")
+    for name in key_attributes:
+        if query.get(name) is not None and start_key[name] != query[name]:
+            raise ValueError("cursor does not match this listing")
+
+
+def list_items(
+    user_id: Optional[str] = None,
+    content_type: Optional[str] = None,
+    tag: Optional[str] = None,
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    max_round_trips: int = LIST_MAX_ROUND_TRIPS,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Return one page of items plus the cursor for the next page (None when done).
+
+    Filters are served by an index when one exists (see _list_request; results
+    are newest first) and otherwise pushed down as a FilterExpression. A page
+    the filter thins out is topped up with further reads of `limit` items, at
+    most `max_round_trips` in all; past that the page is returned short with
+    a cursor, so cost per call is bounded however selective the filter.
     """
+    op, params, hydrate, key_attributes = _list_request(user_id, content_type, tag)
+    start_key = decode_cursor(cursor)
+    if start_key is not None:
+        _check_cursor(start_key, key_attributes, {"user_id": user_id, "content_type": content_type, "tag": tag})
+    # refills read a full page too: asking for just the missing few turns a
+    # selective filter into one round trip per item
+    params["Limit"] = limit
+
     items: List[Dict[str, Any]] = []
     try:
-        resp = table.scan()
-        items.extend(resp.get("Items", []))
-        while resp.get("LastEvaluatedKey"):
-            resp = table.scan(ExclusiveStartKey=resp["LastEvaluatedKey"])
+        for _ in range(max(1, int(max_round_trips))):
+            if start_key:
+                params["ExclusiveStartKey"] = start_key
+            resp = op(**params)
             items.extend(resp.get("Items", []))
+            start_key = resp.get("LastEvaluatedKey")
+            if not start_key or len(items) >= limit:
+                break
+    except ClientError:
+        logger.exception("list_items failed")
+        raise
+    if len(items) > limit:
+        # the next page starts right after the last item returned
+        items = items[:limit]
+        start_key = {a: items[-1][a] for a in key_attributes}
+    if hydrate:
+        items = _hydrate(items)
+    return items, encode_cursor(start_key)
+
+
+def iter_item_pages(
+    user_id: Optional[str] = None,
+    content_type: Optional[str] = None,
+    tag: Optional[str] = None,
+    page_size: int = SCAN_PAGE_SIZE,
+) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Yield matching items one DynamoDB page at a time. Only the current page is
+    held in memory, so callers that stream results out keep a constant footprint.
+    """
+    op, params, hydrate, _ = _list_request(user_id, content_type, tag)
+    params["Limit"] = int(page_size)
+    try:
+        while True:
+            resp = op(**params)
+            page = resp.get("Items", [])
+            yield _hydrate(page) if hydrate else page
+            if not resp.get("LastEvaluatedKey"):
+                return
+            params["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
     except ClientError:
-        logger.exception("scan_items failed")
+        logger.exception("iter_item_pages failed")
         raise
+
+
+def iter_pending_pages(created_before: str, page_size: int = SCAN_PAGE_SIZE) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Yield pages of items still "pending" that were created before the given
+    ISO timestamp, oldest first, from the status index. Items may be deleted
+    between pages; the query resumes after the last key regardless.
+    """
+    params: Dict[str, Any] = {
+        "IndexName": DDB_STATUS_INDEX,
+        "KeyConditionExpression": Key("status").eq("pending") & Key("created_at").lt(created_before),
+        "Limit": int(page_size),
+    }
+    try:
+        while True:
+            resp = table.query(**params)
+            yield resp.get("Items", [])
+            if not resp.get("LastEvaluatedKey"):
+                return
+            params["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+    except ClientError:
+        logger.exception("iter_pending_pages failed")
+        raise
+
+
+def iter_items(**filters: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Generator over matching items (streaming counterpart of scan_items).
+    """
+    for page in iter_item_pages(**filters):
+        yield from page
+
+
+_SEGMENT_DONE = object()
+
+
+def iter_parallel_scan_pages(
+    total_segments: int = SCAN_SEGMENTS,
+    max_workers: Optional[int] = None,
+    content_type: Optional[str] = None,
+    tag: Optional[str] = None,
+    page_size: int = SCAN_PAGE_SIZE,
+) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Scan the table with DynamoDB parallel scan (Segment/TotalSegments) on a
+    thread pool, yielding pages in arrival order (no ordering across segments).
+
+    A bounded queue between the workers and the consumer applies backpressure,
+    so memory stays at a few pages per worker. Closing the generator early
+    stops the workers; a segment failure is re-raised to the consumer.
+    """
+    total_segments = max(1, int(total_segments))
+    workers = max(1, min(int(max_workers or SCAN_MAX_WORKERS), total_segments))
+    base: Dict[str, Any] = {}
+    filter_expr = _filter_expression(content_type, tag)
+    if filter_expr is not None:
+        base["FilterExpression"] = filter_expr
+    out: "queue.Queue[Any]" = queue.Queue(maxsize=workers * 2)
+    stop = threading.Event()
+
+    def _put(obj: Any) -> None:
+        while not stop.is_set():
+            try:
+                out.put(obj, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _scan_segment(segment: int) -> None:
+        params = dict(base, Segment=segment, TotalSegments=total_segments, Limit=int(page_size))
+        try:
+            while not stop.is_set():
+                resp = table.scan(**params)
+                _put(resp.get("Items", []))
+                if not resp.get("LastEvaluatedKey"):
+                    break
+                params["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+        except Exception as e:
+            logger.exception("parallel scan segment %s/%s failed", segment, total_segments)
+            _put(e)
+        finally:
+            _put(_SEGMENT_DONE)
+
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ddb-scan")
+    try:
+        for segment in range(total_segments):
+            executor.submit(_scan_segment, segment)
+        remaining = total_segments
+        while remaining:
+            obj = out.get()
+            if obj is _SEGMENT_DONE:
+                remaining -= 1
+            elif isinstance(obj, Exception):
+                raise obj
+            else:
+                yield obj
+    finally:
+        stop.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def parallel_scan_items(**kwargs: Any) -> List[Dict[str, Any]]:
+    """
+    Parallel counterpart of scan_items: merge every segment into one list.
+    """
+    items: List[Dict[str, Any]] = []
+    for page in iter_parallel_scan_pages(**kwargs):
+        items.extend(page)
     return items
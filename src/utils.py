@@ -1,3 +1,36 @@
 import uuid
+from typing import Optional
+
+
 def generate_id():
     return str(uuid.uuid4())
+
+
+# (offset, magic bytes, mime type); checked in order
+_IMAGE_SIGNATURES = (
+    (0, b"\xff\xd8\xff", "image/jpeg"),
+    (0, b"\x89PNG\r\n\x1a\n", "image/png"),
+    (0, b"GIF87a", "image/gif"),
+    (0, b"GIF89a", "image/gif"),
+    (0, b"BM", "image/bmp"),
+    (0, b"II*\x00", "image/tiff"),
+    (0, b"MM\x00*", "image/tiff"),
+    (4, b"ftypavif", "image/avif"),
+    (4, b"ftypheic", "image/heic"),
+    (4, b"ftypheix", "image/heic"),
+    (4, b"ftypmif1", "image/heif"),
+)
+
+
+def sniff_image_type(header: bytes) -> Optional[str]:
+    """
+    Detect the image type from the first bytes of a file (16 are enough).
+    Returns a MIME type, or None if the bytes are not a known image format.
+    """
+    header = bytes(header[:16])
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    for offset, magic, mime in _IMAGE_SIGNATURES:
+        if header[offset:offset + len(magic)] == magic:
+            return mime
+    return None
@@ -0,0 +1,35 @@
+# tests/test_async_handler.py
+import asyncio
+import json
+import time
+
+import src.async_handler as async_handler
+import src.handler as handler
+
+
+def parse(res):
+    return res["statusCode"], json.loads(res["body"])
+
+
+def test_async_get_image_matches_sync(monkeypatch):
+    monkeypatch.setattr(handler, "get_item", lambda iid: {"image_id": iid})
+    status, body = parse(asyncio.run(async_handler.get_image({"pathParameters": {"image_id": "i1"}})))
+    assert status == 200
+    assert body == {"image_id": "i1"}
+
+def test_async_handlers_overlap_blocking_io(monkeypatch):
+    def slow_get_item(iid):
+        time.sleep(0.2)
+        return {"image_id": iid}
+    monkeypatch.setattr(handler, "get_item", slow_get_item)
+
+    async def run_many():
+        events = [{"pathParameters": {"image_id": f"i{n}"}} for n in range(10)]
+        return await asyncio.gather(*(async_handler.get_image(e) for e in events))
+
+    start = time.perf_counter()
+    results = asyncio.run(run_many())
+    elapsed = time.perf_counter() - start
+    assert [parse(r)[1]["image_id"] for r in results] == [f"i{n}" for n in range(10)]
+    # serialised on the event loop this would take >= 2s
+    assert elapsed < 1.0
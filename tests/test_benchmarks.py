@@ -0,0 +1,47 @@
+# tests/test_benchmarks.py
+from benchmarks.compare import compare
+
+
+def _report(p99, rps, us):
+    return {
+        "http": [{"scenario": "get_image", "table_size": 100, "concurrency": 8,
+                  "throughput_rps": rps, "latency_ms": {"p99": p99}}],
+        "micro": [{"name": "response_item", "us_per_op": us}],
+    }
+
+def test_compare_flags_regressions_over_threshold():
+    lines, regressed = compare(_report(10.0, 500.0, 2.0), _report(10.5, 490.0, 2.1), threshold=10)
+    assert not regressed
+    assert len(lines) == 3
+
+    _, regressed = compare(_report(10.0, 500.0, 2.0), _report(12.0, 500.0, 2.0), threshold=10)
+    assert regressed
+    _, regressed = compare(_report(10.0, 500.0, 2.0), _report(10.0, 400.0, 2.0), threshold=10)
+    assert regressed
+
+def test_compare_ignores_unmatched_rows():
+    candidate = _report(99.0, 1.0, 99.0)
+    candidate["http"][0]["concurrency"] = 1
+    candidate["micro"][0]["name"] = "new_case"
+    lines, regressed = compare(_report(10.0, 500.0, 2.0), candidate, threshold=10)
+    assert lines == [] and not regressed
+
+def test_compare_covers_coldstart_phases():
+    def cold(ms):
+        return {"coldstart": {"phases": {"import_ms": {"median_ms": ms}}}}
+    lines, regressed = compare(cold(100.0), cold(130.0), threshold=10)
+    assert regressed and lines[0].startswith("coldstart import_ms")
+
+def test_parse_importtime_orders_by_self_time():
+    from benchmarks.coldstart import parse_importtime
+    stderr = (
+        "import time: self [us] | cumulative | imported package\n"
+        "import time:       120 |        120 |   json.decoder\n"
+        "import time:      3000 |       3120 | json\n"
+        "import time:       500 |        500 | other\n"
+    )
+    rows = parse_importtime(stderr, top=2)
+    assert rows == [
+        {"module": "json", "self_ms": 3.0, "cumulative_ms": 3.12},
+        {"module": "other", "self_ms": 0.5, "cumulative_ms": 0.5},
+    ]
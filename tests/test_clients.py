@@ -0,0 +1,39 @@
+# tests/test_clients.py
+import src.clients as clients
+
+
+def test_client_config_from_settings(monkeypatch):
+    monkeypatch.setattr(clients, "AWS_MAX_POOL_CONNECTIONS", 77)
+    monkeypatch.setattr(clients, "AWS_RETRY_MODE", "standard")
+    cfg = clients.client_config()
+    assert cfg.max_pool_connections == 77
+    assert cfg.retries == {"mode": "standard", "max_attempts": clients.AWS_MAX_ATTEMPTS}
+    assert cfg.tcp_keepalive == clients.AWS_TCP_KEEPALIVE
+    assert cfg.connect_timeout == clients.AWS_CONNECT_TIMEOUT
+
+def test_clients_are_shared():
+    s3 = clients.get_client("s3")
+    assert clients.get_client("s3") is s3
+    assert s3.meta.config.max_pool_connections == clients.AWS_MAX_POOL_CONNECTIONS
+    assert "s3" in clients.pool_stats()
+
+def test_pool_metrics_track_in_flight():
+    m = clients.PoolMetrics("svc", 10)
+    m._on_send(request=None)
+    m._on_send(request=None)
+    m._on_response(exception=None)
+    m._on_response(exception=RuntimeError("timeout"))
+    assert m.snapshot() == {
+        "max_pool_connections": 10,
+        "requests": 2,
+        "errors": 1,
+        "in_flight": 0,
+        "peak_in_flight": 2,
+    }
+
+def test_lazy_client_creates_on_first_use(monkeypatch):
+    monkeypatch.delitem(clients._clients, "sts", raising=False)
+    lazy = clients.LazyClient("sts")
+    assert "sts" not in clients._clients
+    assert lazy.meta.service_model.service_name == "sts"
+    assert lazy.meta is clients.get_client("sts").meta
@@ -0,0 +1,131 @@
+# tests/test_derivatives.py
+import io
+import threading
+
+import pytest
+
+import src.derivatives as derivatives
+
+Image = pytest.importorskip("PIL.Image")
+
+
+@pytest.fixture(autouse=True)
+def no_verification(monkeypatch):
+    # already complete: verify_upload has nothing to do
+    monkeypatch.setattr(derivatives, "verify_upload", lambda image_id, **kw: None)
+
+
+def _png(w, h, mode="RGBA"):
+    buf = io.BytesIO()
+    Image.new(mode, (w, h), (10, 20, 30, 255) if mode == "RGBA" else (10, 20, 30)).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+class InlinePool:
+    """Runs submitted work synchronously so tests need no worker processes."""
+    def submit(self, fn, *args):
+        class Done:
+            def result(self_inner):
+                return fn(*args)
+        return Done()
+
+
+def test_parse_sizes():
+    assert derivatives.parse_sizes("thumb:128, medium:512,") == {"thumb": 128, "medium": 512}
+    assert derivatives.parse_sizes("") == {}
+    with pytest.raises(ValueError):
+        derivatives.parse_sizes("thumb")
+    with pytest.raises(ValueError):
+        derivatives.parse_sizes("thumb:0")
+
+def test_render_variants_keeps_aspect_ratio():
+    out = derivatives.render_variants(_png(800, 400), {"thumb": 100, "medium": 400}, "JPEG", 80)
+    sizes = {name: Image.open(io.BytesIO(blob)).size for name, blob in out.items()}
+    assert sizes == {"thumb": (100, 50), "medium": (400, 200)}
+    assert Image.open(io.BytesIO(out["thumb"])).format == "JPEG"
+
+def test_generate_derivatives_stores_and_records(monkeypatch):
+    written, recorded = {}, {}
+    monkeypatch.setattr(derivatives, "get_pool", lambda: InlinePool())
+    data = _png(300, 300, "RGB")
+    chunks = lambda key: (memoryview(data)[i:i + 100] for i in range(0, len(data), 100))
+    monkeypatch.setattr(derivatives.storage, "iter_object_chunks", chunks)
+    monkeypatch.setattr(derivatives.storage, "get_item", lambda iid: {"image_id": iid, "status": "complete"})
+    monkeypatch.setattr(derivatives.storage, "put_object_bytes", lambda k, d, ct: written.__setitem__(k, ct))
+    monkeypatch.setattr(derivatives.storage, "set_variants", lambda iid, v: recorded.update({iid: v}))
+
+    variants = derivatives.generate_derivatives("i1", {"thumb": 64})
+    assert variants == {"thumb": "derived/i1/thumb.jpg"}
+    assert written == {"derived/i1/thumb.jpg": "image/jpeg"}
+    assert recorded == {"i1": variants}
+
+def test_generate_derivatives_skips_recorded_variants(monkeypatch):
+    item = {"image_id": "i1", "status": "complete", "variants": {"thumb": "derived/i1/thumb.jpg"}}
+    monkeypatch.setattr(derivatives.storage, "get_item", lambda iid: item)
+    monkeypatch.setattr(derivatives.storage, "iter_object_chunks", lambda key: pytest.fail("re-read the original"))
+    assert derivatives.generate_derivatives("i1", {"thumb": 64}) == {"thumb": "derived/i1/thumb.jpg"}
+
+def test_generate_derivatives_skips_incomplete_images(monkeypatch):
+    monkeypatch.setattr(derivatives.storage, "get_item", lambda iid: {"image_id": iid, "status": "pending"})
+    monkeypatch.setattr(derivatives.storage, "iter_object_chunks", lambda key: pytest.fail("read an unverified upload"))
+    monkeypatch.setattr(derivatives.storage, "set_variants", lambda iid, v: pytest.fail("recorded variants"))
+    assert derivatives.generate_derivatives("i1", {"thumb": 64}) == {}
+
+def test_in_process_rendering_skips_the_pool(monkeypatch):
+    monkeypatch.setattr(derivatives, "DERIVATIVE_IN_PROCESS", True)
+    monkeypatch.setattr(derivatives, "get_pool", lambda: pytest.fail("started a process pool"))
+    out = derivatives._render(_png(200, 100), {"thumb": 50})
+    assert Image.open(io.BytesIO(out["thumb"])).size == (50, 25)
+
+def test_handle_s3_event(monkeypatch):
+    calls = []
+    def fake_generate(image_id):
+        calls.append(image_id)
+        if image_id == "bad":
+            raise RuntimeError("corrupt")
+        return {}
+    monkeypatch.setattr(derivatives, "generate_derivatives", fake_generate)
+    event = {"Records": [
+        {"s3": {"object": {"key": "images/i1"}}},
+        {"s3": {"object": {"key": "derived/i1/thumb.jpg"}}},
+        {"s3": {"object": {"key": "images/bad"}}},
+    ]}
+    assert derivatives.handle_s3_event(event) == {"processed": ["i1"], "failed": ["bad"]}
+    assert calls == ["i1", "bad"]
+
+def test_process_upload_verifies_before_rendering(monkeypatch):
+    calls = []
+    def verify(iid, large_only=True):
+        calls.append(("verify", large_only))
+        return {"statusCode": 200}
+    monkeypatch.setattr(derivatives, "verify_upload", verify)
+    monkeypatch.setattr(derivatives, "generate_derivatives", lambda iid: calls.append("render") or {})
+    derivatives.process_upload("i1")
+    assert calls == [("verify", False), "render"]
+
+    monkeypatch.setattr(derivatives, "verify_upload", lambda iid, **kw: {"statusCode": 400, "body": "checksum mismatch"})
+    monkeypatch.setattr(derivatives, "generate_derivatives", lambda iid: pytest.fail("rendered unverified"))
+    with pytest.raises(RuntimeError):
+        derivatives.process_upload("i1")
+
+def test_local_queue_processes_in_background(monkeypatch):
+    done = []
+    monkeypatch.setattr(derivatives, "generate_derivatives", done.append)
+    q = derivatives.LocalDerivativeQueue()
+    q.submit("a")
+    q.submit("b")
+    q.join()
+    assert done == ["a", "b"]
+
+def test_local_queue_drops_duplicate_submissions(monkeypatch):
+    release, done = threading.Event(), []
+    def slow(image_id):
+        release.wait(5)
+        done.append(image_id)
+    monkeypatch.setattr(derivatives, "generate_derivatives", slow)
+    q = derivatives.LocalDerivativeQueue()
+    for _ in range(3):
+        q.submit("a")  # e.g. the same upload completed three times
+    release.set()
+    q.join()
+    assert done == ["a"]
@@ -0,0 +1,84 @@
+# tests/test_dynamo.py
+from decimal import Decimal
+
+from boto3.dynamodb.conditions import Attr, Key
+
+from src.dynamo import DocumentClient, Table
+
+
+class RecordingClient:
+    """Low-level client double: records wire params, replays canned responses."""
+    def __init__(self, responses):
+        self.responses = responses
+        self.calls = []
+
+    def __getattr__(self, operation):
+        def call(**params):
+            self.calls.append((operation, params))
+            return self.responses.get(operation, {})
+        return call
+
+
+def test_table_serializes_requests_and_deserializes_responses():
+    client = RecordingClient({"query": {
+        "Items": [{"image_id": {"S": "i1"}, "size": {"N": "3"}}],
+        "LastEvaluatedKey": {"image_id": {"S": "i1"}},
+        "Count": 1,
+        "ScannedCount": 2,
+    }})
+    table = Table("Images", DocumentClient(client))
+    resp = table.query(
+        IndexName="gsi",
+        KeyConditionExpression=Key("user_id").eq("u1"),
+        FilterExpression=Attr("tags").contains("red"),
+        ExclusiveStartKey={"image_id": "i0"},
+        Limit=5,
+    )
+    assert resp["Items"] == [{"image_id": "i1", "size": Decimal(3)}]
+    assert resp["LastEvaluatedKey"] == {"image_id": "i1"} and resp["ScannedCount"] == 2
+
+    op, params = client.calls[0]
+    assert op == "query" and params["TableName"] == "Images" and params["Limit"] == 5
+    assert params["ExclusiveStartKey"] == {"image_id": {"S": "i0"}}
+    # both conditions share one placeholder namespace
+    assert len(set(params["ExpressionAttributeNames"])) == 2
+    assert sorted(params["ExpressionAttributeValues"].values(), key=str) == [{"S": "red"}, {"S": "u1"}]
+
+
+def test_string_expressions_and_item_writes():
+    client = RecordingClient({"update_item": {"Attributes": {"refcount": {"N": "2"}}}})
+    table = Table("ImageContent", DocumentClient(client))
+    resp = table.update_item(
+        Key={"sha256": "h"},
+        UpdateExpression="ADD refcount :one",
+        ConditionExpression="attribute_exists(sha256)",
+        ExpressionAttributeValues={":one": 1},
+        ReturnValues="ALL_NEW",
+    )
+    assert resp["Attributes"] == {"refcount": Decimal(2)}
+    _, params = client.calls[0]
+    assert params["Key"] == {"sha256": {"S": "h"}}
+    assert params["ExpressionAttributeValues"] == {":one": {"N": "1"}}
+    assert "ExpressionAttributeNames" not in params
+
+
+def test_batch_calls_convert_unprocessed_entries():
+    client = RecordingClient({
+        "batch_write_item": {"UnprocessedItems": {"Images": [{"DeleteRequest": {"Key": {"image_id": {"S": "b"}}}}]}},
+        "batch_get_item": {
+            "Responses": {"Images": [{"image_id": {"S": "a"}}]},
+            "UnprocessedKeys": {"Images": {"Keys": [{"image_id": {"S": "b"}}]}},
+        },
+    })
+    docs = Table("Images", DocumentClient(client)).meta.client
+    resp = docs.batch_write_item(RequestItems={"Images": [
+        {"PutRequest": {"Item": {"image_id": "a", "size": 1}}},
+        {"DeleteRequest": {"Key": {"image_id": "b"}}},
+    ]})
+    assert resp["UnprocessedItems"] == {"Images": [{"DeleteRequest": {"Key": {"image_id": "b"}}}]}
+    sent = client.calls[0][1]["RequestItems"]["Images"]
+    assert sent[0] == {"PutRequest": {"Item": {"image_id": {"S": "a"}, "size": {"N": "1"}}}}
+
+    resp = docs.batch_get_item(RequestItems={"Images": {"Keys": [{"image_id": "a"}, {"image_id": "b"}]}})
+    assert resp["Responses"] == {"Images": [{"image_id": "a"}]}
+    assert resp["UnprocessedKeys"] == {"Images": {"Keys": [{"image_id": "b"}]}}
@@ -1,10 +1,18 @@
 # tests/test_handler.py
 import json
 import importlib
+import threading
 import pytest
 
 import src.handler as handler
 
+@pytest.fixture(autouse=True)
+def usage_updates(monkeypatch):
+    """Record counter updates instead of writing them (no table in unit tests)."""
+    calls = []
+    monkeypatch.setattr(handler, "update_usage", lambda user_id, **delta: calls.append((user_id, delta)) or True)
+    return calls
+
 # Helper to parse handler responses
 def parse(res):
     assert "statusCode" in res and "body" in res
@@ -24,8 +32,10 @@ def test_request_upload_success(monkeypatch):
     def fake_presign_put(image_id, content_type):
         return f"https://s3.local/{image_id}"
 
+    indexed = []
     monkeypatch.setattr(handler, "create_metadata", fake_create_metadata)
     monkeypatch.setattr(handler, "generate_presigned_put", fake_presign_put)
+    monkeypatch.setattr(handler, "index_tags", lambda items: indexed.extend(items) or [])
 
     event = {"body": json.dumps(payload)}
     status, body = parse(handler.request_upload(event))
@@ -34,6 +44,51 @@ def test_request_upload_success(monkeypatch):
     assert body["upload_url"].startswith("https://s3.local/")
     assert created["user_id"] == "u1"
     assert created["filename"] == "a.png"
+    assert [i["image_id"] for i in indexed] == [body["image_id"]]
+
+def test_request_upload_counts_usage(monkeypatch, usage_updates):
+    payload = {"user_id": "u1", "filename": "a.png", "content_type": "image/png", "size": 10}
+    monkeypatch.setattr(handler, "create_metadata", lambda item: None)
+    monkeypatch.setattr(handler, "generate_presigned_put", lambda iid, ct: "https://s3.local/x")
+    status, _ = parse(handler.request_upload({"body": json.dumps(payload)}))
+    assert status == 201
+    assert usage_updates == [("u1", {
+        "images": 1, "size": 10, "pending": 1, "content_types": {"image/png": 1},
+        "max_images": handler.USER_QUOTA_IMAGES, "max_bytes": handler.USER_QUOTA_BYTES,
+    })]
+
+def test_request_upload_over_quota(monkeypatch):
+    payload = {"user_id": "u1", "filename": "a.png", "content_type": "image/png", "size": 10}
+    monkeypatch.setattr(handler, "USER_QUOTA_BYTES", 5)
+    monkeypatch.setattr(handler, "update_usage", lambda user_id, max_bytes=0, **delta: delta["size"] <= max_bytes)
+    monkeypatch.setattr(handler, "create_metadata", lambda item: pytest.fail("wrote an item over quota"))
+    status, body = parse(handler.request_upload({"body": json.dumps(payload)}))
+    assert status == 403
+    assert body == {"error": "quota exceeded", "max_images": None, "max_bytes": 5}
+
+def test_request_upload_returns_reservation_on_write_failure(monkeypatch, usage_updates):
+    payload = {"user_id": "u1", "filename": "a.png", "content_type": "image/png", "size": 10}
+    def boom(item):
+        raise RuntimeError("ddb down")
+    monkeypatch.setattr(handler, "create_metadata", boom)
+    status, _ = parse(handler.request_upload({"body": json.dumps(payload)}))
+    assert status == 500
+    assert [d["images"] for _, d in usage_updates] == [1, -1]
+    assert [d["size"] for _, d in usage_updates] == [10, -10]
+
+def test_request_upload_tag_index_failure_rolls_back(monkeypatch, usage_updates):
+    payload = {"user_id": "u1", "filename": "a.png", "content_type": "image/png", "size": 10, "tags": ["t1"]}
+    written, deleted, unindexed = [], [], []
+    monkeypatch.setattr(handler, "create_metadata", written.append)
+    monkeypatch.setattr(handler, "index_tags", lambda items: [items[0]["image_id"]])
+    monkeypatch.setattr(handler, "unindex_tags", lambda items: unindexed.extend(items) or [])
+    monkeypatch.setattr(handler, "batch_delete_metadata", lambda ids: deleted.extend(ids) or [])
+    status, body = parse(handler.request_upload({"body": json.dumps(payload)}))
+    assert status == 500
+    assert body["error"] == "ddb write error"
+    # the row, its tag entries and the usage reservation are all undone
+    assert deleted == [written[0]["image_id"]] and unindexed == written
+    assert [d["images"] for _, d in usage_updates] == [1, -1]
 
 def test_request_upload_invalid_payload():
     event = {"body": "not-a-json"}
@@ -49,6 +104,211 @@ def test_request_upload_too_large(monkeypatch):
     assert status == 413
     assert body["error"] == "file too large"
 
+def test_request_upload_deduplicates_known_content(monkeypatch):
+    payload = {"user_id": "u1", "filename": "a.png", "content_type": "image/png", "size": 10, "sha256": "AB" * 32}
+    created, acquired = {}, []
+    def fake_acquire(sha, size=None):
+        acquired.append((sha, size))
+        return {"object_key": "images/first", "content_type": "image/png"}
+    monkeypatch.setattr(handler, "acquire_content", fake_acquire)
+    monkeypatch.setattr(handler, "create_metadata", created.update)
+    monkeypatch.setattr(handler, "generate_presigned_put", lambda *a: pytest.fail("no upload URL expected"))
+    # no PUT, so no S3 event: the source's variants are copied instead
+    copied, recorded = [], {}
+    source = {"image_id": "first", "variants": {"thumb": "derived/first/thumb.jpg"}}
+    monkeypatch.setattr(handler, "get_item", lambda iid: source if iid == "first" else None)
+    monkeypatch.setattr(handler, "copy_object", lambda src, dst: copied.append((src, dst)))
+    monkeypatch.setattr(handler, "set_variants", recorded.__setitem__)
+    status, body = parse(handler.request_upload({"body": json.dumps(payload)}))
+    assert status == 201
+    assert body == {"image_id": created["image_id"], "deduplicated": True}
+    assert acquired == [("ab" * 32, 10)]
+    assert created["object_key"] == "images/first"
+    assert created["checksum_sha256"] == "ab" * 32
+    thumb = f"derived/{created['image_id']}/thumb.jpg"
+    assert copied == [("derived/first/thumb.jpg", thumb)]
+    assert recorded == {created["image_id"]: {"thumb": thumb}}
+
+def test_request_upload_dedup_miss_uploads_normally(monkeypatch):
+    payload = {"user_id": "u1", "filename": "a.png", "content_type": "image/png", "size": 10, "sha256": "ab" * 32}
+    created = {}
+    monkeypatch.setattr(handler, "acquire_content", lambda sha, size=None: None)
+    monkeypatch.setattr(handler, "create_metadata", created.update)
+    monkeypatch.setattr(handler, "generate_presigned_put", lambda iid, ct: f"https://s3.local/{iid}")
+    status, body = parse(handler.request_upload({"body": json.dumps(payload)}))
+    assert status == 201
+    assert body["deduplicated"] is False
+    assert "object_key" not in created
+    assert created["declared_sha256"] == "ab" * 32
+
+def test_request_upload_dedup_releases_on_write_failure(monkeypatch):
+    payload = {"user_id": "u1", "filename": "a.png", "content_type": "image/png", "size": 10, "sha256": "ab" * 32}
+    released = []
+    def boom(item):
+        raise RuntimeError("ddb down")
+    monkeypatch.setattr(handler, "acquire_content", lambda sha, size=None: {"object_key": "images/first"})
+    monkeypatch.setattr(handler, "create_metadata", boom)
+    monkeypatch.setattr(handler, "release_content", lambda sha, count=1: released.append(sha))
+    status, body = parse(handler.request_upload({"body": json.dumps(payload)}))
+    assert status == 500
+    assert released == ["ab" * 32]
+
+# -----------------------
+# batch_request_upload tests
+# -----------------------
+def test_batch_request_upload_mixed_results(monkeypatch):
+    written = []
+    def fake_batch_create(items):
+        written.extend(items)
+        return [items[1]["image_id"]]  # second valid item left unprocessed
+    indexed = []
+    monkeypatch.setattr(handler, "batch_create_metadata", fake_batch_create)
+    monkeypatch.setattr(handler, "index_tags", lambda items: indexed.extend(items) or [])
+    monkeypatch.setattr(handler, "generate_presigned_put", lambda iid, ct: f"https://s3.local/{iid}")
+    monkeypatch.setattr(handler, "MAX_UPLOAD_SIZE", 100)
+
+    items = [
+        {"user_id": "u1", "filename": "a.png", "content_type": "image/png", "size": 10},
+        {"user_id": "u1", "filename": "b.png"},
+        {"user_id": "u1", "filename": "c.png", "content_type": "image/png", "size": 1000},
+        {"user_id": "u1", "filename": "d.png", "content_type": "image/png", "size": 10, "tags": ["t"]},
+    ]
+    status, body = parse(handler.batch_request_upload({"body": json.dumps({"items": items})}))
+    assert status == 200
+    results = body["results"]
+    assert [r["index"] for r in results] == [0, 1, 2, 3]
+    assert results[0]["upload_url"] == f"https://s3.local/{results[0]['image_id']}"
+    assert results[1]["error"] == "invalid payload"
+    assert results[2]["error"] == "file too large"
+    assert results[3]["error"] == "ddb write error"
+    assert [w["filename"] for w in written] == ["a.png", "d.png"]
+    assert written[1]["tags"] == ["t"]
+    assert indexed == []  # d.png carries the only tag but was not written
+
+@pytest.mark.parametrize("payload,status", [
+    ({}, 400),
+    ({"items": "nope"}, 400),
+    ({"items": []}, 400),
+])
+def test_batch_request_upload_invalid_body(payload, status):
+    code, body = parse(handler.batch_request_upload({"body": json.dumps(payload)}))
+    assert code == status
+    assert body["error"] == "invalid payload"
+
+def test_batch_request_upload_too_many(monkeypatch):
+    monkeypatch.setattr(handler, "BATCH_MAX_ITEMS", 2)
+    item = {"user_id": "u1", "filename": "a.png", "content_type": "image/png", "size": 1}
+    status, body = parse(handler.batch_request_upload({"body": json.dumps({"items": [item] * 3})}))
+    assert status == 413
+    assert body["error"] == "too many items"
+
+# -----------------------
+# multipart upload tests
+# -----------------------
+def test_request_multipart_upload(monkeypatch):
+    created = {}
+    monkeypatch.setattr(handler, "create_multipart_upload", lambda iid, ct: "up-1")
+    monkeypatch.setattr(handler, "create_metadata", created.update)
+    monkeypatch.setattr(handler, "generate_presigned_part", lambda iid, uid, n: f"https://s3.local/{iid}?uploadId={uid}&partNumber={n}")
+    monkeypatch.setattr(handler, "MULTIPART_MIN_PART_SIZE", 8 * 1024 * 1024)
+
+    payload = {"user_id": "u1", "filename": "big.tif", "content_type": "image/tiff", "size": 20 * 1024 * 1024}
+    status, body = parse(handler.request_multipart_upload({"body": json.dumps(payload)}))
+    assert status == 201
+    assert body["upload_id"] == "up-1"
+    assert body["part_size"] == 8 * 1024 * 1024
+    assert [p["part_number"] for p in body["parts"]] == [1, 2, 3]
+    assert body["parts"][2]["url"].endswith("partNumber=3")
+    assert created["upload_id"] == "up-1"
+
+def test_request_multipart_upload_too_large(monkeypatch):
+    monkeypatch.setattr(handler, "MULTIPART_MAX_UPLOAD_SIZE", 100)
+    payload = {"user_id": "u1", "filename": "big.tif", "content_type": "image/tiff", "size": 101}
+    status, body = parse(handler.request_multipart_upload({"body": json.dumps(payload)}))
+    assert status == 413
+
+def _patch_complete_rest(monkeypatch):
+    monkeypatch.setattr(handler, "head_object", lambda iid: {"ContentLength": 10, "ETag": '"e1"'})
+    monkeypatch.setattr(handler, "inspect_object", _fake_inspect())
+    monkeypatch.setattr(handler, "record_object_info", lambda iid, info: True)
+    monkeypatch.setattr(handler, "register_content", lambda *args: True)
+    monkeypatch.setattr(handler, "generate_presigned_get", lambda iid, key=None: f"https://s3.local/{iid}")
+
+def test_complete_multipart_with_client_parts(monkeypatch):
+    completed, cleared = [], []
+    monkeypatch.setattr(handler, "get_item", lambda iid: {"image_id": iid, "upload_id": "up-1"})
+    monkeypatch.setattr(handler, "complete_multipart_upload", lambda iid, uid, parts: completed.append((uid, parts)))
+    monkeypatch.setattr(handler, "clear_upload_id", cleared.append)
+    _patch_complete_rest(monkeypatch)
+
+    event = {"pathParameters": {"image_id": "m1"}, "body": json.dumps({"parts": [{"part_number": 1, "etag": "\"e1\""}]})}
+    status, body = parse(handler.complete_upload(event))
+    assert status == 200
+    assert "upload_id" not in body
+    assert completed == [("up-1", [{"PartNumber": 1, "ETag": "\"e1\""}])]
+    assert cleared == ["m1"]
+
+def test_complete_multipart_lists_parts_when_omitted(monkeypatch):
+    completed = []
+    monkeypatch.setattr(handler, "get_item", lambda iid: {"image_id": iid, "upload_id": "up-1"})
+    monkeypatch.setattr(handler, "list_uploaded_parts", lambda iid, uid: [{"PartNumber": 1, "ETag": "x"}])
+    monkeypatch.setattr(handler, "complete_multipart_upload", lambda iid, uid, parts: completed.append(parts))
+    monkeypatch.setattr(handler, "clear_upload_id", lambda iid: None)
+    _patch_complete_rest(monkeypatch)
+    status, body = parse(handler.complete_upload({"pathParameters": {"image_id": "m1"}}))
+    assert status == 200
+    assert completed == [[{"PartNumber": 1, "ETag": "x"}]]
+
+def test_complete_multipart_already_assembled(monkeypatch):
+    # a previous complete assembled the object but failed to clear upload_id
+    from botocore.exceptions import ClientError
+    def gone(iid, uid, parts):
+        raise ClientError({"Error": {"Code": "NoSuchUpload"}}, "CompleteMultipartUpload")
+    monkeypatch.setattr(handler, "get_item", lambda iid: {"image_id": iid, "upload_id": "up-1"})
+    monkeypatch.setattr(handler, "complete_multipart_upload", gone)
+    monkeypatch.setattr(handler, "clear_upload_id", lambda iid: None)
+    _patch_complete_rest(monkeypatch)
+    event = {"pathParameters": {"image_id": "m1"}, "body": json.dumps({"parts": [{"part_number": 1, "etag": "e"}]})}
+    status, body = parse(handler.complete_upload(event))
+    assert status == 200 and body["status"] == "complete"
+
+    monkeypatch.setattr(handler, "head_object", lambda iid: None)  # nothing assembled: a real failure
+    status, body = parse(handler.complete_upload(event))
+    assert status == 400 and body["error"] == "multipart completion failed"
+
+def test_complete_large_upload_is_verified_out_of_band(monkeypatch):
+    item = {"image_id": "big", "user_id": "u1", "status": "pending"}
+    monkeypatch.setattr(handler, "get_item", lambda iid: dict(item))
+    _patch_complete_rest(monkeypatch)
+    monkeypatch.setattr(handler, "INLINE_VERIFY_MAX_BYTES", 5)  # the fake HEAD reports 10 bytes
+    monkeypatch.setattr(handler, "inspect_object", lambda iid: pytest.fail("hashed inside the request"))
+    status, body = parse(handler.complete_upload({"pathParameters": {"image_id": "big"}}))
+    assert status == 202
+    assert body == {"image_id": "big", "status": "pending", "verification": "queued"}
+
+    # the S3 event pipeline then finishes it
+    monkeypatch.setattr(handler, "inspect_object", _fake_inspect())
+    status, body = parse(handler.verify_upload("big"))
+    assert status == 200 and body["status"] == "complete"
+    monkeypatch.setattr(handler, "INLINE_VERIFY_MAX_BYTES", 100)
+    assert handler.verify_upload("big") is None  # small ones are left to complete_upload
+
+def test_complete_multipart_without_parts(monkeypatch):
+    monkeypatch.setattr(handler, "get_item", lambda iid: {"image_id": iid, "upload_id": "up-1"})
+    monkeypatch.setattr(handler, "list_uploaded_parts", lambda iid, uid: [])
+    monkeypatch.setattr(handler, "head_object", lambda iid: None)
+    status, body = parse(handler.complete_upload({"pathParameters": {"image_id": "m1"}}))
+    assert status == 400
+    assert body["error"] == "no parts uploaded"
+
+def test_abort_stale_uploads(monkeypatch):
+    seen = []
+    monkeypatch.setattr(handler, "abort_stale_multipart_uploads", lambda age: seen.append(age) or ["images/a"])
+    status, body = parse(handler.abort_stale_uploads({"max_age_seconds": 60}))
+    assert status == 200
+    assert body == {"aborted": 1}
+    assert seen == [60]
+
 # -----------------------
 # complete_upload tests
 # -----------------------
@@ -60,6 +320,7 @@ def test_complete_upload_missing_image_id():
 
 def test_complete_upload_not_found(monkeypatch):
     monkeypatch.setattr(handler, "get_item", lambda iid: None)
+    monkeypatch.setattr(handler, "head_object", lambda iid: None)
     event = {"pathParameters": {"image_id": "nope"}}
     status, body = parse(handler.complete_upload(event))
     assert status == 404
@@ -73,15 +334,105 @@ def test_complete_upload_object_missing(monkeypatch):
     assert status == 404
     assert body["error"] == "object missing in s3"
 
+def _fake_inspect(detected="image/png"):
+    return lambda iid: {"sha256": "ab" * 32, "size": 10, "detected_content_type": detected}
+
 def test_complete_upload_success(monkeypatch):
     item = {"image_id": "i1", "user_id": "u1"}
+    recorded = {}
     monkeypatch.setattr(handler, "get_item", lambda iid: item.copy())
-    monkeypatch.setattr(handler, "head_object", lambda iid: True)
-    monkeypatch.setattr(handler, "generate_presigned_get", lambda iid: f"https://s3.local/{iid}")
+    monkeypatch.setattr(handler, "head_object", lambda iid: {"ContentLength": 10, "ETag": '"e1"'})
+    monkeypatch.setattr(handler, "inspect_object", _fake_inspect())
+    monkeypatch.setattr(handler, "record_object_info", lambda iid, info: not recorded.update({iid: info}))
+    monkeypatch.setattr(handler, "register_content", lambda sha, key, size, ct: True)
+    monkeypatch.setattr(handler, "generate_presigned_get", lambda iid, key=None: f"https://s3.local/{key}")
     status, body = parse(handler.complete_upload({"pathParameters": {"image_id": "i1"}}))
     assert status == 200
     assert body["image_id"] == "i1"
-    assert body["url"].startswith("https://s3.local/")
+    assert body["url"] == "https://s3.local/images/i1"
+    assert body["checksum_sha256"] == "ab" * 32
+    assert body["detected_content_type"] == "image/png"
+    assert recorded["i1"]["sha256"] == "ab" * 32
+    assert recorded["i1"]["object_key"] == "images/i1"
+    assert recorded["i1"]["object_size"] == 10 and recorded["i1"]["etag"] == '"e1"'
+    assert body["status"] == "complete"
+    assert body["object_size"] == 10
+
+def test_complete_upload_heads_while_reading_item(monkeypatch):
+    started = threading.Event()
+
+    def slow_get_item(iid):
+        # the HEAD must already be in flight before the item read returns
+        assert started.wait(2)
+        return {"image_id": iid, "status": "pending"}
+
+    def head(iid):
+        started.set()
+        return {"ContentLength": 10, "ETag": '"e1"'}
+
+    monkeypatch.setattr(handler, "get_item", slow_get_item)
+    _patch_complete_rest(monkeypatch)
+    monkeypatch.setattr(handler, "head_object", head)
+    status, body = parse(handler.complete_upload({"pathParameters": {"image_id": "i1"}}))
+    assert status == 200
+    assert body["object_etag"] == '"e1"'
+
+def test_complete_upload_already_complete_skips_checks(monkeypatch):
+    monkeypatch.setattr(handler, "get_item", lambda iid: {"image_id": iid, "status": "complete"})
+    monkeypatch.setattr(handler, "head_object", lambda iid: None)
+    monkeypatch.setattr(handler, "inspect_object", lambda iid: pytest.fail("inspected a complete upload"))
+    monkeypatch.setattr(handler, "generate_presigned_get", lambda iid, key=None: f"https://s3.local/{key}")
+    status, body = parse(handler.complete_upload({"pathParameters": {"image_id": "i1"}}))
+    assert status == 200
+    assert body["url"] == "https://s3.local/images/i1"
+
+def test_complete_upload_lost_race_releases_claim(monkeypatch):
+    released = []
+    items = iter([{"image_id": "i1", "status": "pending"}, {"image_id": "i1", "status": "complete"}])
+    monkeypatch.setattr(handler, "get_item", lambda iid: next(items))
+    _patch_complete_rest(monkeypatch)
+    monkeypatch.setattr(handler, "register_content", lambda *args: False)
+    monkeypatch.setattr(handler, "acquire_content", lambda sha, size=None: {"object_key": "images/i1"})
+    monkeypatch.setattr(handler, "record_object_info", lambda iid, info: False)
+    monkeypatch.setattr(handler, "release_content", lambda sha, count=1: released.append(sha))
+    monkeypatch.setattr(handler, "delete_object", lambda iid: pytest.fail("deleted the winner's object"))
+    status, body = parse(handler.complete_upload({"pathParameters": {"image_id": "i1"}}))
+    assert status == 200
+    assert body["status"] == "complete"
+    assert released == ["ab" * 32]
+
+def test_complete_upload_reuses_existing_content(monkeypatch):
+    deleted, recorded = [], {}
+    monkeypatch.setattr(handler, "get_item", lambda iid: {"image_id": iid})
+    monkeypatch.setattr(handler, "head_object", lambda iid: True)
+    monkeypatch.setattr(handler, "inspect_object", _fake_inspect())
+    monkeypatch.setattr(handler, "register_content", lambda *args: False)
+    monkeypatch.setattr(handler, "acquire_content", lambda sha, size=None: {"object_key": "images/first"})
+    monkeypatch.setattr(handler, "record_object_info", lambda iid, info: not recorded.update(info))
+    monkeypatch.setattr(handler, "delete_object", deleted.append)
+    monkeypatch.setattr(handler, "generate_presigned_get", lambda iid, key=None: f"https://s3.local/{key}")
+    status, body = parse(handler.complete_upload({"pathParameters": {"image_id": "i2"}}))
+    assert status == 200
+    assert body["object_key"] == recorded["object_key"] == "images/first"
+    assert body["url"] == "https://s3.local/images/first"
+    # the duplicate upload is dropped in favour of the shared object
+    assert deleted == ["i2"]
+
+def test_complete_upload_checksum_mismatch(monkeypatch):
+    monkeypatch.setattr(handler, "get_item", lambda iid: {"image_id": iid, "declared_sha256": "cd" * 32})
+    monkeypatch.setattr(handler, "head_object", lambda iid: True)
+    monkeypatch.setattr(handler, "inspect_object", _fake_inspect())
+    status, body = parse(handler.complete_upload({"pathParameters": {"image_id": "i1"}}))
+    assert status == 400
+    assert body["error"] == "checksum mismatch"
+
+def test_complete_upload_rejects_non_image(monkeypatch):
+    monkeypatch.setattr(handler, "get_item", lambda iid: {"image_id": iid})
+    monkeypatch.setattr(handler, "head_object", lambda iid: True)
+    monkeypatch.setattr(handler, "inspect_object", _fake_inspect(detected=None))
+    status, body = parse(handler.complete_upload({"pathParameters": {"image_id": "i1"}}))
+    assert status == 415
+    assert body["error"] == "unsupported media type"
 
 # -----------------------
 # get_image tests
@@ -100,51 +451,199 @@ def test_get_image_not_found(monkeypatch):
 
 def test_get_image_download_true_success(monkeypatch):
     monkeypatch.setattr(handler, "get_item", lambda iid: {"image_id": iid})
-    monkeypatch.setattr(handler, "generate_presigned_get", lambda iid: f"https://s3.local/{iid}")
+    monkeypatch.setattr(handler, "generate_presigned_get", lambda iid, key=None: f"https://s3.local/{key}")
     event = {"pathParameters": {"image_id": "i2"}, "queryStringParameters": {"download": "true"}}
     status, body = parse(handler.get_image(event))
     assert status == 200
     assert "url" in body and body["url"].startswith("https://s3.local/")
 
+def test_get_image_download_pending_upload(monkeypatch):
+    monkeypatch.setattr(handler, "get_item", lambda iid: {"image_id": iid, "status": "pending"})
+    monkeypatch.setattr(handler, "generate_presigned_get", lambda iid, key=None: pytest.fail("signed a pending upload"))
+    event = {"pathParameters": {"image_id": "i2"}, "queryStringParameters": {"download": "true"}}
+    status, body = parse(handler.get_image(event))
+    assert status == 409
+    assert body["error"] == "upload not complete"
+
 def test_get_image_download_true_missing_object(monkeypatch):
     monkeypatch.setattr(handler, "get_item", lambda iid: {"image_id": iid})
-    monkeypatch.setattr(handler, "generate_presigned_get", lambda iid: None)
+    monkeypatch.setattr(handler, "generate_presigned_get", lambda iid, key=None: None)
     event = {"pathParameters": {"image_id": "i2"}, "queryStringParameters": {"download": "true"}}
     status, body = parse(handler.get_image(event))
     assert status == 404
     assert body["error"] == "object missing in s3"
 
+def test_get_image_variant_url(monkeypatch):
+    item = {"image_id": "i3", "variants": {"thumb": "derived/i3/thumb.jpg"}}
+    monkeypatch.setattr(handler, "get_item", lambda iid: dict(item))
+    monkeypatch.setattr(handler, "generate_presigned_get", lambda iid, key=None: f"https://s3.local/{key}")
+    event = {"pathParameters": {"image_id": "i3"}, "queryStringParameters": {"size": "thumb"}}
+    status, body = parse(handler.get_image(event))
+    assert status == 200
+    assert body["url"] == "https://s3.local/derived/i3/thumb.jpg"
+
+    event["queryStringParameters"] = {"size": "huge"}
+    status, body = parse(handler.get_image(event))
+    assert status == 404
+    assert body["error"] == "variant not available"
+
+def test_get_image_etag_and_not_modified(monkeypatch):
+    monkeypatch.setattr(handler, "get_item", lambda iid: {"image_id": iid, "status": "complete"})
+    event = {"pathParameters": {"image_id": "i4"}}
+    res = handler.get_image(event)
+    etag = res["headers"]["ETag"]
+    assert res["statusCode"] == 200
+    assert res["headers"]["Cache-Control"] == "private, no-cache"
+    assert handler.get_image(event)["headers"]["ETag"] == etag  # stable across reads
+
+    # REST API events keep the client's header case; weak tags compare equal
+    res = handler.get_image(dict(event, headers={"If-None-Match": f'"other", W/{etag}'}))
+    assert res["statusCode"] == 304 and res["body"] == ""
+    assert res["headers"]["ETag"] == etag
+
+    # a 304 is decided from stored fields, without encoding the body
+    encode = handler.dumps
+    monkeypatch.setattr(handler, "dumps", lambda body: pytest.fail("encoded the body of a 304"))
+    assert handler.get_image(dict(event, headers={"if-none-match": etag}))["statusCode"] == 304
+    monkeypatch.setattr(handler, "dumps", encode)
+
+    # variants or the status flip stamp updated_at, which turns the ETag over
+    monkeypatch.setattr(handler, "get_item", lambda iid: {"image_id": iid, "status": "complete", "updated_at": "t1"})
+    res = handler.get_image(dict(event, headers={"if-none-match": etag}))
+    assert res["statusCode"] == 200 and res["headers"]["ETag"] != etag
+
+def test_get_image_url_cached_for_presign_margin(monkeypatch):
+    monkeypatch.setattr(handler, "get_item", lambda iid: {"image_id": iid})
+    monkeypatch.setattr(handler, "generate_presigned_get", lambda iid, key=None: f"https://s3.local/{key}")
+    event = {"pathParameters": {"image_id": "i2"}, "queryStringParameters": {"download": "true"}}
+    res = handler.get_image(event)
+    assert res["headers"]["Cache-Control"] == f"private, max-age={handler.URL_MAX_AGE}"
+
 # -----------------------
 # list_images_handler tests
 # -----------------------
-def test_list_images_scan_error(monkeypatch):
-    def fake_scan():
+def test_list_images_storage_error(monkeypatch):
+    def fake_list(**kwargs):
         raise RuntimeError("boom")
-    monkeypatch.setattr(handler, "scan_items", fake_scan)
+    monkeypatch.setattr(handler, "list_items", fake_list)
     status, body = parse(handler.list_images_handler({}))
     assert status == 500
-    assert body["error"] == "scan_items failed"
+    assert body["error"] == "list_items failed"
 
-def test_list_images_filters(monkeypatch):
-    items = [
-        {"image_id": "a", "user_id": "u1", "content_type": "image/png", "tags": ["t1"]},
-        {"image_id": "b", "user_id": "u2", "content_type": "image/jpeg", "tags": ["t2"]},
-        {"image_id": "c", "user_id": "u1", "content_type": "image/png", "tags": ["t2","t1"]},
-    ]
-    monkeypatch.setattr(handler, "scan_items", lambda: items.copy())
+def test_list_images_passes_filters_and_cursor(monkeypatch):
+    calls = []
+    def fake_list(**kwargs):
+        calls.append(kwargs)
+        return [{"image_id": "a", "user_id": "u1", "size": 3}], "next-page"
+    monkeypatch.setattr(handler, "list_items", fake_list)
 
-    status, body = parse(handler.list_images_handler({"queryStringParameters": {"user_id": "u1"}}))
+    qs = {"user_id": "u1", "content_type": "image/png", "tag": "t1", "limit": "5", "cursor": "abc"}
+    status, body = parse(handler.list_images_handler({"queryStringParameters": qs}))
     assert status == 200
-    assert len(body["items"]) == 2
+    assert body["items"][0]["image_id"] == "a"
+    assert body["next_cursor"] == "next-page"
+    assert calls[0] == {"user_id": "u1", "content_type": "image/png", "tag": "t1", "limit": 5, "cursor": "abc"}
 
-    status, body = parse(handler.list_images_handler({"queryStringParameters": {"content_type": "image/jpeg"}}))
-    assert status == 200
-    assert len(body["items"]) == 1
-    assert body["items"][0]["image_id"] == "b"
+def test_list_images_not_modified(monkeypatch):
+    monkeypatch.setattr(handler, "list_items", lambda **kwargs: ([{"image_id": "a"}], None))
+    event = {"queryStringParameters": {"user_id": "u1"}}
+    etag = handler.list_images_handler(event)["headers"]["ETag"]
+    res = handler.list_images_handler(dict(event, headers={"if-none-match": etag}))
+    assert res["statusCode"] == 304
+    assert handler.list_images_handler(dict(event, headers={"if-none-match": '"stale"'}))["statusCode"] == 200
+    # a completed item or a new next page changes the ETag
+    for page in (([{"image_id": "a", "status": "complete"}], None), ([{"image_id": "a"}], "more")):
+        monkeypatch.setattr(handler, "list_items", lambda page=page, **kwargs: page)
+        assert handler.list_images_handler(dict(event, headers={"if-none-match": etag}))["statusCode"] == 200
+
+def test_list_images_limit_defaults_and_caps(monkeypatch):
+    calls = []
+    def fake_list(**kwargs):
+        calls.append(kwargs)
+        return [], None
+    monkeypatch.setattr(handler, "list_items", fake_list)
+    monkeypatch.setattr(handler, "LIST_MAX_LIMIT", 50)
 
-    status, body = parse(handler.list_images_handler({"queryStringParameters": {"tag": "t1"}}))
+    status, body = parse(handler.list_images_handler({}))
     assert status == 200
-    assert len(body["items"]) == 2
+    assert body == {"items": [], "next_cursor": None}
+    assert calls[0]["limit"] == handler.LIST_DEFAULT_LIMIT
+
+    parse(handler.list_images_handler({"queryStringParameters": {"limit": "1000"}}))
+    assert calls[1]["limit"] == 50
+
+def test_list_images_invalid_limit():
+    status, body = parse(handler.list_images_handler({"queryStringParameters": {"limit": "x"}}))
+    assert status == 400
+    assert body["error"] == "invalid limit"
+
+def test_list_images_invalid_cursor(monkeypatch):
+    def fake_list(**kwargs):
+        raise ValueError("invalid cursor")
+    monkeypatch.setattr(handler, "list_items", fake_list)
+    status, body = parse(handler.list_images_handler({"queryStringParameters": {"cursor": "???"}}))
+    assert status == 400
+    assert body["error"] == "invalid cursor"
+
+# -----------------------
+# stream_images_handler tests
+# -----------------------
+def test_stream_images_ndjson(monkeypatch):
+    from decimal import Decimal
+    pages = [[{"image_id": "a", "size": Decimal("3")}], [], [{"image_id": "b", "size": Decimal("1.5")}]]
+    seen = {}
+    def fake_pages(**kwargs):
+        seen.update(kwargs)
+        return iter(pages)
+    monkeypatch.setattr(handler, "iter_item_pages", fake_pages)
+
+    res = handler.stream_images_handler({"queryStringParameters": {"tag": "t1"}})
+    assert res["statusCode"] == 200
+    assert res["headers"]["Content-Type"] == handler.NDJSON_CONTENT_TYPE
+    lines = b"".join(res["body"]).decode().splitlines()
+    assert [json.loads(l) for l in lines] == [{"image_id": "a", "size": 3}, {"image_id": "b", "size": 1.5}]
+    assert seen == {"user_id": None, "content_type": None, "tag": "t1"}
+
+def test_stream_images_first_page_error(monkeypatch):
+    def failing_pages(**kwargs):
+        raise RuntimeError("boom")
+        yield []
+    monkeypatch.setattr(handler, "iter_item_pages", failing_pages)
+    status, body = parse(handler.stream_images_handler({}))
+    assert status == 500
+    assert body["error"] == "stream failed"
+
+def test_stream_images_midstream_error(monkeypatch):
+    def flaky_pages(**kwargs):
+        yield [{"image_id": "a"}]
+        raise RuntimeError("throttled")
+    monkeypatch.setattr(handler, "iter_item_pages", flaky_pages)
+    res = handler.stream_images_handler({})
+    lines = [json.loads(l) for l in b"".join(res["body"]).decode().splitlines()]
+    assert lines == [{"image_id": "a"}, {"error": "stream interrupted"}]
+
+def test_stream_images_parallel_segments(monkeypatch):
+    seen = {}
+    def fake_parallel(**kwargs):
+        seen.update(kwargs)
+        return iter([[{"image_id": "a"}], [{"image_id": "b"}]])
+    monkeypatch.setattr(handler, "iter_parallel_scan_pages", fake_parallel)
+
+    res = handler.stream_images_handler({"queryStringParameters": {"segments": "8", "content_type": "image/png"}})
+    assert res["statusCode"] == 200
+    assert len(b"".join(res["body"]).splitlines()) == 2
+    assert seen == {"total_segments": 8, "content_type": "image/png", "tag": None}
+
+@pytest.mark.parametrize("qs,error", [
+    ({"segments": "x"}, "invalid segments"),
+    ({"segments": "0"}, "invalid segments"),
+    ({"segments": "100000"}, "invalid segments"),
+    ({"segments": "2", "user_id": "u1"}, "segments cannot be combined with user_id"),
+])
+def test_stream_images_rejects_bad_segments(qs, error):
+    status, body = parse(handler.stream_images_handler({"queryStringParameters": qs}))
+    assert status == 400
+    assert body["error"] == error
 
 # -----------------------
 # delete_image_handler tests
@@ -168,6 +667,57 @@ def test_delete_success_and_s3_errors(monkeypatch):
     assert status == 200
     assert body["deleted"] == "z"
 
+def test_delete_cleans_up_tag_index(monkeypatch):
+    item = {"image_id": "z", "tags": ["t1", "t2"]}
+    unindexed = []
+    deleted = []
+    monkeypatch.setattr(handler, "get_item", lambda iid: dict(item))
+    monkeypatch.setattr(handler, "delete_object", lambda iid: None)
+    monkeypatch.setattr(handler, "delete_metadata", deleted.append)
+    monkeypatch.setattr(handler, "unindex_tags", lambda items: unindexed.extend(items) or [])
+    status, body = parse(handler.delete_image_handler({"pathParameters": {"image_id": "z"}}))
+    assert status == 200
+    assert deleted == ["z"]
+    assert unindexed == [item]
+
+def test_delete_takes_item_off_usage(monkeypatch, usage_updates):
+    item = {"image_id": "z", "user_id": "u1", "content_type": "image/png", "size": 10,
+            "object_size": 12, "status": "complete"}
+    monkeypatch.setattr(handler, "get_item", lambda iid: dict(item))
+    monkeypatch.setattr(handler, "delete_object", lambda iid: None)
+    monkeypatch.setattr(handler, "delete_metadata", lambda iid: None)
+    status, _ = parse(handler.delete_image_handler({"pathParameters": {"image_id": "z"}}))
+    assert status == 200
+    assert usage_updates == [("u1", {"images": -1, "size": -12, "pending": 0, "content_types": {"image/png": -1}})]
+
+def test_usage_route(monkeypatch):
+    monkeypatch.setattr(handler, "get_usage", lambda uid: {"user_id": uid, "image_count": 2})
+    status, body = parse(handler.router({"httpMethod": "GET", "path": "/v1/users/u%201/usage"}))
+    assert status == 200
+    assert body["user_id"] == "u 1" and body["image_count"] == 2
+    assert body["quota"] == {"max_images": None, "max_bytes": None}
+
+def test_delete_releases_shared_content(monkeypatch):
+    item = {"image_id": "z", "object_key": "images/first", "checksum_sha256": "ab" * 32}
+    released, s3_deleted = [], []
+    monkeypatch.setattr(handler, "get_item", lambda iid: dict(item))
+    monkeypatch.setattr(handler, "delete_object", lambda iid: pytest.fail("shared object deleted directly"))
+    monkeypatch.setattr(handler, "delete_metadata", lambda iid: None)
+    monkeypatch.setattr(handler, "delete_keys", lambda keys: s3_deleted.extend(keys) or [])
+
+    # other references remain: the object stays
+    monkeypatch.setattr(handler, "release_content", lambda sha, count=1: released.append(sha))
+    status, _ = parse(handler.delete_image_handler({"pathParameters": {"image_id": "z"}}))
+    assert status == 200
+    assert released == ["ab" * 32]
+    assert s3_deleted == []
+
+    # last reference: the object goes with it
+    monkeypatch.setattr(handler, "release_content", lambda sha, count=1: "images/first")
+    status, _ = parse(handler.delete_image_handler({"pathParameters": {"image_id": "z"}}))
+    assert status == 200
+    assert s3_deleted == ["images/first"]
+
 def test_delete_ddb_error(monkeypatch):
     def fake_delete_obj(iid):
         return None
@@ -180,3 +730,120 @@ def test_delete_ddb_error(monkeypatch):
     status, body = parse(handler.delete_image_handler({"pathParameters": {"image_id": "z"}}))
     assert status == 500
     assert body["error"] == "ddb delete failed"
+
+# -----------------------
+# batch get / delete tests
+# -----------------------
+def test_batch_get_images_per_id_outcomes(monkeypatch):
+    seen = []
+    def fake_batch_get(ids):
+        seen.extend(ids)
+        return {"a": {"image_id": "a", "size": 1}}, ["c"]
+    monkeypatch.setattr(handler, "batch_get_items", fake_batch_get)
+
+    body_in = {"image_ids": ["a", "b", "c", "a"]}
+    status, body = parse(handler.batch_get_images({"body": json.dumps(body_in)}))
+    assert status == 200
+    assert seen == ["a", "b", "c"]
+    assert body["results"] == [
+        {"image_id": "a", "item": {"image_id": "a", "size": 1}},
+        {"image_id": "b", "error": "not found"},
+        {"image_id": "c", "error": "ddb read error"},
+    ]
+
+@pytest.mark.parametrize("payload", [{}, {"image_ids": []}, {"image_ids": [1, 2]}, {"image_ids": "a"}])
+def test_batch_get_images_invalid_payload(payload):
+    status, body = parse(handler.batch_get_images({"body": json.dumps(payload)}))
+    assert status == 400
+    assert body["error"] == "invalid payload"
+
+def test_batch_delete_images(monkeypatch):
+    unindexed = []
+    items = {"a": {"image_id": "a", "tags": ["t"]}, "b": {"image_id": "b", "tags": ["t"]}}
+    monkeypatch.setattr(handler, "batch_get_items", lambda ids: (items, []))
+    monkeypatch.setattr(handler, "batch_delete_objects", lambda ids: ["a"])
+    monkeypatch.setattr(handler, "batch_delete_metadata", lambda ids: ["b"])
+    monkeypatch.setattr(handler, "unindex_tags", lambda items: unindexed.extend(items) or [])
+    status, body = parse(handler.batch_delete_images({"body": json.dumps({"image_ids": ["a", "b"]})}))
+    assert status == 200
+    assert body["results"] == [
+        {"image_id": "a", "deleted": True},
+        {"image_id": "b", "error": "ddb delete failed"},
+    ]
+    # b is still present, so its tag entries must stay
+    assert unindexed == [items["a"]]
+
+def test_batch_delete_images_limit_and_ddb_error(monkeypatch):
+    monkeypatch.setattr(handler, "BATCH_DELETE_MAX_ITEMS", 1)
+    status, body = parse(handler.batch_delete_images({"body": json.dumps({"image_ids": ["a", "b"]})}))
+    assert status == 413
+
+    def boom(ids):
+        raise RuntimeError("ddb down")
+    monkeypatch.setattr(handler, "BATCH_DELETE_MAX_ITEMS", 10)
+    monkeypatch.setattr(handler, "batch_get_items", lambda ids: ({}, []))
+    monkeypatch.setattr(handler, "batch_delete_objects", lambda ids: [])
+    monkeypatch.setattr(handler, "batch_delete_metadata", boom)
+    status, body = parse(handler.batch_delete_images({"body": json.dumps({"image_ids": ["a"]})}))
+    assert status == 500
+    assert body["error"] == "ddb delete failed"
+
+# -----------------------
+# router tests
+# -----------------------
+def test_router_dispatches_rest_api_events(monkeypatch):
+    import base64
+    monkeypatch.setattr(handler, "create_metadata", lambda item: None)
+    monkeypatch.setattr(handler, "generate_presigned_put", lambda image_id, content_type: f"https://s3.local/{image_id}")
+    monkeypatch.setattr(handler, "index_tags", lambda items: [])
+    payload = {"user_id": "u1", "filename": "a.png", "content_type": "image/png", "size": 10}
+    event = {
+        "httpMethod": "POST",
+        "path": "/v1/images",
+        "body": base64.b64encode(json.dumps(payload).encode()).decode(),
+        "isBase64Encoded": True,
+    }
+    status, body = parse(handler.router(event))
+    assert status == 201 and body["upload_url"].startswith("https://s3.local/")
+
+def test_router_fills_path_parameters_for_http_api_events(monkeypatch):
+    seen = []
+    monkeypatch.setattr(handler, "get_item", lambda image_id: seen.append(image_id) or None)
+    event = {
+        "rawPath": "/prod/v1/images/abc%20d",
+        "requestContext": {"http": {"method": "GET"}, "stage": "prod"},
+        "pathParameters": {"proxy": "v1/images/abc%20d"},
+    }
+    status, body = parse(handler.router(event))
+    assert status == 404 and body == {"error": "not found"}
+    assert seen == ["abc d"]
+
+def test_router_unknown_route_and_method(monkeypatch):
+    status, body = parse(handler.router({"httpMethod": "GET", "path": "/v1/nothing"}))
+    assert status == 404 and body["error"] == "route not found"
+    res = handler.router({"httpMethod": "PUT", "path": "/images/abc"})
+    assert res["statusCode"] == 405
+    assert res["headers"]["Allow"] == "GET, DELETE"
+
+def test_router_buffers_ndjson_streams(monkeypatch):
+    monkeypatch.setattr(handler, "iter_item_pages", lambda **kw: iter([[{"image_id": "a"}], [{"image_id": "b"}]]))
+    res = handler.router({"httpMethod": "GET", "path": "/images", "queryStringParameters": {"format": "ndjson"}})
+    assert res["statusCode"] == 200
+    assert [json.loads(line)["image_id"] for line in res["body"].splitlines()] == ["a", "b"]
+
+@pytest.mark.parametrize("method", ["GET", "DELETE"])
+@pytest.mark.parametrize("segment", handler.RESERVED_PATH_SEGMENTS)
+def test_router_reserved_segments_are_not_image_ids(monkeypatch, method, segment):
+    looked_up = []
+    monkeypatch.setattr(handler, "get_item", lambda image_id: looked_up.append(image_id) or None)
+    res = handler.router({"httpMethod": method, "path": f"/v1/images/{segment}"})
+    assert res["statusCode"] == 405 and res["headers"]["Allow"] == "POST"
+    assert looked_up == []
+
+def test_router_image_ids_sharing_a_reserved_prefix(monkeypatch):
+    seen = []
+    monkeypatch.setattr(handler, "get_item", lambda image_id: seen.append(image_id) or None)
+    for image_id in ("batchy", "multipart-1"):
+        status, _ = parse(handler.router({"httpMethod": "GET", "path": f"/v1/images/{image_id}"}))
+        assert status == 404
+    assert seen == ["batchy", "multipart-1"]
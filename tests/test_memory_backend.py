@@ -0,0 +1,414 @@
+# tests/test_memory_backend.py
+import json
+from decimal import Decimal
+from urllib.parse import parse_qsl, urlparse
+
+import pytest
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
+
+import src.handler as handler
+import src.storage as storage
+from src.backends import AwsBackend, get_backend
+from src.config import S3_BUCKET
+from src.expressions import ExpressionError, apply_update, evaluate_condition
+from src.memory_backend import MemoryBackend
+
+
+@pytest.fixture
+def backend():
+    return MemoryBackend(min_part_size=1)
+
+
+@pytest.fixture
+def memory_storage(backend):
+    previous = storage.backend
+    storage.use_backend(backend)
+    yield backend
+    storage.use_backend(previous)
+
+
+def _code(excinfo):
+    return excinfo.value.response["Error"]["Code"]
+
+
+# -----------------------
+# expressions
+# -----------------------
+def test_condition_expressions():
+    # the shapes src.storage builds: record_object_info, acquire_content,
+    # update_usage's quota check, list filters and the pending-index query
+    names = {"#status": "status", "#size": "size", "#bytes": "bytes"}
+    values = {":pending": "pending", ":zero": Decimal(0), ":size": Decimal(10), ":bytes_left": Decimal(90)}
+    claimable = "attribute_exists(image_id) AND (attribute_not_exists(#status) OR #status = :pending)"
+    assert evaluate_condition(claimable, {"image_id": "a", "status": "pending"}, names, values)
+    assert evaluate_condition(claimable, {"image_id": "a"}, names, values)
+    assert not evaluate_condition(claimable, {"image_id": "a", "status": "complete"}, names, values)
+    assert not evaluate_condition(claimable, {}, names, values)
+
+    content = {"sha256": "h", "refcount": Decimal(1), "size": Decimal(10)}
+    assert evaluate_condition("attribute_exists(sha256) AND refcount > :zero AND #size = :size", content, names, values)
+    assert not evaluate_condition("refcount <= :zero", content, values=values)
+    assert not evaluate_condition("#size = :size", {"size": "10"}, names, values)  # types differ
+
+    quota = "(attribute_not_exists(#bytes) OR #bytes <= :bytes_left)"
+    assert evaluate_condition(quota, {}, names, values)
+    assert not evaluate_condition(quota, {"bytes": Decimal(91)}, names, values)
+
+    item = {"content_type": "image/png", "tags": ["x", "y"], "status": "pending", "created_at": "2025-01-01"}
+    assert evaluate_condition(Attr("content_type").eq("image/png") & Attr("tags").contains("y"), item)
+    assert not evaluate_condition(Attr("tags").contains("z"), item)
+    assert evaluate_condition(Key("status").eq("pending") & Key("created_at").lt("2025-02-01"), item)
+
+
+def test_update_expressions():
+    item = {"image_id": "a", "status": "pending", "upload_id": "u", "images": Decimal(1)}
+    values = {":complete": "complete", ":h": "h", ":now": "t", ":images": Decimal(2), ":bytes": Decimal(-5)}
+    touched = apply_update(
+        item, "SET #status = :complete, sha256 = :h REMOVE upload_id", {"#status": "status"}, values
+    )
+    assert item == {"image_id": "a", "status": "complete", "sha256": "h", "images": Decimal(1)}
+    assert touched == {"status", "sha256", "upload_id"}
+
+    touched = apply_update(item, "SET updated_at = :now ADD #images :images, #bytes :bytes",
+                           {"#images": "images", "#bytes": "bytes"}, values)
+    assert item["images"] == Decimal(3) and item["bytes"] == Decimal(-5) and item["updated_at"] == "t"
+    assert touched == {"updated_at", "images", "bytes"}
+
+
+@pytest.mark.parametrize("expression", [
+    "a BETWEEN :one AND :two",
+    "begins_with(s, :one)",
+    "NOT a = :one",
+    "m.n = :one",
+    "a = :one extra",
+])
+def test_unsupported_conditions_are_rejected(expression):
+    with pytest.raises(ExpressionError):
+        evaluate_condition(expression, {}, values={":one": Decimal(1), ":two": Decimal(2)})
+
+
+@pytest.mark.parametrize("expression", [
+    "SET n = n + :one",
+    "SET l = list_append(l, :one)",
+    "ADD s :set",
+    "DELETE s :set",
+])
+def test_unsupported_updates_are_rejected(expression):
+    with pytest.raises(ExpressionError):
+        apply_update({}, expression, values={":one": Decimal(1), ":set": {"a"}})
+
+
+# -----------------------
+# tables
+# -----------------------
+def _seed(table, n):
+    for i in range(n):
+        table.put_item(Item={
+            "image_id": f"i{i}",
+            "user_id": f"u{i % 2}",
+            "content_type": "image/png",
+            "created_at": f"2025-01-{i + 1:02d}",
+            "size": i,
+        })
+
+
+def test_item_conditions_and_normalisation(backend):
+    table = backend.table("Images")
+    table.put_item(Item={"image_id": "a", "size": 1}, ConditionExpression="attribute_not_exists(image_id)")
+    with pytest.raises(ClientError) as excinfo:
+        table.put_item(Item={"image_id": "a"}, ConditionExpression="attribute_not_exists(image_id)")
+    assert _code(excinfo) == "ConditionalCheckFailedException"
+    with pytest.raises(ClientError) as excinfo:
+        table.put_item(Item={"image_id": "b", "ratio": 1.5})
+    assert _code(excinfo) == "ValidationException"
+
+    resp = table.update_item(
+        Key={"image_id": "a"}, UpdateExpression="ADD size :one", ExpressionAttributeValues={":one": 1},
+        ReturnValues="ALL_NEW",
+    )
+    assert resp["Attributes"] == {"image_id": "a", "size": Decimal(2)}
+    got = table.get_item(Key={"image_id": "a"})["Item"]
+    got["size"] = 100  # reads are copies
+    assert table.get_item(Key={"image_id": "a"})["Item"]["size"] == 2
+    with pytest.raises(ClientError) as excinfo:
+        table.get_item(Key={"user_id": "a"})
+    assert _code(excinfo) == "ValidationException"
+
+
+def test_query_orders_pages_and_filters_like_dynamodb(backend):
+    table = backend.table("Images")
+    _seed(table, 10)
+    table.put_item(Item={"image_id": "sparse", "created_at": "2025-02-01"})  # no user_id: not in the GSI
+
+    params = {"IndexName": "gsi_user_created", "KeyConditionExpression": Key("user_id").eq("u0"),
+              "ScanIndexForward": False, "Limit": 2, "FilterExpression": Attr("size").gt(5)}
+    first = table.query(**params)
+    # Limit counts evaluated items, the filter runs afterwards
+    assert (first["ScannedCount"], [i["image_id"] for i in first["Items"]]) == (2, ["i8", "i6"])
+    assert first["LastEvaluatedKey"] == {"image_id": "i6", "user_id": "u0", "created_at": "2025-01-07"}
+    second = table.query(**params, ExclusiveStartKey=first["LastEvaluatedKey"])
+    assert (second["ScannedCount"], second["Items"]) == (2, [])
+    third = table.query(**params, ExclusiveStartKey=second["LastEvaluatedKey"])
+    assert [i["image_id"] for i in third["Items"]] == [] and "LastEvaluatedKey" not in third
+
+    everyone = table.query(
+        IndexName="gsi_user_created",
+        KeyConditionExpression="user_id = :u AND created_at >= :from",
+        ExpressionAttributeValues={":u": "u1", ":from": "2025-01-06"},
+    )
+    assert [i["image_id"] for i in everyone["Items"]] == ["i5", "i7", "i9"]
+
+
+def test_scan_segments_partition_the_table(backend):
+    table = backend.table("Images")
+    _seed(table, 25)
+    seen = []
+    for segment in range(3):
+        params = {"Segment": segment, "TotalSegments": 3, "Limit": 4}
+        while True:
+            resp = table.scan(**params)
+            seen.extend(i["image_id"] for i in resp["Items"])
+            if "LastEvaluatedKey" not in resp:
+                break
+            params["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+    assert sorted(seen) == sorted(f"i{i}" for i in range(25))
+
+
+def test_batch_operations_go_through_meta_client(backend):
+    table = backend.table("Images")
+    client = table.meta.client
+    client.batch_write_item(RequestItems={"Images": [{"PutRequest": {"Item": {"image_id": f"b{i}"}}} for i in range(3)]})
+    client.batch_write_item(RequestItems={"Images": [{"DeleteRequest": {"Key": {"image_id": "b0"}}}]})
+    resp = client.batch_get_item(RequestItems={"Images": {"Keys": [{"image_id": "b0"}, {"image_id": "b1"}]}})
+    assert resp["Responses"]["Images"] == [{"image_id": "b1"}]
+    with pytest.raises(ClientError) as excinfo:
+        client.batch_write_item(RequestItems={"Images": [{"PutRequest": {"Item": {"image_id": "x"}}}] * 26})
+    assert _code(excinfo) == "ValidationException"
+
+
+# -----------------------
+# objects
+# -----------------------
+def test_presigned_urls_are_deterministic_and_verifiable(backend):
+    s3 = backend.s3
+    params = {"Bucket": "b", "Key": "images/1", "ContentType": "image/png"}
+    url = s3.generate_presigned_url("put_object", Params=params, ExpiresIn=60, HttpMethod="PUT")
+    assert url == s3.generate_presigned_url("put_object", Params=params, ExpiresIn=60, HttpMethod="PUT")
+    parsed = urlparse(url)
+    assert parsed.path == "/_memory/b/images/1"
+    query = dict(parse_qsl(parsed.query))
+    assert s3.verify_presigned_url("PUT", "b", "images/1", query, "image/png")
+    assert not s3.verify_presigned_url("PUT", "b", "images/1", query, "text/html")
+    assert not s3.verify_presigned_url("PUT", "b", "images/2", query, "image/png")
+
+
+def test_multipart_upload_rules():
+    s3 = MemoryBackend(min_part_size=4).s3
+    upload_id = s3.create_multipart_upload(Bucket="b", Key="k", ContentType="image/png")["UploadId"]
+    e1 = s3.upload_part(Bucket="b", Key="k", UploadId=upload_id, PartNumber=1, Body=b"ab")["ETag"]
+    e2 = s3.upload_part(Bucket="b", Key="k", UploadId=upload_id, PartNumber=2, Body=b"cd")["ETag"]
+    assert s3.list_parts(Bucket="b", Key="k", UploadId=upload_id, MaxParts=1)["NextPartNumberMarker"] == 1
+    parts = [{"PartNumber": 1, "ETag": e1}, {"PartNumber": 2, "ETag": e2}]
+    with pytest.raises(ClientError) as excinfo:
+        s3.complete_multipart_upload(Bucket="b", Key="k", UploadId=upload_id, MultipartUpload={"Parts": parts})
+    assert _code(excinfo) == "EntityTooSmall"
+    s3.upload_part(Bucket="b", Key="k", UploadId=upload_id, PartNumber=1, Body=b"abcd")
+    with pytest.raises(ClientError) as excinfo:  # part 1 was replaced, its old ETag is gone
+        s3.complete_multipart_upload(Bucket="b", Key="k", UploadId=upload_id, MultipartUpload={"Parts": parts})
+    assert _code(excinfo) == "InvalidPart"
+    parts = [{"PartNumber": p["PartNumber"], "ETag": p["ETag"]}
+             for p in s3.list_parts(Bucket="b", Key="k", UploadId=upload_id)["Parts"]]
+    etag = s3.complete_multipart_upload(Bucket="b", Key="k", UploadId=upload_id, MultipartUpload={"Parts": parts})
+    assert etag["ETag"].endswith('-2"')
+    assert s3.get_object(Bucket="b", Key="k")["Body"].read() == b"abcdcd"
+    with pytest.raises(ClientError) as excinfo:
+        s3.abort_multipart_upload(Bucket="b", Key="k", UploadId=upload_id)
+    assert _code(excinfo) == "NoSuchUpload"
+
+
+# -----------------------
+# backend selection and end to end
+# -----------------------
+def test_get_backend():
+    assert isinstance(get_backend("aws"), AwsBackend)
+    assert isinstance(get_backend("memory"), MemoryBackend)
+    with pytest.raises(ValueError):
+        get_backend("sqlite")
+
+
+def _body(res):
+    return res["statusCode"], json.loads(res["body"])
+
+
+def test_handlers_end_to_end_on_memory_backend(memory_storage):
+    png = b"\x89PNG\r\n\x1a\n" + b"\0" * 32
+    payload = {"user_id": "u1", "filename": "a.png", "content_type": "image/png", "size": len(png), "tags": ["red"]}
+    status, created = _body(handler.request_upload({"body": json.dumps(payload)}))
+    assert status == 201
+    image_id = created["image_id"]
+    status, _ = _body(handler.get_image({"pathParameters": {"image_id": image_id}, "queryStringParameters": {"download": "1"}}))
+    assert status == 409
+
+    url = urlparse(created["upload_url"])
+    bucket, key = url.path[len("/_memory/"):].split("/", 1)
+    assert memory_storage.s3.verify_presigned_url("PUT", bucket, key, dict(parse_qsl(url.query)), "image/png")
+    memory_storage.s3.put_object(Bucket=bucket, Key=key, Body=png, ContentType="image/png")
+
+    status, done = _body(handler.complete_upload({"pathParameters": {"image_id": image_id}}))
+    assert status == 200 and done["url"]
+    status, item = _body(handler.get_image({"pathParameters": {"image_id": image_id}}))
+    assert status == 200 and item["detected_content_type"] == "image/png"
+    assert item["status"] == "complete" and item["object_size"] == len(png) and item["object_etag"]
+    # a repeated complete is answered from the stored status
+    assert not storage.record_object_info(image_id, {"sha256": "00", "detected_content_type": "image/png"})
+    status, again = _body(handler.complete_upload({"pathParameters": {"image_id": image_id}}))
+    assert status == 200 and again["checksum_sha256"] == item["checksum_sha256"]
+    usage = storage.get_usage("u1")
+    assert (usage["image_count"], usage["total_bytes"], usage["pending_count"]) == (1, len(png), 0)
+    assert usage["content_types"] == {"image/png": 1}
+
+    for qs in ({"user_id": "u1"}, {"content_type": "image/png"}, {"tag": "red"}, {}):
+        status, page = _body(handler.list_images_handler({"queryStringParameters": qs}))
+        assert status == 200 and [i["image_id"] for i in page["items"]] == [image_id], qs
+
+    status, _ = _body(handler.delete_image_handler({"pathParameters": {"image_id": image_id}}))
+    assert status == 200
+    assert memory_storage.table("Images").get_item(Key={"image_id": image_id}) == {}
+    assert memory_storage.s3.keys(bucket) == []
+    assert len(memory_storage.table("ImageContent")) == 0
+    usage = storage.get_usage("u1")
+    assert (usage["image_count"], usage["total_bytes"], usage["content_types"]) == (0, 0, {})
+
+
+def test_failed_status_flip_keeps_the_upload(memory_storage, monkeypatch):
+    png = b"\x89PNG\r\n\x1a\n" + b"\1" * 32
+    payload = {"user_id": "u1", "filename": "a.png", "content_type": "image/png", "size": len(png)}
+    image_id = _body(handler.request_upload({"body": json.dumps(payload)}))[1]["image_id"]
+    memory_storage.s3.put_object(Bucket=S3_BUCKET, Key=f"images/{image_id}", Body=png, ContentType="image/png")
+
+    def throttled(image_id, info):
+        raise ClientError({"Error": {"Code": "ProvisionedThroughputExceededException"}}, "UpdateItem")
+    monkeypatch.setattr(handler, "record_object_info", throttled)
+    assert _body(handler.complete_upload({"pathParameters": {"image_id": image_id}}))[0] == 500
+    assert memory_storage.s3.keys(S3_BUCKET) == [f"images/{image_id}"]
+    assert len(memory_storage.table("ImageContent")) == 0
+
+    monkeypatch.setattr(handler, "record_object_info", storage.record_object_info)
+    status, done = _body(handler.complete_upload({"pathParameters": {"image_id": image_id}}))
+    assert status == 200 and done["status"] == "complete"
+    assert memory_storage.s3.keys(S3_BUCKET) == [f"images/{image_id}"]
+
+
+def test_usage_quota_is_atomic(memory_storage):
+    assert storage.update_usage("u1", images=1, size=60, content_types={"image/png": 1}, max_bytes=100)
+    assert not storage.update_usage("u1", images=1, size=50, max_bytes=100)
+    assert not storage.update_usage("u1", images=1, size=101, max_bytes=100)
+    assert storage.update_usage("u1", images=1, size=40, max_images=2, max_bytes=100)
+    assert not storage.update_usage("u1", images=1, size=0, max_images=2)
+    usage = storage.get_usage("u1")
+    assert (usage["image_count"], usage["total_bytes"], usage["content_types"]) == (2, 100, {"image/png": 1})
+    assert storage.get_usage("nobody")["image_count"] == 0
+
+
+def test_complete_charges_undeclared_bytes_against_the_quota(memory_storage, monkeypatch):
+    monkeypatch.setattr(handler, "USER_QUOTA_BYTES", 100)
+    png = b"\x89PNG\r\n\x1a\n" + b"\2" * 72
+    payload = {"user_id": "u1", "filename": "a.png", "content_type": "image/png", "size": 40}
+    image_id = _body(handler.request_upload({"body": json.dumps(payload)}))[1]["image_id"]
+    memory_storage.s3.put_object(Bucket=S3_BUCKET, Key=f"images/{image_id}", Body=png, ContentType="image/png")
+
+    # 80 bytes against a declared 40 fits; the settled total is the real size
+    assert _body(handler.complete_upload({"pathParameters": {"image_id": image_id}}))[0] == 200
+    usage = storage.get_usage("u1")
+    assert (usage["total_bytes"], usage["pending_count"]) == (len(png), 0)
+
+    image_id = _body(handler.request_upload({"body": json.dumps(dict(payload, size=10))}))[1]["image_id"]
+    memory_storage.s3.put_object(Bucket=S3_BUCKET, Key=f"images/{image_id}", Body=png, ContentType="image/png")
+    status, body = _body(handler.complete_upload({"pathParameters": {"image_id": image_id}}))
+    assert status == 403 and body["error"] == "quota exceeded"
+    # still pending on its upload, holding only the declared reservation
+    assert storage.get_item(image_id)["status"] == "pending"
+    assert f"images/{image_id}" in memory_storage.s3.keys(S3_BUCKET)
+    usage = storage.get_usage("u1")
+    assert (usage["total_bytes"], usage["pending_count"]) == (len(png) + 10, 1)
+
+
+def test_batch_delete_releases_shared_content_in_one_pass(memory_storage, monkeypatch):
+    image_ids = []
+    for n in range(50):
+        sha = f"{n % 10:064x}"  # five images per content
+        key = f"images/first{n % 10}"
+        if n < 10:
+            memory_storage.s3.put_object(Bucket=S3_BUCKET, Key=key, Body=b"x")
+            assert storage.register_content(sha, key, 1, "image/png")
+        else:
+            assert storage.acquire_content(sha, size=1)
+        storage.create_metadata({
+            "image_id": f"i{n}", "user_id": "u1", "status": "complete", "created_at": "2025-01-01",
+            "object_key": key, "checksum_sha256": sha, "size": 1, "object_size": 1,
+        })
+        image_ids.append(f"i{n}")
+    calls = []
+    delete_objects = memory_storage.s3.delete_objects
+    monkeypatch.setattr(memory_storage.s3, "delete_objects",
+                        lambda **kwargs: calls.append(len(kwargs["Delete"]["Objects"])) or delete_objects(**kwargs))
+    monkeypatch.setattr(memory_storage.s3, "delete_object", lambda **kwargs: pytest.fail("single-key delete"))
+
+    status, body = _body(handler.batch_delete_images({"body": json.dumps({"image_ids": image_ids})}))
+    assert status == 200 and all(r.get("deleted") for r in body["results"])
+    assert calls == [10]
+    assert memory_storage.s3.keys(S3_BUCKET) == []
+    assert len(memory_storage.table("ImageContent")) == 0
+
+
+def test_deduplicated_upload_rolls_back_when_tag_indexing_fails(memory_storage, monkeypatch):
+    sha = "cd" * 32
+    memory_storage.s3.put_object(Bucket=S3_BUCKET, Key="images/first", Body=b"x" * 10)
+    assert storage.register_content(sha, "images/first", 10, "image/png")
+    payload = {"user_id": "u1", "filename": "a.png", "content_type": "image/png", "size": 10,
+               "sha256": sha, "tags": ["red"]}
+
+    def unindexed(items):
+        raise ClientError({"Error": {"Code": "ProvisionedThroughputExceededException"}}, "BatchWriteItem")
+    monkeypatch.setattr(handler, "index_tags", unindexed)
+    assert _body(handler.request_upload({"body": json.dumps(payload)}))[0] == 500
+    assert len(memory_storage.table("Images")) == 0
+    assert memory_storage.table("ImageContent").get_item(Key={"sha256": sha})["Item"]["refcount"] == 1
+    assert storage.get_usage("u1")["image_count"] == 0
+
+    # a retry is counted once
+    monkeypatch.setattr(handler, "index_tags", storage.index_tags)
+    status, body = _body(handler.request_upload({"body": json.dumps(payload)}))
+    assert status == 201 and body["deduplicated"]
+    assert memory_storage.table("ImageContent").get_item(Key={"sha256": sha})["Item"]["refcount"] == 2
+    assert storage.get_usage("u1")["image_count"] == 1
+
+
+def test_deduplicated_upload_copies_the_source_variants(memory_storage):
+    sha = "ef" * 32
+    memory_storage.s3.put_object(Bucket=S3_BUCKET, Key="images/first", Body=b"x" * 10)
+    memory_storage.s3.put_object(Bucket=S3_BUCKET, Key="derived/first/thumb.jpg", Body=b"thumb")
+    storage.create_metadata({"image_id": "first", "user_id": "u1", "status": "complete",
+                             "created_at": "2025-01-01", "variants": {"thumb": "derived/first/thumb.jpg"}})
+    assert storage.register_content(sha, "images/first", 10, "image/png")
+    payload = {"user_id": "u1", "filename": "a.png", "content_type": "image/png", "size": 10, "sha256": sha}
+
+    status, body = _body(handler.request_upload({"body": json.dumps(payload)}))
+    assert status == 201 and body["deduplicated"]
+    key = f"derived/{body['image_id']}/thumb.jpg"
+    assert storage.get_item(body["image_id"])["variants"] == {"thumb": key}
+    assert memory_storage.s3.get_object(Bucket=S3_BUCKET, Key=key)["Body"].read() == b"thumb"
+
+
+def test_list_by_user_and_tag_on_memory_backend(memory_storage):
+    items = [
+        {"image_id": f"i{n}", "user_id": f"u{n % 2}", "content_type": "image/png", "status": "complete",
+         "created_at": f"2025-01-{n + 1:02d}", "tags": ["red"] if n % 3 == 0 else ["blue"]}
+        for n in range(12)
+    ]
+    for item in items:
+        storage.create_metadata(item)
+    storage.index_tags(items)
+    found, cursor = storage.list_items(user_id="u0", tag="red", limit=10)
+    assert [i["image_id"] for i in found] == ["i6", "i0"] and cursor is None
@@ -0,0 +1,114 @@
+# tests/test_metrics.py
+import json
+import logging
+import threading
+
+import pytest
+
+import src.clients as clients
+import src.metrics as metrics
+
+
+@pytest.fixture(autouse=True)
+def _reset_metrics():
+    metrics.registry.clear()
+    yield
+    metrics.registry.clear()
+
+
+def test_counter_and_histogram_render():
+    registry = metrics.Registry()
+    calls = registry.counter("calls_total", "Calls", ("op",))
+    latency = registry.histogram("latency_seconds", "Latency", ("op",), buckets=(0.1, 1))
+    calls.inc(op="get")
+    calls.inc(2, op="get")
+    latency.observe(0.05, op="get")
+    latency.observe(0.5, op="get")
+    latency.observe(5, op="get")
+    registry.add_collector(lambda: [("up", "gauge", "Up", [("up", {}, 1)])])
+
+    text = registry.render()
+    assert "# TYPE calls_total counter" in text
+    assert 'calls_total{op="get"} 3' in text
+    assert "# TYPE latency_seconds histogram" in text
+    assert 'latency_seconds_bucket{op="get",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{op="get",le="1"} 2' in text
+    assert 'latency_seconds_bucket{op="get",le="+Inf"} 3' in text
+    assert 'latency_seconds_count{op="get"} 3' in text
+    assert "\nup 1\n" in text
+
+def test_label_values_are_escaped():
+    registry = metrics.Registry()
+    registry.counter("c_total", "C", ("path",)).inc(path='a"b\\c')
+    assert 'c_total{path="a\\"b\\\\c"} 1' in registry.render()
+
+def test_timed_handler_observes_and_logs(caplog):
+    @metrics.timed_handler
+    def fake_handler(event, context=None):
+        metrics.record_aws_call("dynamodb", "GetItem", 0.002)
+        return {"statusCode": 404, "body": "{}"}
+
+    with caplog.at_level(logging.INFO, logger="metrics"):
+        assert fake_handler({})["statusCode"] == 404
+    assert metrics.handler_seconds.count(handler="fake_handler", status=404) == 1
+    line = json.loads(caplog.records[-1].getMessage())
+    assert line["handler"] == "fake_handler"
+    assert line["status"] == 404
+    assert line["aws_calls"] == 1
+    assert line["aws_ms"] == 2.0
+
+def test_bind_scope_counts_worker_calls_in_handler_line(caplog):
+    @metrics.timed_handler
+    def fake_handler(event, context=None):
+        work = metrics.bind_scope(lambda: metrics.record_aws_call("s3", "HeadObject", 0.001))
+        worker = threading.Thread(target=work)
+        worker.start()
+        worker.join()
+        return {"statusCode": 200, "body": "{}"}
+
+    with caplog.at_level(logging.INFO, logger="metrics"):
+        fake_handler({})
+    assert json.loads(caplog.records[-1].getMessage())["aws_calls"] == 1
+
+def test_timed_handler_records_exceptions_as_500():
+    @metrics.timed_handler
+    def broken(event, context=None):
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        broken({})
+    assert metrics.handler_seconds.count(handler="broken", status=500) == 1
+
+class _Model:
+    name = "Query"
+    class service_model:
+        service_name = "dynamodb"
+
+def test_call_hooks_record_latency_retries_and_throttles():
+    context = {}
+    clients._on_call_start(model=_Model(), context=context)
+    clients._on_call_end(
+        parsed={"ResponseMetadata": {"RetryAttempts": 2}, "ScannedCount": 10, "Count": 3},
+        context=context,
+    )
+    clients._on_call_start(model=_Model(), context=context)
+    clients._on_call_end(
+        parsed={"Error": {"Code": "ProvisionedThroughputExceededException"}},
+        context=context,
+    )
+    clients._on_call_start(model=_Model(), context=context)
+    clients._on_call_error(exception=TimeoutError(), context=context)
+
+    labels = {"service": "dynamodb", "operation": "Query"}
+    assert metrics.aws_call_seconds.count(**labels) == 3
+    assert metrics.aws_retries.value(**labels) == 2
+    assert metrics.aws_throttles.value(**labels) == 1
+    assert metrics.aws_call_errors.value(code="TimeoutError", **labels) == 1
+    assert metrics.ddb_items_scanned.value(operation="Query") == 10
+    assert metrics.ddb_items_returned.value(operation="Query") == 3
+
+def test_render_includes_pool_and_cache_collectors():
+    import src.storage  # noqa: F401  registers the cache collector
+    text = metrics.render()
+    assert "aws_pool_requests_total" in text
+    assert 'cache_hits_total{cache="metadata"}' in text
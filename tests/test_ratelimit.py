@@ -0,0 +1,181 @@
+# tests/test_ratelimit.py
+import asyncio
+import json
+
+import pytest
+
+import src.ratelimit as ratelimit
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+async def _echo(scope, receive, send):
+    """Downstream app: answers 200 with the body it received."""
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _call(app, method="POST", path="/v1/images", body=None, headers=(), query=b"", chunked=False,
+                client="10.0.0.1"):
+    raw = json.dumps(body).encode() if body is not None else b""
+    length = [] if chunked else [(b"content-length", str(len(raw)).encode())]
+    scope = {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "query_string": query,
+        "headers": [(b"content-type", b"application/json"), *length, *headers],
+        "client": (client, 1234),
+    }
+    received = []
+    # chunked bodies arrive in 4 KiB messages
+    messages = [raw[i:i + 4096] for i in range(0, len(raw), 4096)] if chunked else [raw]
+
+    async def receive():
+        chunk = messages.pop(0) if messages else b""
+        return {"type": "http.request", "body": chunk, "more_body": bool(messages)}
+
+    async def send(message):
+        received.append(message)
+
+    await app(scope, receive, send)
+    start = received[0]
+    return start["status"], dict(start["headers"]), b"".join(m.get("body", b"") for m in received[1:])
+
+
+def test_memory_bucket_refills_and_evicts():
+    now = [0.0]
+    backend = ratelimit.MemoryRateLimitBackend(max_keys=2, clock=lambda: now[0])
+    assert _run(backend.take("a", rate=1, burst=2)) == 0
+    assert _run(backend.take("a", rate=1, burst=2)) == 0
+    assert _run(backend.take("a", rate=1, burst=2)) == pytest.approx(1.0)
+    now[0] = 1.5
+    assert _run(backend.take("a", rate=1, burst=2)) == 0
+    _run(backend.take("b", rate=1, burst=2))
+    _run(backend.take("c", rate=1, burst=2))
+    assert len(backend) == 2  # "a" was least recently used
+
+
+def test_per_user_limit_keys_on_body_and_replays_it():
+    app = ratelimit.AdmissionControl(_echo, backend=ratelimit.MemoryRateLimitBackend(), rate=0.001, burst=2)
+    payload = {"user_id": "u1", "filename": "a.png"}
+    for _ in range(2):
+        status, _, body = _run(_call(app, body=payload))
+        assert status == 200 and json.loads(body) == payload
+    status, headers, body = _run(_call(app, body=payload))
+    assert status == 429
+    assert json.loads(body)["error"] == "rate limited"
+    assert int(headers[b"retry-after"]) >= 1
+    # other users have their own bucket; the header wins over the body
+    assert _run(_call(app, body={"user_id": "u2"}))[0] == 200
+    assert _run(_call(app, body=payload, headers=[(b"x-user-id", b"u3")]))[0] == 200
+
+
+def test_batch_costs_one_token_per_item():
+    app = ratelimit.AdmissionControl(_echo, backend=ratelimit.MemoryRateLimitBackend(), rate=0.001, burst=5)
+    batch = {"items": [{"user_id": "u1"}] * 4}
+    assert _run(_call(app, path="/v1/images/batch", body=batch))[0] == 200
+    assert _run(_call(app, path="/v1/images/batch", body=batch))[0] == 429
+
+
+def test_batch_larger_than_the_bucket_pays_its_full_cost():
+    now = [0.0]
+    backend = ratelimit.MemoryRateLimitBackend(clock=lambda: now[0])
+    app = ratelimit.AdmissionControl(_echo, backend=backend, rate=1, burst=5)
+    batch = {"items": [{"user_id": "u1"}] * 20}
+    assert _run(_call(app, path="/v1/images/batch", body=batch))[0] == 200
+    # 15 tokens in debt: a single upload waits until the bucket is back at 1
+    now[0] = 10.0
+    status, headers, _ = _run(_call(app, body={"user_id": "u1"}))
+    assert status == 429 and int(headers[b"retry-after"]) == 6
+    now[0] = 16.0
+    assert _run(_call(app, body={"user_id": "u1"}))[0] == 200
+
+
+def test_image_id_batches_cost_one_token_per_id():
+    app = ratelimit.AdmissionControl(_echo, backend=ratelimit.MemoryRateLimitBackend(), rate=0.001, burst=5)
+    batch = {"user_id": "u1", "image_ids": ["a", "b", "c", "d"]}
+    assert _run(_call(app, path="/v1/images/batch-delete", body=batch))[0] == 200
+    assert _run(_call(app, path="/v1/images/batch-delete", body=batch))[0] == 429
+
+
+@pytest.mark.parametrize("chunked", [False, True])
+def test_bodies_too_large_to_inspect_pay_the_largest_batch(monkeypatch, chunked):
+    monkeypatch.setattr(ratelimit, "MAX_KEY_BODY_BYTES", 10_000)
+    now = [0.0]
+    backend = ratelimit.MemoryRateLimitBackend(clock=lambda: now[0])
+    app = ratelimit.AdmissionControl(_echo, backend=backend, rate=1, burst=5, ip_rate=1, ip_burst=5)
+    big = {"user_id": "u1", "image_ids": ["x" * 36] * 1000}
+    status, _, body = _run(_call(app, path="/v1/images/batch-delete", body=big, chunked=chunked))
+    # admitted from the full bucket, and the whole body still reaches the app
+    assert status == 200 and json.loads(body) == big
+    now[0] = ratelimit.MAX_BATCH_COST - 10
+    assert _run(_call(app, body={"user_id": "u2"}))[0] == 429
+
+
+def test_trusted_proxy_hops_take_the_client_from_x_forwarded_for():
+    app = ratelimit.AdmissionControl(
+        _echo, backend=ratelimit.MemoryRateLimitBackend(), ip_rate=0.001, ip_burst=1, trusted_proxy_hops=1
+    )
+
+    def call(forwarded):
+        # every request arrives from the load balancer's address
+        return _run(_call(app, method="GET", path="/v1/images", client="10.0.0.2",
+                          headers=[(b"x-forwarded-for", forwarded)]))[0]
+
+    assert call(b"203.0.113.7") == 200
+    assert call(b"198.51.100.1") == 200
+    # a spoofed leftmost entry does not buy a new bucket: the ALB appends the real peer
+    assert call(b"1.2.3.4, 203.0.113.7") == 429
+    # without a trusted proxy the header is ignored
+    scope = {"client": ("10.0.0.2", 1), "headers": [(b"x-forwarded-for", b"1.1.1.1")]}
+    assert ratelimit._client_address(scope, 0) == "10.0.0.2"
+
+
+def test_rotating_user_ids_hit_the_address_bucket():
+    app = ratelimit.AdmissionControl(
+        _echo, backend=ratelimit.MemoryRateLimitBackend(), rate=0.001, burst=2, ip_rate=0.001, ip_burst=3
+    )
+    statuses = [_run(_call(app, body={"user_id": f"u{n}"}))[0] for n in range(4)]
+    assert statuses == [200, 200, 200, 429]
+    # requests without any user_id share the same address bucket
+    assert _run(_call(app, method="GET", path="/v1/images"))[0] == 429
+
+
+def test_concurrency_cap_rejects_fast_and_exempts_metrics():
+    async def scenario():
+        release = asyncio.Event()
+
+        async def slow(scope, receive, send):
+            await release.wait()
+            await _echo(scope, receive, send)
+
+        app = ratelimit.AdmissionControl(slow, backend=ratelimit.MemoryRateLimitBackend(), max_inflight=1)
+        first = asyncio.ensure_future(_call(app, method="GET", path="/v1/images", query=b"user_id=u1"))
+        await asyncio.sleep(0)
+        busy = await _call(app, method="GET", path="/v1/images", query=b"user_id=u2")
+        exempt = asyncio.ensure_future(_call(app, method="GET", path="/metrics"))
+        await asyncio.sleep(0)
+        assert app.limiter.inflight == 1  # /metrics does not take a slot
+        release.set()
+        return busy, await first, await exempt, app.limiter.inflight
+
+    busy, first, exempt, inflight = _run(scenario())
+    assert busy[0] == 429 and json.loads(busy[2]) == {"error": "server busy"}
+    assert first[0] == 200 and exempt[0] == 200
+    assert inflight == 0
+
+
+def test_load_backend():
+    assert isinstance(ratelimit.load_backend("memory"), ratelimit.MemoryRateLimitBackend)
+    assert isinstance(ratelimit.load_backend("src.ratelimit:MemoryRateLimitBackend"), ratelimit.MemoryRateLimitBackend)
+    with pytest.raises(ValueError):
+        ratelimit.load_backend("redis")
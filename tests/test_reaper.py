@@ -0,0 +1,162 @@
+# tests/test_reaper.py
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import src.reaper as reaper
+import src.storage as storage
+from src.config import S3_BUCKET
+from src.memory_backend import MemoryBackend
+
+
+@pytest.fixture
+def backend():
+    previous = storage.backend
+    memory = MemoryBackend(min_part_size=1)
+    storage.use_backend(memory)
+    yield memory
+    storage.use_backend(previous)
+
+
+def _ago(seconds):
+    return (datetime.now(timezone.utc) - timedelta(seconds=seconds)).isoformat()
+
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\0" * 8
+
+
+def _seed(backend, image_id, age, status="pending", uploaded=None, **extra):
+    item = {
+        "image_id": image_id, "user_id": "u1", "content_type": "image/png", "size": len(PNG),
+        "status": status, "created_at": _ago(age), "tags": [], **extra,
+    }
+    storage.create_metadata(item)
+    for user_id, delta in storage.usage_delta([item]).items():
+        storage.update_usage(user_id, **delta)
+    if item["tags"]:
+        storage.index_tags([item])
+    if uploaded is not None:
+        backend.s3.put_object(Bucket=S3_BUCKET, Key=f"images/{image_id}", Body=uploaded)
+    return item
+
+
+def _ids(backend):
+    return sorted(i["image_id"] for i in backend.table("Images").scan()["Items"])
+
+
+def test_reap_deletes_only_old_pending_items_without_objects(backend):
+    _seed(backend, "dead", 7200, tags=["red"])
+    _seed(backend, "uploaded", 7200, uploaded=PNG)
+    _seed(backend, "fresh", 60)
+    _seed(backend, "done", 7200, status="complete")
+    upload_id = backend.s3.create_multipart_upload(Bucket=S3_BUCKET, Key="images/parts")["UploadId"]
+    _seed(backend, "parts", 7200, upload_id=upload_id)
+
+    stats = reaper.reap_pending(older_than=3600, rate=0, page_size=1)
+    assert stats["examined"] == 3 and stats["uploaded"] == stats["settled"] == 1
+    assert stats["dead"] == stats["deleted"] == 2 and stats["failed"] == 0
+    assert _ids(backend) == ["done", "fresh", "uploaded"]
+    assert len(backend.table("ImageTags")) == 0
+    assert backend.s3.list_multipart_uploads(Bucket=S3_BUCKET).get("Uploads", []) == []
+
+
+def test_reap_completes_uploads_whose_client_never_did(backend):
+    _seed(backend, "uploaded", 7200, uploaded=PNG)
+    _seed(backend, "junk", 7200, uploaded=b"not an image")
+    assert storage.get_usage("u1")["pending_count"] == 2
+
+    stats = reaper.reap_pending(older_than=3600, rate=0)
+    assert stats["settled"] == stats["rejected"] == 1 and stats["deleted"] == 1
+    assert _ids(backend) == ["uploaded"]
+    assert storage.get_item("uploaded")["status"] == "complete"
+    assert backend.s3.keys(S3_BUCKET) == ["images/uploaded"]
+    usage = storage.get_usage("u1")
+    assert (usage["image_count"], usage["total_bytes"], usage["pending_count"]) == (1, len(PNG), 0)
+
+
+def test_reap_deletes_variants_of_dead_and_rejected_items(backend):
+    for image_id, uploaded in (("dead", None), ("junk", b"not an image")):
+        key = f"derived/{image_id}/thumb.jpg"
+        backend.s3.put_object(Bucket=S3_BUCKET, Key=key, Body=b"jpeg")
+        _seed(backend, image_id, 7200, uploaded=uploaded, variants={"thumb": key})
+
+    stats = reaper.reap_pending(older_than=3600, rate=0)
+    assert stats["deleted"] == 2 and stats["failed"] == 0
+    assert _ids(backend) == []
+    assert backend.s3.keys(S3_BUCKET) == []
+
+
+def test_reap_skips_multipart_uploads_still_receiving_parts(backend, monkeypatch):
+    for image_id in ("active", "stalled"):
+        upload_id = backend.s3.create_multipart_upload(Bucket=S3_BUCKET, Key=f"images/{image_id}")["UploadId"]
+        backend.s3.upload_part(Bucket=S3_BUCKET, Key=f"images/{image_id}", UploadId=upload_id,
+                               PartNumber=1, Body=b"x")
+        _seed(backend, image_id, 7200, upload_id=upload_id)
+    last_part = storage.last_part_uploaded
+    monkeypatch.setattr(
+        storage, "last_part_uploaded",
+        lambda image_id, upload_id: datetime(2020, 1, 1, tzinfo=timezone.utc) if image_id == "stalled"
+        else last_part(image_id, upload_id),
+    )
+
+    stats = reaper.reap_pending(older_than=3600, rate=0)
+    assert stats["uploading"] == 1 and stats["deleted"] == 1
+    assert _ids(backend) == ["active"]
+    uploads = backend.s3.list_multipart_uploads(Bucket=S3_BUCKET).get("Uploads", [])
+    assert [u["Key"] for u in uploads] == ["images/active"]
+
+
+def test_reap_dry_run_and_max_items(backend):
+    for n in range(5):
+        _seed(backend, f"dead{n}", 7200 + n)
+    stats = reaper.reap_pending(older_than=3600, rate=0, dry_run=True)
+    assert stats["dead"] == 5 and stats["deleted"] == 0
+    assert len(_ids(backend)) == 5
+
+    stats = reaper.reap_pending(older_than=3600, rate=0, max_items=3, page_size=2)
+    assert stats["examined"] == stats["deleted"] == 3 and not stats["complete"]
+    # oldest first
+    assert _ids(backend) == ["dead0", "dead1"]
+
+
+def test_pacer_spaces_batches_to_rate():
+    now, slept = [0.0], []
+
+    def sleep(seconds):
+        slept.append(seconds)
+        now[0] += seconds
+
+    pacer = reaper._Pacer(10, clock=lambda: now[0], sleep=sleep)
+    pacer.wait(5)
+    pacer.wait(5)
+    pacer.wait(20)
+    assert slept == [0.5, 0.5]
+
+
+def test_scheduled_event_stops_at_deadline(backend):
+    for n in range(4):
+        _seed(backend, f"dead{n}", 7200)
+
+    class Context:
+        def get_remaining_time_in_millis(self):
+            return 0  # already inside the safety margin: one batch, then stop
+
+    res = reaper.handle_scheduled_event({"older_than_seconds": 3600}, Context())
+    body = json.loads(res["body"])
+    assert res["statusCode"] == 200
+    assert body["deleted"] >= 1 and not body["complete"]
+
+
+def test_main_exit_code(backend, monkeypatch, capsys):
+    _seed(backend, "dead", 7200)
+    assert reaper.main(["--older-than", "3600", "--rate", "0", "--dry-run"]) == 0
+    assert json.loads(capsys.readouterr().out)["dead"] == 1
+
+    monkeypatch.setattr(storage, "batch_delete_metadata", lambda ids: list(ids))
+    assert reaper.main(["--older-than", "3600", "--rate", "0"]) == 1
+
+    def broken(*args, **kwargs):
+        raise RuntimeError("status index unavailable")
+    monkeypatch.setattr(storage, "iter_pending_pages", broken)
+    assert reaper.main(["--older-than", "3600"]) == 1
@@ -0,0 +1,31 @@
+# tests/test_serialization.py
+import json
+from decimal import Decimal
+
+import pytest
+
+import src.serialization as serialization
+
+
+@pytest.fixture(params=["orjson", "stdlib"])
+def backend(request, monkeypatch):
+    if request.param == "stdlib":
+        monkeypatch.setattr(serialization, "orjson", None)
+    elif serialization.orjson is None:
+        pytest.skip("orjson not installed")
+    return request.param
+
+
+def test_decimals_and_sets_in_one_pass(backend):
+    body = {
+        "items": [{"size": Decimal("12345"), "ratio": Decimal("1.5"), "tags": {"b", "a"}}],
+        "nested": ({"n": Decimal("0")},),
+    }
+    expected = {"items": [{"size": 12345, "ratio": 1.5, "tags": ["a", "b"]}], "nested": [{"n": 0}]}
+    assert json.loads(serialization.dumps(body)) == expected
+    assert json.loads(serialization.dumps_bytes(body)) == expected
+    assert isinstance(json.loads(serialization.dumps(body))["items"][0]["size"], int)
+
+def test_unsupported_types_raise(backend):
+    with pytest.raises(TypeError):
+        serialization.dumps({"x": object()})
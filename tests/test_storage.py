@@ -0,0 +1,748 @@
+# tests/test_storage.py
+import io
+import threading
+
+import pytest
+
+import src.storage as storage
+
+
+INDEX_KEYS = {
+    None: ("image_id",),
+    storage.DDB_USER_INDEX: ("image_id", "user_id", "created_at"),
+    storage.DDB_CONTENT_TYPE_INDEX: ("image_id", "content_type", "created_at"),
+}
+
+
+class PagedTable:
+    """
+    Minimal stand-in for a boto3 Table that serves query/scan pages from a list,
+    honouring Limit and ExclusiveStartKey (FilterExpression is recorded only).
+    """
+    def __init__(self, items, keep=lambda item: True, keys=None):
+        self.items = items
+        self.keep = keep
+        self.keys = keys
+        self.calls = []
+
+    def _page(self, op, **kwargs):
+        self.calls.append((op, kwargs))
+        start = 0
+        if "ExclusiveStartKey" in kwargs:
+            esk = kwargs["ExclusiveStartKey"]
+            start = next(n for n, i in enumerate(self.items) if all(i[k] == v for k, v in esk.items())) + 1
+        evaluated = self.items[start:start + kwargs.get("Limit", len(self.items))]
+        resp = {"Items": [i for i in evaluated if self.keep(i)]}
+        if evaluated and start + len(evaluated) < len(self.items):
+            # like DynamoDB: table key plus the key of the index being read
+            keys = self.keys or INDEX_KEYS[kwargs.get("IndexName")]
+            resp["LastEvaluatedKey"] = {k: evaluated[-1][k] for k in keys}
+        return resp
+
+    def query(self, **kwargs):
+        return self._page("query", **kwargs)
+
+    def scan(self, **kwargs):
+        return self._page("scan", **kwargs)
+
+
+@pytest.fixture(autouse=True)
+def _clear_caches():
+    storage.metadata_cache.clear()
+    storage.presign_cache.clear()
+    yield
+    storage.metadata_cache.clear()
+    storage.presign_cache.clear()
+
+
+def _items(n):
+    return [{"image_id": f"i{n_}", "user_id": "u1", "created_at": f"2025-01-01T00:00:{n_:02d}"} for n_ in range(n)]
+
+
+# -----------------------
+# cursor encoding
+# -----------------------
+def test_cursor_roundtrip():
+    key = {"image_id": "i1", "user_id": "u1", "created_at": "2025-01-01T00:00:00+00:00"}
+    cursor = storage.encode_cursor(key)
+    assert "=" not in cursor
+    assert storage.decode_cursor(cursor) == key
+    assert storage.encode_cursor(None) is None
+    assert storage.decode_cursor(None) is None
+
+@pytest.mark.parametrize("bad", ["not-base64!!", "e30", "WzFd"])  # "{}" and "[1]" decode but are not keys
+def test_decode_cursor_rejects_garbage(bad):
+    with pytest.raises(ValueError):
+        storage.decode_cursor(bad)
+
+@pytest.mark.parametrize("key", [
+    {"image_id": "i1"},  # base-table key on an index listing
+    {"image_id": "i1", "user_id": "u1", "created_at": "2025", "extra": "x"},
+    {"image_id": "i1", "user_id": "u1", "created_at": 5},
+    {"image_id": "i1", "user_id": "u2", "created_at": "2025"},  # someone else's page
+])
+def test_list_items_rejects_foreign_cursor(monkeypatch, key):
+    table = PagedTable(_items(3))
+    monkeypatch.setattr(storage, "table", table)
+    with pytest.raises(ValueError):
+        storage.list_items(user_id="u1", cursor=storage.encode_cursor(key))
+    assert table.calls == []
+
+# -----------------------
+# list_items
+# -----------------------
+def test_list_items_queries_gsi_for_user(monkeypatch):
+    table = PagedTable(_items(5))
+    monkeypatch.setattr(storage, "table", table)
+
+    items, cursor = storage.list_items(user_id="u1", content_type="image/png", limit=2)
+    assert [i["image_id"] for i in items] == ["i0", "i1"]
+    op, kwargs = table.calls[0]
+    assert op == "query"
+    assert kwargs["IndexName"] == storage.DDB_USER_INDEX
+    assert kwargs["ScanIndexForward"] is False
+    assert kwargs["Limit"] == 2
+    assert "FilterExpression" in kwargs
+
+    items, cursor = storage.list_items(user_id="u1", limit=2, cursor=cursor)
+    assert [i["image_id"] for i in items] == ["i2", "i3"]
+    items, cursor = storage.list_items(user_id="u1", limit=2, cursor=cursor)
+    assert [i["image_id"] for i in items] == ["i4"]
+    assert cursor is None
+
+def test_list_items_scans_without_user(monkeypatch):
+    table = PagedTable(_items(3))
+    monkeypatch.setattr(storage, "table", table)
+
+    items, cursor = storage.list_items(limit=10)
+    assert len(items) == 3
+    assert cursor is None
+    op, kwargs = table.calls[0]
+    assert op == "scan"
+    assert "IndexName" not in kwargs
+    assert "FilterExpression" not in kwargs
+
+def test_list_items_refills_filtered_pages(monkeypatch):
+    # only even items match the filter: pages are topped up a full page at a
+    # time, and the cursor points at the last item returned, not the last read
+    table = PagedTable(_items(10), keep=lambda i: int(i["image_id"][1:]) % 2 == 0)
+    monkeypatch.setattr(storage, "table", table)
+
+    items, cursor = storage.list_items(user_id="u1", content_type="image/png", limit=3)
+    assert [i["image_id"] for i in items] == ["i0", "i2", "i4"]
+    assert storage.decode_cursor(cursor) == {"image_id": "i5", "user_id": "u1", "created_at": "2025-01-01T00:00:05"}
+    assert [kw["Limit"] for _, kw in table.calls] == [3, 3]
+
+    items, cursor = storage.list_items(user_id="u1", content_type="image/png", limit=3, cursor=cursor)
+    assert [i["image_id"] for i in items] == ["i6", "i8"]
+    assert cursor is None
+
+def test_list_items_trims_overfull_refill(monkeypatch):
+    table = PagedTable(_items(10), keep=lambda i: i["image_id"] != "i1")
+    monkeypatch.setattr(storage, "table", table)
+
+    items, cursor = storage.list_items(user_id="u1", limit=3)
+    assert [i["image_id"] for i in items] == ["i0", "i2", "i3"]
+    assert storage.decode_cursor(cursor) == {"image_id": "i3", "user_id": "u1", "created_at": "2025-01-01T00:00:03"}
+    items, _ = storage.list_items(user_id="u1", limit=3, cursor=cursor)
+    assert [i["image_id"] for i in items] == ["i4", "i5", "i6"]
+
+def test_list_items_caps_round_trips(monkeypatch):
+    # one match in 100 items: the page comes back short, with a cursor that
+    # resumes after the last item read
+    table = PagedTable(_items(100), keep=lambda i: i["image_id"] == "i95")
+    monkeypatch.setattr(storage, "table", table)
+
+    items, cursor = storage.list_items(user_id="u1", content_type="image/png", limit=5, max_round_trips=3)
+    assert items == [] and len(table.calls) == 3
+    assert storage.decode_cursor(cursor)["image_id"] == "i14"
+    while cursor:
+        items, cursor = storage.list_items(
+            user_id="u1", content_type="image/png", limit=5, cursor=cursor, max_round_trips=3
+        )
+        if items:
+            break
+    assert [i["image_id"] for i in items] == ["i95"]
+
+# -----------------------
+# streaming scan
+# -----------------------
+def test_iter_item_pages_yields_page_by_page(monkeypatch):
+    table = PagedTable(_items(5))
+    monkeypatch.setattr(storage, "table", table)
+
+    pages = storage.iter_item_pages(page_size=2)
+    assert table.calls == []  # lazy: nothing read until iterated
+    assert [i["image_id"] for i in next(pages)] == ["i0", "i1"]
+    assert len(table.calls) == 1
+    assert [len(p) for p in pages] == [2, 1]
+    assert all(kw["Limit"] == 2 for _, kw in table.calls)
+
+def test_iter_items_with_user_uses_query(monkeypatch):
+    table = PagedTable(_items(3))
+    monkeypatch.setattr(storage, "table", table)
+    assert [i["image_id"] for i in storage.iter_items(user_id="u1", page_size=2)] == ["i0", "i1", "i2"]
+    assert {op for op, _ in table.calls} == {"query"}
+
+def test_scan_items_collects_all(monkeypatch):
+    monkeypatch.setattr(storage, "table", PagedTable(_items(7)))
+    assert len(storage.scan_items()) == 7
+
+# -----------------------
+# parallel scan
+# -----------------------
+class SegmentedTable:
+    """
+    Serves Segment/TotalSegments scans by assigning item n to segment n % total.
+    """
+    def __init__(self, n, fail_segment=None):
+        self.items = _items(n)
+        self.fail_segment = fail_segment
+        self.lock = threading.Lock()
+        self.calls = []
+
+    def scan(self, **kwargs):
+        with self.lock:
+            self.calls.append(kwargs)
+        seg, total = kwargs["Segment"], kwargs["TotalSegments"]
+        if seg == self.fail_segment:
+            raise RuntimeError(f"segment {seg} failed")
+        mine = [i for n, i in enumerate(self.items) if n % total == seg]
+        start = 0
+        if "ExclusiveStartKey" in kwargs:
+            start = [i["image_id"] for i in mine].index(kwargs["ExclusiveStartKey"]["image_id"]) + 1
+        page = mine[start:start + kwargs["Limit"]]
+        resp = {"Items": page}
+        if page and start + len(page) < len(mine):
+            resp["LastEvaluatedKey"] = {"image_id": page[-1]["image_id"]}
+        return resp
+
+
+def test_parallel_scan_returns_every_item_once(monkeypatch):
+    table = SegmentedTable(53)
+    monkeypatch.setattr(storage, "table", table)
+
+    items = storage.parallel_scan_items(total_segments=4, max_workers=2, page_size=5)
+    assert sorted(i["image_id"] for i in items) == sorted(i["image_id"] for i in table.items)
+    assert {kw["Segment"] for kw in table.calls} == {0, 1, 2, 3}
+    assert all(kw["TotalSegments"] == 4 and kw["Limit"] == 5 for kw in table.calls)
+
+def test_parallel_scan_propagates_segment_error(monkeypatch):
+    monkeypatch.setattr(storage, "table", SegmentedTable(20, fail_segment=1))
+    with pytest.raises(RuntimeError, match="segment 1 failed"):
+        storage.parallel_scan_items(total_segments=3, page_size=2)
+
+def test_parallel_scan_early_close_stops_workers(monkeypatch):
+    table = SegmentedTable(1000)
+    monkeypatch.setattr(storage, "table", table)
+
+    pages = storage.iter_parallel_scan_pages(total_segments=2, page_size=1)
+    next(pages)
+    pages.close()
+    calls = len(table.calls)
+    assert calls < 1000
+    assert len(table.calls) == calls  # no worker keeps scanning after close
+
+# -----------------------
+# get_item cache
+# -----------------------
+class ItemTable:
+    def __init__(self, items):
+        self.items = {i["image_id"]: i for i in items}
+        self.gets = 0
+
+    def get_item(self, Key):
+        self.gets += 1
+        item = self.items.get(Key["image_id"])
+        return {"Item": dict(item)} if item else {}
+
+    def put_item(self, Item):
+        self.items[Item["image_id"]] = Item
+
+    def delete_item(self, Key):
+        self.items.pop(Key["image_id"], None)
+
+
+def test_get_item_served_from_cache(monkeypatch):
+    table = ItemTable([{"image_id": "i1", "user_id": "u1", "status": "complete"}])
+    monkeypatch.setattr(storage, "table", table)
+
+    first = storage.get_item("i1")
+    first["url"] = "mutated by caller"
+    second = storage.get_item("i1")
+    assert table.gets == 1
+    assert "url" not in second
+    assert storage.metadata_cache.stats()["hits"] == 1
+
+def test_get_item_does_not_cache_pending_items(monkeypatch):
+    # another container may complete the upload; a cached pending item would
+    # keep answering 409 here until the TTL ran out
+    table = ItemTable([{"image_id": "i1", "status": "pending"}])
+    monkeypatch.setattr(storage, "table", table)
+
+    assert storage.get_item("i1")["status"] == "pending"
+    table.items["i1"] = {"image_id": "i1", "status": "complete"}
+    assert storage.get_item("i1")["status"] == "complete"
+    assert table.gets == 2
+    storage.get_item("i1")
+    assert table.gets == 2
+
+def test_get_item_does_not_cache_misses(monkeypatch):
+    table = ItemTable([])
+    monkeypatch.setattr(storage, "table", table)
+    assert storage.get_item("nope") is None
+    table.put_item({"image_id": "nope"})
+    assert storage.get_item("nope") == {"image_id": "nope"}
+
+def test_metadata_writes_and_deletes_invalidate(monkeypatch):
+    table = ItemTable([{"image_id": "i1", "size": 1}])
+    monkeypatch.setattr(storage, "table", table)
+
+    storage.get_item("i1")
+    storage.create_metadata({"image_id": "i1", "size": 2})
+    assert storage.get_item("i1")["size"] == 2
+
+    storage.delete_metadata("i1")
+    assert storage.get_item("i1") is None
+    assert table.gets == 3
+
+# -----------------------
+# presigned GET cache
+# -----------------------
+class CountingS3:
+    def __init__(self):
+        self.signed = 0
+        self.deleted = []
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn, HttpMethod):
+        self.signed += 1
+        return f"http://localstack:4566/{Params['Key']}?sig={self.signed}&exp={ExpiresIn}"
+
+    def delete_object(self, Bucket, Key):
+        self.deleted.append(Key)
+
+
+def test_presigned_get_reused_until_margin(monkeypatch):
+    fake = CountingS3()
+    monkeypatch.setattr(storage, "s3", fake)
+
+    url = storage.generate_presigned_get("i1", expires=300)
+    assert url.startswith("http://localhost:4566/images/i1")
+    assert storage.generate_presigned_get("i1", expires=300) == url
+    assert fake.signed == 1
+
+    # a different lifetime must not reuse a URL signed for another one
+    assert storage.generate_presigned_get("i1", expires=900) != url
+    assert fake.signed == 2
+
+def test_presigned_get_not_cached_inside_margin(monkeypatch):
+    fake = CountingS3()
+    monkeypatch.setattr(storage, "s3", fake)
+    monkeypatch.setattr(storage, "PRESIGNED_GET_REUSE_MARGIN", 60)
+    storage.generate_presigned_get("i1", expires=30)
+    storage.generate_presigned_get("i1", expires=30)
+    assert fake.signed == 2
+
+def test_delete_object_drops_presigned_get(monkeypatch):
+    fake = CountingS3()
+    monkeypatch.setattr(storage, "s3", fake)
+    storage.generate_presigned_get("i1")
+    storage.delete_object("i1")
+    storage.generate_presigned_get("i1")
+    assert fake.deleted == ["images/i1"]
+    assert fake.signed == 2
+
+# -----------------------
+# batch writes
+# -----------------------
+class BatchClient:
+    """
+    Fake low-level client: leaves the last request of each call unprocessed
+    `unprocessed_rounds` times before accepting it.
+    """
+    def __init__(self, unprocessed_rounds=0, fail=False):
+        self.unprocessed_rounds = unprocessed_rounds
+        self.fail = fail
+        self.calls = []
+
+    def batch_write_item(self, RequestItems):
+        (name, reqs), = RequestItems.items()
+        self.calls.append(list(reqs))
+        if self.fail:
+            from botocore.exceptions import ClientError
+            raise ClientError({"Error": {"Code": "ProvisionedThroughputExceededException"}}, "BatchWriteItem")
+        if self.unprocessed_rounds and len(reqs) > 0:
+            self.unprocessed_rounds -= 1
+            return {"UnprocessedItems": {name: reqs[-1:]}}
+        return {"UnprocessedItems": {}}
+
+
+class BatchTable:
+    name = "Images"
+
+    def __init__(self, client):
+        self.meta = type("Meta", (), {"client": client})()
+
+
+def test_batch_create_metadata_chunks_and_retries(monkeypatch):
+    client = BatchClient(unprocessed_rounds=2)
+    monkeypatch.setattr(storage, "table", BatchTable(client))
+    monkeypatch.setattr(storage.time, "sleep", lambda s: None)
+
+    items = [{"image_id": f"i{n}"} for n in range(30)]
+    assert storage.batch_create_metadata(items) == []
+    assert [len(c) for c in client.calls] == [25, 1, 1, 5]
+
+def test_batch_create_metadata_reports_unwritten(monkeypatch):
+    monkeypatch.setattr(storage, "table", BatchTable(BatchClient(unprocessed_rounds=100)))
+    monkeypatch.setattr(storage.time, "sleep", lambda s: None)
+    monkeypatch.setattr(storage, "DDB_BATCH_MAX_RETRIES", 2)
+    assert storage.batch_create_metadata([{"image_id": "a"}, {"image_id": "b"}]) == ["b"]
+
+def test_batch_create_metadata_chunk_error(monkeypatch):
+    monkeypatch.setattr(storage, "table", BatchTable(BatchClient(fail=True)))
+    assert storage.batch_create_metadata([{"image_id": "a"}, {"image_id": "b"}]) == ["a", "b"]
+
+
+class BatchGetClient:
+    def __init__(self, items, unprocessed_rounds=0):
+        self.items = {i["image_id"]: i for i in items}
+        self.unprocessed_rounds = unprocessed_rounds
+        self.calls = []
+
+    def batch_get_item(self, RequestItems):
+        (name, req), = RequestItems.items()
+        keys = req["Keys"]
+        self.calls.append(len(keys))
+        held = []
+        if self.unprocessed_rounds:
+            self.unprocessed_rounds -= 1
+            keys, held = keys[:-1], keys[-1:]
+        resp = {"Responses": {name: [self.items[k["image_id"]] for k in keys if k["image_id"] in self.items]}}
+        if held:
+            resp["UnprocessedKeys"] = {name: {"Keys": held}}
+        return resp
+
+
+def test_batch_get_items_uses_cache_and_retries(monkeypatch):
+    items = [{"image_id": f"i{n}", "status": "complete"} for n in range(150)]
+    items[149]["status"] = "pending"
+    client = BatchGetClient(items, unprocessed_rounds=1)
+    monkeypatch.setattr(storage, "table", BatchTable(client))
+    monkeypatch.setattr(storage.time, "sleep", lambda s: None)
+    storage.metadata_cache.set("i0", {"image_id": "i0", "cached": True})
+
+    ids = [f"i{n}" for n in range(150)] + ["missing"]
+    found, failed = storage.batch_get_items(ids)
+    assert failed == []
+    assert len(found) == 150
+    assert found["i0"]["cached"] is True
+    assert client.calls == [100, 1, 50]
+    # second round: complete items come from the cache, the pending one is re-read
+    storage.batch_get_items(["i1", "i149"])
+    assert client.calls == [100, 1, 50, 1]
+
+def test_batch_delete_metadata_invalidates(monkeypatch):
+    client = BatchClient()
+    monkeypatch.setattr(storage, "table", BatchTable(client))
+    storage.metadata_cache.set("a", {"image_id": "a"})
+    assert storage.batch_delete_metadata(["a", "b"]) == []
+    assert storage.metadata_cache.get("a") is None
+    assert client.calls[0] == [{"DeleteRequest": {"Key": {"image_id": "a"}}}, {"DeleteRequest": {"Key": {"image_id": "b"}}}]
+
+def test_batch_delete_objects_chunks_and_reports_errors(monkeypatch):
+    calls = []
+    class S3:
+        def delete_objects(self, Bucket, Delete):
+            calls.append(len(Delete["Objects"]))
+            assert Delete["Quiet"] is True
+            return {"Errors": [{"Key": "images/i5", "Code": "AccessDenied"}]} if len(calls) == 1 else {}
+    monkeypatch.setattr(storage, "s3", S3())
+    assert storage.batch_delete_objects([f"i{n}" for n in range(2500)]) == ["i5"]
+    assert calls == [1000, 1000, 500]
+
+# -----------------------
+# content_type / tag indexes
+# -----------------------
+def test_list_items_content_type_uses_gsi(monkeypatch):
+    table = PagedTable(_items(3))
+    monkeypatch.setattr(storage, "table", table)
+    items, cursor = storage.list_items(content_type="image/png", limit=5)
+    assert len(items) == 3
+    op, kwargs = table.calls[0]
+    assert op == "query"
+    assert kwargs["IndexName"] == storage.DDB_CONTENT_TYPE_INDEX
+    assert "FilterExpression" not in kwargs
+
+def test_list_items_tag_queries_fanout_and_hydrates(monkeypatch):
+    entries = [{"image_id": f"i{n}", "tag": "t1", "sort_key": f"2025#i{n}"} for n in range(4)]
+    tag_table = PagedTable(entries, keys=("tag", "sort_key"))
+    monkeypatch.setattr(storage, "tag_table", tag_table)
+    hydrated = []
+    def fake_batch_get(ids):
+        hydrated.append(list(ids))
+        # i1 was deleted but its tag entry is still around
+        return {i: {"image_id": i, "filename": f"{i}.png"} for i in ids if i != "i1"}, []
+    monkeypatch.setattr(storage, "batch_get_items", fake_batch_get)
+
+    items, cursor = storage.list_items(tag="t1", content_type="image/png", limit=3)
+    assert [i["filename"] for i in items] == ["i0.png", "i2.png"]
+    assert hydrated == [["i0", "i1", "i2"]]
+    op, kwargs = tag_table.calls[0]
+    assert op == "query"
+    assert "IndexName" not in kwargs
+    assert "FilterExpression" in kwargs
+
+    items, cursor = storage.list_items(tag="t1", limit=3, cursor=cursor)
+    assert [i["image_id"] for i in items] == ["i3"]
+    assert cursor is None
+
+def test_list_items_user_and_tag_reads_the_tag_partition(monkeypatch):
+    entries = [{"image_id": "i0", "tag": "t1", "sort_key": "2025#i0", "user_id": "u1"}]
+    tag_table = PagedTable(entries, keys=("tag", "sort_key"))
+    monkeypatch.setattr(storage, "tag_table", tag_table)
+    monkeypatch.setattr(storage, "table", PagedTable([]))
+    monkeypatch.setattr(storage, "batch_get_items", lambda ids: ({i: {"image_id": i} for i in ids}, []))
+
+    items, _ = storage.list_items(user_id="u1", tag="t1")
+    assert [i["image_id"] for i in items] == ["i0"]
+    assert storage.table.calls == []
+    (op, kwargs), = tag_table.calls
+    assert op == "query" and "FilterExpression" in kwargs  # user_id
+
+def test_list_items_tag_hydration_failure_raises(monkeypatch):
+    monkeypatch.setattr(storage, "tag_table", PagedTable([{"image_id": "i0"}]))
+    monkeypatch.setattr(storage, "batch_get_items", lambda ids: ({}, ["i0"]))
+    with pytest.raises(RuntimeError):
+        storage.list_items(tag="t1")
+
+def test_index_and_unindex_tags(monkeypatch):
+    client = BatchClient()
+    tag_table = BatchTable(client)
+    tag_table.name = "ImageTags"
+    monkeypatch.setattr(storage, "tag_table", tag_table)
+    item = {
+        "image_id": "i1", "user_id": "u1", "content_type": "image/png",
+        "created_at": "2025-01-01T00:00:00+00:00", "tags": ["a", "b", "a"],
+    }
+    assert storage.index_tags([item, dict(item, image_id="i2", tags=[])]) == []
+    puts = [r["PutRequest"]["Item"] for r in client.calls[0]]
+    assert [(p["tag"], p["sort_key"]) for p in puts] == [
+        ("a", "2025-01-01T00:00:00+00:00#i1"),
+        ("b", "2025-01-01T00:00:00+00:00#i1"),
+    ]
+    assert puts[0]["user_id"] == "u1" and puts[0]["content_type"] == "image/png"
+
+    assert storage.unindex_tags([item]) == []
+    assert [r["DeleteRequest"]["Key"]["tag"] for r in client.calls[1]] == ["a", "b"]
+
+def test_index_tags_reports_failures(monkeypatch):
+    tag_table = BatchTable(BatchClient(fail=True))
+    monkeypatch.setattr(storage, "tag_table", tag_table)
+    item = {"image_id": "i1", "user_id": "u1", "content_type": "c", "created_at": "t", "tags": ["a", "b"]}
+    assert storage.index_tags([item]) == ["i1"]
+    assert storage.unindex_tags([item]) == ["i1"]
+
+# -----------------------
+# derivatives support
+# -----------------------
+def test_presigned_get_for_variant_key(monkeypatch):
+    fake = CountingS3()
+    monkeypatch.setattr(storage, "s3", fake)
+    original = storage.generate_presigned_get("i1")
+    thumb = storage.generate_presigned_get("i1", key="derived/i1/thumb.jpg")
+    assert "derived/i1/thumb.jpg" in thumb and original != thumb
+    assert storage.generate_presigned_get("i1", key="derived/i1/thumb.jpg") == thumb
+    assert fake.signed == 2
+
+def test_set_variants_conditional_update(monkeypatch):
+    calls = []
+    class Table:
+        def update_item(self, **kwargs):
+            calls.append(kwargs)
+    monkeypatch.setattr(storage, "table", Table())
+    storage.metadata_cache.set("i1", {"image_id": "i1"})
+    storage.set_variants("i1", {"thumb": "derived/i1/thumb.jpg"})
+    assert calls[0]["ConditionExpression"] == "attribute_exists(image_id)"
+    assert calls[0]["ExpressionAttributeValues"][":v"] == {"thumb": "derived/i1/thumb.jpg"}
+    assert "updated_at = :now" in calls[0]["UpdateExpression"]  # new ETag for get_image
+    assert storage.metadata_cache.get("i1") is None
+
+def test_clear_upload_id_stamps_updated_at(monkeypatch):
+    calls = []
+    class Table:
+        def update_item(self, **kwargs):
+            calls.append(kwargs)
+    monkeypatch.setattr(storage, "table", Table())
+    storage.clear_upload_id("i1")
+    assert calls[0]["UpdateExpression"] == "SET updated_at = :now REMOVE upload_id"
+    assert ":now" in calls[0]["ExpressionAttributeValues"]
+
+# -----------------------
+# streaming object reads
+# -----------------------
+class TrickleBody(io.RawIOBase):
+    """Body that returns at most `step` bytes per readinto, like a socket."""
+    def __init__(self, data, step=7):
+        self.data = data
+        self.pos = 0
+        self.step = step
+        self.closed_called = False
+
+    def readinto(self, b):
+        n = min(len(b), self.step, len(self.data) - self.pos)
+        b[:n] = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+    def close(self):
+        self.closed_called = True
+
+
+def test_iter_object_chunks_reuses_one_buffer(monkeypatch):
+    data = bytes(range(256)) * 3
+    body = TrickleBody(data)
+    class S3:
+        def get_object(self, Bucket, Key):
+            return {"Body": body}
+    monkeypatch.setattr(storage, "s3", S3())
+
+    seen, buffers = [], set()
+    for chunk in storage.iter_object_chunks("images/i1", chunk_size=100):
+        assert isinstance(chunk, memoryview)
+        buffers.add(id(chunk.obj))
+        seen.append(bytes(chunk))
+    assert b"".join(seen) == data
+    assert [len(c) for c in seen] == [100] * 7 + [68]
+    assert len(buffers) == 1
+    assert body.closed_called
+
+def test_iter_object_chunks_without_readinto(monkeypatch):
+    # StreamingBody before botocore 1.39 only has read()
+    class OldBody:
+        def __init__(self, data):
+            self.raw = io.BytesIO(data)
+            self.closed_called = False
+        def read(self, amt=None):
+            return self.raw.read(amt)
+        def close(self):
+            self.closed_called = True
+    data = bytes(range(256))
+    body = OldBody(data)
+    class S3:
+        def get_object(self, Bucket, Key):
+            return {"Body": body}
+    monkeypatch.setattr(storage, "s3", S3())
+    chunks = [bytes(c) for c in storage.iter_object_chunks("images/i1", chunk_size=100)]
+    assert chunks == [data[:100], data[100:200], data[200:]]
+    assert body.closed_called
+
+def test_inspect_object_hash_and_sniff(monkeypatch):
+    import hashlib
+    data = b"\x89PNG\r\n\x1a\n" + b"x" * 5000
+    class S3:
+        def get_object(self, Bucket, Key):
+            return {"Body": TrickleBody(data, step=3)}
+    monkeypatch.setattr(storage, "s3", S3())
+    info = storage.inspect_object("i1", chunk_size=10)
+    assert info == {
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "size": len(data),
+        "detected_content_type": "image/png",
+    }
+
+# -----------------------
+# multipart uploads
+# -----------------------
+MIB = 1024 * 1024
+
+@pytest.mark.parametrize("size,min_part,expected", [
+    (1, 8 * MIB, 8 * MIB),
+    (100 * MIB, 8 * MIB, 8 * MIB),
+    (200 * 1024 * MIB, 8 * MIB, 21 * MIB),  # 200 GiB must fit in 10000 parts
+    (10 * MIB, 5 * MIB + 1, 6 * MIB),
+])
+def test_multipart_part_size(size, min_part, expected):
+    part = storage.multipart_part_size(size, min_part)
+    assert part == expected
+    assert -(-size // part) <= storage.S3_MAX_PARTS
+
+def test_list_uploaded_parts_paginates(monkeypatch):
+    pages = [
+        {"Parts": [{"PartNumber": 1, "ETag": "a", "Size": 5}], "IsTruncated": True, "NextPartNumberMarker": 1},
+        {"Parts": [{"PartNumber": 2, "ETag": "b", "Size": 5}], "IsTruncated": False},
+    ]
+    calls = []
+    class S3:
+        def list_parts(self, **kwargs):
+            calls.append(kwargs)
+            return pages[len(calls) - 1]
+    monkeypatch.setattr(storage, "s3", S3())
+    assert storage.list_uploaded_parts("i1", "up") == [{"PartNumber": 1, "ETag": "a"}, {"PartNumber": 2, "ETag": "b"}]
+    assert calls[1]["PartNumberMarker"] == 1
+
+def test_abort_stale_multipart_uploads(monkeypatch):
+    from datetime import datetime, timedelta, timezone
+    now = datetime.now(timezone.utc)
+    aborted = []
+    class S3:
+        def list_multipart_uploads(self, **kwargs):
+            return {"Uploads": [
+                {"Key": "images/old", "UploadId": "u1", "Initiated": now - timedelta(days=2)},
+                {"Key": "images/new", "UploadId": "u2", "Initiated": now - timedelta(minutes=5)},
+            ], "IsTruncated": False}
+        def abort_multipart_upload(self, Bucket, Key, UploadId):
+            aborted.append((Key, UploadId))
+    monkeypatch.setattr(storage, "s3", S3())
+    assert storage.abort_stale_multipart_uploads(24 * 3600) == ["images/old"]
+    assert aborted == [("images/old", "u1")]
+
+# -----------------------
+# content-hash dedup
+# -----------------------
+def _conditional_failure():
+    from botocore.exceptions import ClientError
+    return ClientError({"Error": {"Code": "ConditionalCheckFailedException"}}, "Op")
+
+class ContentTable:
+    """Just enough of the conditional semantics used by the refcount helpers."""
+    def __init__(self):
+        self.items = {}
+    def put_item(self, Item, ConditionExpression):
+        if Item["sha256"] in self.items:
+            raise _conditional_failure()
+        self.items[Item["sha256"]] = dict(Item)
+    def update_item(self, Key, ExpressionAttributeValues, ConditionExpression, ReturnValues, **kwargs):
+        item = self.items.get(Key["sha256"])
+        values = ExpressionAttributeValues
+        if item is None or ("refcount > :zero" in ConditionExpression and item["refcount"] <= 0):
+            raise _conditional_failure()
+        if ":size" in values and item["size"] != values[":size"]:
+            raise _conditional_failure()
+        item["refcount"] += values.get(":one", values.get(":minus"))
+        return {"Attributes": dict(item)}
+    def delete_item(self, Key, ConditionExpression, ExpressionAttributeValues):
+        if self.items[Key["sha256"]]["refcount"] > 0:
+            raise _conditional_failure()
+        del self.items[Key["sha256"]]
+
+def test_content_refcount_lifecycle(monkeypatch):
+    fake = ContentTable()
+    monkeypatch.setattr(storage, "content_table", fake)
+    assert storage.register_content("h", "images/a", 10, "image/png") is True
+    assert storage.register_content("h", "images/b", 10, "image/png") is False
+
+    assert storage.acquire_content("h", size=11) is None
+    assert storage.acquire_content("h", size=10)["object_key"] == "images/a"
+    assert fake.items["h"]["refcount"] == 2
+
+    assert storage.release_content("h") is None
+    # last reference: record removed and the key handed back for deletion
+    assert storage.release_content("h") == "images/a"
+    assert fake.items == {}
+    assert storage.acquire_content("h") is None
+    assert storage.release_content("h") is None
+
+def test_object_key_prefers_shared_object():
+    assert storage.object_key({"image_id": "a"}) == "images/a"
+    assert storage.object_key({"image_id": "a", "object_key": "images/b"}) == "images/b"
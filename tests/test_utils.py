@@ -0,0 +1,19 @@
+# tests/test_utils.py
+import pytest
+
+from src.utils import sniff_image_type
+
+
+@pytest.mark.parametrize("header,expected", [
+    (b"\xff\xd8\xff\xe0\x00\x10JFIF", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n\x00\x00", "image/png"),
+    (b"GIF89a\x01\x00", "image/gif"),
+    (b"RIFF\x24\x00\x00\x00WEBPVP8 ", "image/webp"),
+    (b"\x00\x00\x00\x1cftypavif", "image/avif"),
+    (b"\x00\x00\x00\x18ftypheic", "image/heic"),
+    (b"II*\x00\x08\x00", "image/tiff"),
+    (b"%PDF-1.7", None),
+    (b"", None),
+])
+def test_sniff_image_type(header, expected):
+    assert sniff_image_type(header) == expected